@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+from timeit import default_timer as timer
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mmu import MMU
+from cpu import CPU
+import alu_tables
+
+# Table build/load cost against the per-call saving of each table helper
+HELPERS = [
+    ('add_8', (0x3A, 0xC6, True)),
+    ('sub_8', (0x3A, 0xC6, True)),
+    ('and_8', (0x3A, 0xC6)),
+    ('xor_8', (0x3A, 0xC6)),
+    ('inc_8', (0x3F,)),
+    ('dec_8', (0x40,)),
+    ('rl_8', (0x81,)),
+    ('rr_8', (0x81,)),
+    ('swap_8', (0x3A,)),
+    ('daa_8', (0x9A,)),
+]
+
+
+def per_call(fn, args, number=100000):
+    return min(timeit.repeat(lambda: fn(*args), number=number, repeat=3)) / number
+
+
+if __name__ == '__main__':
+    start = timer()
+    tables = alu_tables.build_tables()
+    build_time = timer() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'alu_tables.bin')
+        alu_tables.save_tables(tables, path)
+        start = timer()
+        alu_tables.load_tables(path)
+        load_time = timer() - start
+
+    print('build: %.1f ms, load from cache: %.1f ms' % (build_time * 1e3, load_time * 1e3))
+
+    eager = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+    table = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), alu_tables=tables)
+
+    saved = []
+    for name, args in HELPERS:
+        t_eager = per_call(getattr(eager, name), args)
+        t_table = per_call(getattr(table, name), args)
+        saved.append(t_eager - t_table)
+        print('%-7s eager %6.0f ns  table %6.0f ns' % (name, t_eager * 1e9, t_table * 1e9))
+
+    mean_saved = sum(saved) / len(saved)
+    print('build time pays for itself after %.0f ALU ops' % (build_time / mean_saved))
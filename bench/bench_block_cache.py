@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from cartridge import load_rom
+from cpu import CPU
+from mmu import MMU
+from translator import cache_path
+
+# Start-up cost of the block translator, cold (translating everything) and
+# warm (loading the block cache written by the cold run), as seen by a
+# short-lived process: time to build the CPU and run a number of cycles.
+# Runs a generated ROM of many distinct blocks unless given a ROM.
+
+# Register-only instructions for the generated blocks: LD r, r', LD r, n,
+# 8-bit ALU on registers and immediates, INC/DEC r, and a few CB ops
+REGISTER_OPS = [op for op in range(0x40, 0x80) if op & 0x07 != 0x06 and op & 0x38 != 0x30] + \
+               [op for op in range(0x80, 0xC0) if op & 0x07 != 0x06]
+IMMEDIATE_OPS = [0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E, 0x3E,
+                 0xC6, 0xCE, 0xD6, 0xDE, 0xE6, 0xEE, 0xF6, 0xFE]
+INC_DEC_OPS = [0x04, 0x05, 0x0C, 0x0D, 0x14, 0x15, 0x1C, 0x1D, 0x24, 0x25, 0x2C, 0x2D, 0x3C, 0x3D]
+CB_OPS = [op for op in range(0x40) if op & 0x07 != 0x06]    # rotates, shifts, SWAP
+
+
+def many_blocks_rom(blocks, length=24, seed=1):
+    # blocks runs of length random instructions, each ending in a jump to
+    # the next, the last one back to the first
+    rng = random.Random(seed)
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    code = []
+    for i in range(blocks):
+        for _ in range(length):
+            kind = rng.random()
+            if kind < 0.6:
+                code.append(rng.choice(REGISTER_OPS))
+            elif kind < 0.8:
+                code += [rng.choice(IMMEDIATE_OPS), rng.randrange(0x100)]
+            elif kind < 0.95:
+                code.append(rng.choice(INC_DEC_OPS))
+            else:
+                code += [0xCB, rng.choice(CB_OPS)]
+        target = 0x0150 + len(code) + 3 if i < blocks - 1 else 0x0150
+        code += [0xC3, target & 0xFF, target >> 8]
+    if 0x0150 + len(code) > 0x4000:
+        raise ValueError('Too many blocks for ROM bank 0: %d' % blocks)
+    rom_file[0x0100:0x0103] = [0xC3, 0x50, 0x01]
+    rom_file[0x0150:0x0150 + len(code)] = code
+    return rom_file
+
+
+def start_up(rom_file, cycles, path):
+    # Seconds to create a translating CPU, load the cache and run cycles
+    start = timer()
+    cpu = CPU(MMU(rom_file), translate=True)
+    cpu.translator.load_cache(path)
+    cpu.run_cycles(cycles)
+    return timer() - start, cpu.translator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rom', nargs='?')
+    parser.add_argument('--blocks', type=int, default=400)
+    parser.add_argument('--cycles', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rom_file = load_rom(args.rom) if args.rom else many_blocks_rom(args.blocks)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cold_best = warm_best = None
+        for _ in range(args.repeat):
+            path = cache_path(directory, rom_file, True)
+            if os.path.exists(path):
+                os.remove(path)
+            cold, translator = start_up(rom_file, args.cycles, path)
+            translator.save_cache(path)
+            warm, warm_translator = start_up(rom_file, args.cycles, path)
+            cold_best = cold if cold_best is None else min(cold, cold_best)
+            warm_best = warm if warm_best is None else min(warm, warm_best)
+
+        print('%d blocks translated cold, %d loaded warm (cache %d bytes)'
+              % (translator.translated, warm_translator.cache_hits, os.path.getsize(path)))
+        print('cold start    %.1f ms' % (cold_best * 1000))
+        print('warm start    %.1f ms (%.1fx)' % (warm_best * 1000, cold_best / warm_best))
@@ -0,0 +1,124 @@
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mmu import MMU
+from cpu import CPU
+import alu_tables
+
+# Fixed instruction mix: loads, 8-bit ALU, CB-prefixed ops, stack, calls and
+# jumps, looping forever over a small buffer in work RAM.
+MIX_PROGRAM = {
+    0x0100: [0xC3, 0x50, 0x01],         # JP 0x0150
+    0x0150: [0x31, 0xFE, 0xFF,          # LD SP, 0xFFFE
+             0x21, 0x00, 0xC0,          # LD HL, 0xC000   <-- outer loop
+             0x11, 0x00, 0xC1,          # LD DE, 0xC100
+             0x06, 0x40,                # LD B, 0x40
+             0x2A,                      # LDI A, (HL)     <-- inner loop
+             0x80,                      # ADD A, B
+             0x12,                      # LD (DE), A
+             0x1C,                      # INC E
+             0xA9,                      # XOR C
+             0xFE, 0x40,                # CP 0x40
+             0xCD, 0x00, 0x02,          # CALL 0x0200
+             0xC5,                      # PUSH BC
+             0xC1,                      # POP BC
+             0xCB, 0x37,                # SWAP A
+             0xCB, 0x7C,                # BIT 7, H
+             0x05,                      # DEC B
+             0xC2, 0x5B, 0x01,          # JP NZ, 0x015B
+             0xC3, 0x53, 0x01],         # JP 0x0153
+    0x0200: [0x0C,                      # INC C
+             0xC9],                     # RET
+}
+
+
+def build_rom():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    for addr, code in MIX_PROGRAM.items():
+        rom_file[addr:addr + len(code)] = code
+    return rom_file
+
+
+def bench_ips(instructions=50000, repeat=3, flat_memory=False, **cpu_args):
+    best = None
+    for _ in range(repeat):
+        cpu = CPU(MMU(build_rom(), flat_memory=flat_memory), **cpu_args)
+        start = timer()
+        for _ in range(instructions):
+            cpu.tick()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return instructions / best
+
+
+def bench_cycles(cycles=200000, repeat=3, batch=False, flat_memory=False, cpu_class=CPU, **cpu_args):
+    # Emulated clock cycles per second, driving the CPU with tick() or with
+    # a single run_cycles() call
+    best = None
+    for _ in range(repeat):
+        cpu = cpu_class(MMU(build_rom(), flat_memory=flat_memory), **cpu_args)
+        start = timer()
+        if batch:
+            cpu.run_cycles(cycles)
+        else:
+            tick = cpu.tick
+            while cpu.cycles < cycles:
+                tick()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return cpu.cycles / best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('instructions', type=int, nargs='?', default=50000)
+    parser.add_argument('--lazy-flags', action='store_true')
+    parser.add_argument('--alu-tables', action='store_true')
+    parser.add_argument('--flat-memory', action='store_true')
+    parser.add_argument('--batch', action='store_true',
+                        help='also compare tick() against run_cycles()')
+    parser.add_argument('--translate', action='store_true',
+                        help='also compare run_cycles() interpreted and translated')
+    parser.add_argument('--fusions', action='store_true',
+                        help='also compare run_cycles() without and with fused opcode pairs')
+    parser.add_argument('--numba', action='store_true',
+                        help='also compare run_cycles() on the python and numba CPU backends')
+    args = parser.parse_args()
+
+    tables = alu_tables.build_tables() if args.alu_tables else None
+    cpu_args = dict(lazy_flags=args.lazy_flags, alu_tables=tables, flat_memory=args.flat_memory)
+
+    print('%.0f instructions/s' % bench_ips(args.instructions, **cpu_args))
+
+    if args.batch:
+        for batch, name in ((False, 'tick()'), (True, 'run_cycles()')):
+            rate = bench_cycles(batch=batch, **cpu_args)
+            print('%-13s %.0f cycles/s (%.1f%% of realtime)' % (name, rate, rate / 4194304 * 100))
+
+    if args.translate:
+        for translate, name in ((False, 'interpreted'), (True, 'translated')):
+            rate = bench_cycles(cycles=1000000, batch=True, translate=translate, **cpu_args)
+            print('%-13s %.0f cycles/s (%.1f%% of realtime)' % (name, rate, rate / 4194304 * 100))
+
+    if args.fusions:
+        for fusions, name in ((None, 'unfused'), (True, 'fused')):
+            rate = bench_cycles(cycles=1000000, batch=True, fusions=fusions, **cpu_args)
+            print('%-13s %.0f cycles/s (%.1f%% of realtime)' % (name, rate, rate / 4194304 * 100))
+
+    if args.numba:
+        from numba_cpu import BACKENDS, HAVE_NUMBA
+        if not HAVE_NUMBA:
+            parser.error('--numba needs numba, which is not installed')
+        # The first call compiles the core (or loads it from numba's cache)
+        bench_cycles(cycles=100, repeat=1, batch=True, cpu_class=BACKENDS['numba'])
+        for name in ('python', 'numba'):
+            rate = bench_cycles(cycles=4000000, batch=True, cpu_class=BACKENDS[name], **cpu_args)
+            print('%-13s %.0f cycles/s (%.1f%% of realtime)' % (name, rate, rate / 4194304 * 100))
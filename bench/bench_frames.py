@@ -0,0 +1,112 @@
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bench_cpu import build_rom
+from cartridge import load_rom
+from cpu import CPU
+from gameboy import GameBoy
+from mmu import MMU
+from pacing import FRAME_RATE
+from ppu import CYCLES_PER_FRAME
+import alu_tables
+
+# Emulated frames per wall-clock second for the whole machine (CPU, PPU,
+# timer, DMA and serial on the scheduler), against the CPU alone running
+# the same number of cycles per frame.  Runs bench_cpu's instruction mix,
+# or a built-in workload, unless given a ROM.
+
+# Some work each frame (255 turns of DEC B / JP NZ, about 5100 cycles), then
+# waiting for the next V-Blank either in HALT or by polling LY
+FRAME_LOOP = [0x3E, 0x01,               # LD A, 0x01
+              0xE0, 0xFF,               # LDH (0xFF), A - enable V-Blank only
+              0xFB,                     # EI
+              0x06, 0xFF,               # LD B, 0xFF       <-- frame loop
+              0x05,                     # DEC B            <-- work
+              0xC2, 0x07, 0x01]         # JP NZ, work
+WAIT_HALT = [0x76,                      # HALT
+             0xC3, 0x05, 0x01]          # JP frame loop
+WAIT_POLL = [0xF0, 0x44,                # LDH A, (0x44)    <-- poll
+             0xFE, 0x90,                # CP 144
+             0xC2, 0x0B, 0x01,          # JP NZ, poll
+             0xF0, 0x44,                # LDH A, (0x44)    <-- rest of V-Blank
+             0xFE, 0x90,                # CP 144
+             0xCA, 0x12, 0x01,          # JP Z, rest of V-Blank
+             0xC3, 0x05, 0x01]          # JP frame loop
+
+
+def frame_loop_rom(wait):
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0040] = 0xD9             # RETI
+    code = FRAME_LOOP + wait
+    rom_file[0x0100:0x0100 + len(code)] = code
+    return rom_file
+
+
+WORKLOADS = {
+    'mix': build_rom,
+    'halt': lambda: frame_loop_rom(WAIT_HALT),
+    'poll': lambda: frame_loop_rom(WAIT_POLL)
+}
+
+
+def bench_machine(rom_file, frames, **cpu_args):
+    gameboy = GameBoy(rom_file, **cpu_args)
+    start = timer()
+    for _ in range(frames):
+        gameboy.run_frame()
+    elapsed = timer() - start
+
+    cpu = gameboy.cpu
+    idle = (cpu.idle_cycles + cpu.skipped_cycles) / cpu.cycles * 100
+    return frames / elapsed, idle
+
+
+def bench_cpu_only(rom_file, frames, cpu_backend='python', **cpu_args):
+    if cpu_backend == 'python':
+        cpu = CPU(MMU(rom_file), **cpu_args)
+    else:
+        from numba_cpu import BACKENDS
+        cpu = BACKENDS[cpu_backend](MMU(rom_file), **cpu_args)
+    start = timer()
+    for _ in range(frames):
+        cpu.run_cycles(CYCLES_PER_FRAME)
+    elapsed = timer() - start
+
+    idle = (cpu.idle_cycles + cpu.skipped_cycles) / cpu.cycles * 100
+    return frames / elapsed, idle
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rom', nargs='?')
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='mix',
+                        help='built-in program to run when no ROM is given')
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--lazy-flags', action='store_true')
+    parser.add_argument('--alu-tables', action='store_true')
+    parser.add_argument('--no-idle-loops', action='store_true')
+    parser.add_argument('--translate', action='store_true')
+    parser.add_argument('--fusions', action='store_true')
+    parser.add_argument('--cpu-backend', choices=['python', 'numba'], default='python')
+    args = parser.parse_args()
+
+    rom_file = load_rom(args.rom) if args.rom else WORKLOADS[args.workload]()
+    cpu_args = dict(lazy_flags=args.lazy_flags,
+                    alu_tables=alu_tables.build_tables() if args.alu_tables else None,
+                    idle_loops=not args.no_idle_loops, translate=args.translate,
+                    fusions=args.fusions or None, cpu_backend=args.cpu_backend)
+
+    if args.cpu_backend != 'python':
+        # The first run compiles the core (or loads it from numba's cache)
+        bench_cpu_only(rom_file, 1, **cpu_args)
+
+    for name, bench in (('cpu only', bench_cpu_only), ('full machine', bench_machine)):
+        fps, idle = bench(rom_file, args.frames, **cpu_args)
+        print('%-13s %.1f frames/s (%.1f%% of realtime), %.1f%% of cycles halted or skipped'
+              % (name, fps, fps / FRAME_RATE * 100, idle))
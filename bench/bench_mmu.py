@@ -0,0 +1,126 @@
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mmu import MMU
+from exceptions.memory_access_error import MemoryAccessError
+
+
+class ChainMMU(MMU):
+    # The previous range-comparison dispatch, kept here for comparison only.
+    # Only the regions the access patterns below touch are needed.
+    def get(self, addr):
+        if addr >= 0x0000 and addr <= 0x3FFF:
+            return self.ROM[addr]
+        elif addr >= 0x4000 and addr <= 0x7FFF:
+            return self.ROM[addr]
+        elif addr >= 0x8000 and addr <= 0x97FF:
+            return self.CHAR_RAM[addr - 0x8000]
+        elif addr >= 0x9800 and addr <= 0x9BFF:
+            return self.BG_MAP_1[addr - 0x9800]
+        elif addr >= 0x9C00 and addr <= 0x9FFF:
+            return self.BG_MAP_2[addr - 0x9C00]
+        elif addr >= 0xA000 and addr <= 0xBFFF:
+            return self.EXT_RAM[addr - 0xA000]
+        elif addr >= 0xC000 and addr <= 0xDFFF:
+            return self.WORK_RAM[addr - 0xC000]
+        elif addr >= 0xE000 and addr <= 0xFDFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0xFE00 and addr <= 0xFE9F:
+            return self.OAM[addr - 0xFE00]
+        elif addr >= 0xFEA0 and addr <= 0xFEFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0xFF00 and addr <= 0xFF7F:
+            return self.HW_REGS_TEMP[addr - 0xFF00]
+        elif addr >= 0xFF80 and addr <= 0xFFFE:
+            return self.HIGH_RAM[addr - 0xFF80]
+        elif addr == 0xFFFF:
+            return self.INTERRUPT
+        else:
+            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
+
+    def set(self, addr, val):
+        if addr >= 0x0000 and addr <= 0x3FFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0x4000 and addr <= 0x7FFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0x8000 and addr <= 0x97FF:
+            self.CHAR_RAM[addr - 0x8000] = val
+        elif addr >= 0x9800 and addr <= 0x9BFF:
+            self.BG_MAP_1[addr - 0x9800] = val
+        elif addr >= 0x9C00 and addr <= 0x9FFF:
+            self.BG_MAP_2[addr - 0x9C00] = val
+        elif addr >= 0xA000 and addr <= 0xBFFF:
+            self.EXT_RAM[addr - 0xA000] = val
+        elif addr >= 0xC000 and addr <= 0xDFFF:
+            self.WORK_RAM[addr - 0xC000] = val
+        elif addr >= 0xE000 and addr <= 0xFDFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0xFE00 and addr <= 0xFE9F:
+            self.OAM[addr - 0xFE00] = val
+        elif addr >= 0xFEA0 and addr <= 0xFEFF:
+            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        elif addr >= 0xFF00 and addr <= 0xFF7F:
+            self.HW_REGS_TEMP[addr - 0xFF00] = val
+        elif addr >= 0xFF80 and addr <= 0xFFFE:
+            self.HIGH_RAM[addr - 0xFF80] = val
+        elif addr == 0xFFFF:
+            self.INTERRUPT = val
+        else:
+            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
+
+
+# Each pattern is a list of (addr, val) pairs; val None means a read
+def fetch_heavy():
+    # Sequential opcode fetches through both ROM banks
+    return [(addr, None) for addr in range(0x0100, 0x0100 + 0x1000)] + \
+           [(addr, None) for addr in range(0x4000, 0x4000 + 0x1000)]
+
+def stack_heavy():
+    # PUSH/POP pairs just below the top of high RAM and in work RAM
+    pattern = []
+    for sp in list(range(0xFFFE, 0xFF90, -2)) + list(range(0xDFFE, 0xDF00, -2)):
+        pattern += [(sp - 1, 0x12), (sp - 2, 0x34), (sp - 2, None), (sp - 1, None)]
+    return pattern * 8
+
+def vram_heavy():
+    # Tile data and BG map writes with a read-back, as a VRAM copy loop does
+    pattern = []
+    for addr in list(range(0x8000, 0x8800)) + list(range(0x9800, 0x9C00)):
+        pattern += [(addr, addr & 0xFF), (addr, None)]
+    return pattern
+
+PATTERNS = [('fetch-heavy', fetch_heavy), ('stack-heavy', stack_heavy), ('vram-heavy', vram_heavy)]
+
+
+def run(mmu, pattern):
+    get = mmu.get
+    set = mmu.set
+    for addr, val in pattern:
+        if val is None:
+            get(addr)
+        else:
+            set(addr, val)
+
+
+def per_access(mmu, pattern, repeat=5):
+    return min(timeit.repeat(lambda: run(mmu, pattern), number=1, repeat=repeat)) / len(pattern)
+
+
+if __name__ == '__main__':
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    chain = ChainMMU(rom_file)
+    paged = MMU(rom_file)
+    flat = MMU(rom_file, flat_memory=True)
+
+    for name, build in PATTERNS:
+        pattern = build()
+        t_chain = per_access(chain, pattern)
+        t_paged = per_access(paged, pattern)
+        t_flat = per_access(flat, pattern)
+        print('%-12s chain %6.0f ns  paged %6.0f ns  flat %6.0f ns'
+              % (name, t_chain * 1e9, t_paged * 1e9, t_flat * 1e9))
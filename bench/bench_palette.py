@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from palette import PaletteLUT, PALETTES, SHADES
+
+# Cost of turning a 160x144 framebuffer into pygame's RGB layout
+
+
+def allocating_convert(framebuffer, line_palettes):
+    # Apply the palettes and shades with fresh arrays every frame
+    registers = np.concatenate((line_palettes[0], [0xE4]))
+    shades = PALETTES[registers[framebuffer >> 2], framebuffer & 0x03]
+    return SHADES[shades].transpose(1, 0, 2).copy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('frames', type=int, nargs='?', default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    framebuffer = rng.integers(0, 12, (144, 160), dtype=np.uint8)
+    static = np.zeros((144, 3), dtype=np.uint8)
+    static[:] = (0xE4, 0xD2, 0x1B)
+    changing = static.copy()
+    changing[72:, 0] = 0x1B
+
+    lut = PaletteLUT(160, 144)
+    for name, fn in (('allocating', lambda: allocating_convert(framebuffer, static)),
+                     ('lut', lambda: lut.convert(framebuffer, static)),
+                     ('lut, mid-frame change', lambda: lut.convert(framebuffer, changing))):
+        per_frame = min(timeit.repeat(fn, number=args.frames, repeat=3)) / args.frames
+        print('%-22s %.1f us/frame' % (name, per_frame * 1e6))
+    print('LUT rebuilds: %d' % lut.rebuilds)
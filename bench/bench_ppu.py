@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mmu import MMU
+import ppu
+from ppu import PPU
+
+# Full frame render time with random tile data and maps, the window on and
+# all 40 sprites on screen (so most lines hit the ten sprite limit)
+
+
+def busy_mmu(lcdc):
+    rng = np.random.default_rng(0)
+    mmu = MMU(np.zeros(0x8000, dtype=np.uint8))
+    mmu.CHAR_RAM[:] = rng.integers(0, 0x100, len(mmu.CHAR_RAM))
+    mmu.BG_MAP_1[:] = rng.integers(0, 0x100, len(mmu.BG_MAP_1))
+    mmu.BG_MAP_2[:] = rng.integers(0, 0x100, len(mmu.BG_MAP_2))
+    mmu.OAM[:160] = rng.integers(0, 0x100, 160)
+    mmu.OAM[0:160:4] = rng.integers(16, 160, 40)
+    mmu.OAM[1:160:4] = rng.integers(8, 168, 40)
+
+    for reg, val in ((ppu.LCDC, lcdc), (ppu.SCX, 0x35), (ppu.SCY, 0xC9), (ppu.WX, 0x30),
+                     (ppu.WY, 0x40), (ppu.BGP, 0xE4), (ppu.OBP0, 0x1B), (ppu.OBP1, 0x93)):
+        mmu.set(reg, val)
+    return mmu
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('frames', type=int, nargs='?', default=100)
+    args = parser.parse_args()
+
+    for name, lcdc in (('bg only', 0x91), ('bg+window', 0xF1), ('bg+window+sprites', 0xF3)):
+        renderer = PPU(busy_mmu(lcdc))
+        per_frame = min(timeit.repeat(renderer.render_frame, number=args.frames, repeat=3)) / args.frames
+        print('%-18s %.2f ms/frame' % (name, per_frame * 1e3))
+
+    # Re-decode cost when a game streams a few tiles in every frame
+    renderer = PPU(busy_mmu(0xF3))
+    mmu = renderer.mmu
+
+    def streaming_frame():
+        for addr in range(0x8000, 0x8000 + 16 * 8):
+            mmu.set(addr, addr & 0xFF)
+        renderer.render_frame()
+
+    per_frame = min(timeit.repeat(streaming_frame, number=args.frames, repeat=3)) / args.frames
+    cache = renderer.tile_cache
+    print('%-18s %.2f ms/frame  (tile cache hits %d, misses %d, redecodes %d)'
+          % ('8 tiles/frame', per_frame * 1e3, cache.hits, cache.misses, cache.redecodes))
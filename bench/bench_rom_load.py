@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mmu import MMU
+import cartridge
+
+# Startup time and memory of many emulator processes loading the same ROM,
+# with the old read-into-bytes loader against the mmap loader.  Every child
+# loads the ROM, builds an MMU and touches every page of it, then waits until
+# all children have done so before reading its memory counters, so shared
+# pages are shared at the time of measurement.
+
+
+def read_rom(filepath):
+    # The loader before mmap
+    fh = open(filepath, 'rb')
+    data = fh.read()
+    return data
+
+
+def memory_stats():
+    # kB; Pss splits shared pages between the processes mapping them
+    stats = {}
+    try:
+        with open('/proc/self/smaps_rollup') as fh:
+            for line in fh:
+                fields = line.split()
+                if fields[0] in ('Rss:', 'Pss:'):
+                    stats[fields[0][:-1]] = int(fields[1])
+    except OSError:
+        pass
+    return stats
+
+
+def child(method, path):
+    start = timer()
+    rom_file = read_rom(path) if method == 'read' else cartridge.load_rom(path)
+    mmu = MMU(rom_file)
+    for addr in range(0, len(rom_file), 0x1000):
+        rom_file[addr]
+    elapsed = timer() - start
+
+    print('ready', flush=True)
+    sys.stdin.readline()
+
+    stats = memory_stats()
+    stats['load'] = elapsed
+    print(json.dumps(stats), flush=True)
+
+
+def run(method, path, processes):
+    children = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', method, path],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, text=True)
+                for _ in range(processes)]
+
+    # Skip anything the loader itself prints
+    for proc in children:
+        while proc.stdout.readline().strip() != 'ready':
+            pass
+
+    results = []
+    for proc in children:
+        proc.stdin.write('\n')
+        proc.stdin.flush()
+    for proc in children:
+        results.append(json.loads(proc.stdout.readline()))
+        proc.wait()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rom', nargs='?')
+    parser.add_argument('--processes', type=int, default=32)
+    parser.add_argument('--size-mb', type=int, default=4)
+    parser.add_argument('--child', nargs=2, metavar=('METHOD', 'ROM'))
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.rom
+        if path is None:
+            path = os.path.join(tmp, 'bench.gb')
+            rom_file = np.random.default_rng(0).integers(0, 0x100, args.size_mb << 20, dtype=np.uint8)
+            rom_file[cartridge.HEADER_TYPE] = 0x19
+            rom_file[cartridge.HEADER_RAM_SIZE] = 0x00
+            rom_file.tofile(path)
+
+        for method in ('read', 'mmap'):
+            results = run(method, path, args.processes)
+            loads = [r['load'] for r in results]
+            print('%-4s x%d  load mean %.2f ms max %.2f ms  Rss mean %.1f MiB  Pss total %.1f MiB'
+                  % (method, args.processes, sum(loads) / len(loads) * 1e3, max(loads) * 1e3,
+                     sum(r.get('Rss', 0) for r in results) / len(results) / 1024,
+                     sum(r.get('Pss', 0) for r in results) / 1024))
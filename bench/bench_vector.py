@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bench_cpu import build_rom, bench_cycles
+from vector_cpu import VectorCPU
+
+# Scaling of VectorCPU with the number of instances: emulated cycles per
+# second summed over all instances, against one interpreting CPU running
+# the same instruction mix.  In lockstep every instance runs the same
+# instruction at each step; with --diverge each starts at a random
+# instruction of the inner loop, so a step dispatches to many opcode
+# groups.
+
+# Instructions of bench_cpu's inner loop and the subroutine it calls
+LOOP_STARTS = [0x015B, 0x015C, 0x015D, 0x015E, 0x015F, 0x0160, 0x0162, 0x0165,
+               0x0166, 0x0167, 0x0169, 0x016B, 0x016C, 0x016F, 0x0200, 0x0201]
+
+
+def bench_vector(count, cycles, repeat=3, diverge=False):
+    # Returns (cycles/s over all instances, opcode groups per step)
+    best = None
+    for _ in range(repeat):
+        vector = VectorCPU(build_rom(), count)
+        if diverge:
+            vector.pc[:] = np.random.default_rng(1).choice(LOOP_STARTS, count)
+        start = timer()
+        vector.run_cycles(cycles)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    steps = vector.instructions / count
+    return vector.cycles.sum() / best, vector.dispatches / steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 64, 1024])
+    parser.add_argument('--cycles', type=int, default=20000,
+                        help='cycles run by each instance')
+    parser.add_argument('--diverge', action='store_true')
+    args = parser.parse_args()
+
+    rate = bench_cycles(cycles=1000000, batch=True)
+    print('%-13s %.0f cycles/s' % ('interpreter', rate))
+    for count in args.counts:
+        total, groups = bench_vector(count, args.cycles, diverge=args.diverge)
+        print('%-13s %.0f cycles/s (%.1fx the interpreter), %.1f opcode groups per step'
+              % ('N = %d' % count, total, total / rate, groups))
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bench_frames import WORKLOADS
+from cartridge import load_rom
+from cpu import FUSIONS
+from gameboy import GameBoy
+
+# Most frequent runs of consecutive instructions in an execution trace, as
+# candidates for CPU.fuse: runs a ROM (or one of bench_frames' workloads)
+# for a number of frames, with waiting loops run instruction by
+# instruction, and counts every run of 2 or 3 instructions that follow
+# each other in memory.  Pairs with a fused handler are marked.
+
+
+def handler_name(handler):
+    # Bound method or partial of one
+    while not hasattr(handler, '__name__'):
+        handler = handler.func
+    return handler.__name__
+
+
+def trace(rom_file, frames):
+    # Runs frames with every handler wrapped to record (address, opcode),
+    # CB-prefixed opcodes as 0xCB00 | op2.  Returns the trace and a name
+    # for each opcode seen.
+    gameboy = GameBoy(rom_file, idle_loops=False)
+    cpu = gameboy.cpu
+    get = cpu.mmu.get
+    executed = []
+    record = executed.append
+
+    def wrap(op, handler):
+        def traced():
+            addr = (cpu.pc - 1) & 0xFFFF
+            record((addr, op if op != 0xCB else 0xCB00 | get(addr + 1)))
+            return handler()
+        return traced
+
+    names = {op: handler_name(handler) for op, handler in enumerate(cpu.ops)}
+    names.update({0xCB00 | op2: handler_name(handler) for op2, handler in enumerate(cpu.cb_ops)})
+    cpu.ops[:] = [wrap(op, handler) for op, handler in enumerate(cpu.ops)]
+
+    for _ in range(frames):
+        gameboy.run_frame()
+    return executed, names
+
+
+def ngrams(executed, length):
+    # Counts runs of length instructions, each starting 1 to 3 bytes after
+    # the one before: a jump to the next instruction or an interrupt taken
+    # right after one of those lengths is rare enough to count as falling
+    # through
+    counts = Counter()
+    for i in range(len(executed) - length + 1):
+        run = executed[i:i + length]
+        if all(0 < run[k + 1][0] - run[k][0] <= 3 for k in range(length - 1)):
+            counts[tuple(op for _, op in run)] += 1
+    return counts
+
+
+def describe(gram, names):
+    codes = ' '.join('%02X' % op if op < 0x100 else 'CB %02X' % (op & 0xFF) for op in gram)
+    return '%-17s %s' % (codes, ' / '.join(names[op] for op in gram))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rom', nargs='?')
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='mix',
+                        help='built-in program to run when no ROM is given')
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    rom_file = load_rom(args.rom) if args.rom else WORKLOADS[args.workload]()
+    executed, names = trace(rom_file, args.frames)
+    print('%d instructions traced' % len(executed))
+
+    for length in (2, 3):
+        print()
+        print('Top %d runs of %d instructions:' % (args.top, length))
+        for gram, count in ngrams(executed, length).most_common(args.top):
+            fused = '  [fused]' if gram in FUSIONS else ''
+            print('%9d %5.1f%%  %s%s' % (count, count / len(executed) * 100,
+                                         describe(gram, names), fused))
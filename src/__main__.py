@@ -1,6 +1,11 @@
+from cartridge import load_rom, save_path_for
 from events import Events
-from graphics import Graphics
-from mmu import MMU
+from gameboy import GameBoy
+from graphics import create_graphics, VIDEO_BACKENDS
+from pacing import Pacer, PACING_REALTIME, PACING_SPEED, PACING_UNCAPPED
+import alu_tables
+import argparse
+import os
 import sys
 from timeit import default_timer as timer
 
@@ -11,62 +16,134 @@ GB_PARAMS = {
             }
 
 PREFS = {
-        'debug_perf': True
+        'debug_perf': True,
+        'lazy_flags': False,
+        'alu_tables': False,
+        'idle_loops': True,
+        'translate': False,
+        'fusions': True,
+        'cpu_backend': 'auto'
         }
 
-def load_rom(filepath):
-    fh = open(filepath, 'rb')
-    data = fh.read()
-    print('Loaded ' + str(len(data)) + ' bytes.')
-    return data
+ALU_TABLES_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'pygbemu', 'alu_tables.bin')
+BLOCK_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'pygbemu', 'blocks')
 
+# Runtime speed changes from the video backend
+SPEED_EVENTS = {
+            Events.SPEED_REALTIME: (PACING_REALTIME,),
+            Events.SPEED_2X: (PACING_SPEED, 2),
+            Events.SPEED_4X: (PACING_SPEED, 4),
+            Events.SPEED_UNCAPPED: (PACING_UNCAPPED,)
+            }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='pygbemu')
+    parser.add_argument('rom', nargs='?')
+    parser.add_argument('--video', choices=sorted(VIDEO_BACKENDS), default='pygame',
+                        help='video backend; null and numpy run without pygame or a display')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='stop after this many frames (default: run until quit)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed multiplier over realtime (59.73 frames/s)')
+    parser.add_argument('--uncapped', action='store_true',
+                        help='run as fast as possible, presenting every --present-every frames')
+    parser.add_argument('--present-every', type=int, default=10)
+    parser.add_argument('--no-idle-loops', action='store_true',
+                        help='run waiting loops instruction by instruction, for accuracy testing')
+    parser.add_argument('--translate', action='store_true',
+                        help='compile ROM code into Python a basic block at a time')
+    parser.add_argument('--no-fusions', action='store_true',
+                        help='run common opcode pairs as separate instructions')
+    parser.add_argument('--cpu-backend', choices=['auto', 'python', 'numba'],
+                        help='numba compiles the CPU core; auto picks it if numba is installed')
+    return parser.parse_args(argv)
+
+def run(argv=None):
+    args = parse_args(argv)
 
-def run():
     # Load the ROM file into memory
-    try:
-        print('Opening ' + sys.argv[1])
-        rom_file = load_rom(sys.argv[1])
-    except IndexError:
+    if args.rom is None:
         print('No ROM file specified!')
         return 1
+    print('Opening ' + args.rom)
+    rom_file = load_rom(args.rom)
 
-    # Initialise MMU - Memory controller
-    mmu = MMU(rom_file)
+    # Initialise the machine - CPU, MMU, PPU and timers on one scheduler
+    tables = alu_tables.get_tables(ALU_TABLES_CACHE) if PREFS['alu_tables'] else None
+    cpu_backend = args.cpu_backend or PREFS['cpu_backend']
+    if cpu_backend != 'python':
+        from numba_cpu import default_backend, HAVE_NUMBA
+        if cpu_backend == 'auto':
+            cpu_backend = default_backend()
+        elif not HAVE_NUMBA:
+            print('The numba CPU backend needs numba, which is not installed')
+            return 1
+    print('CPU backend: ' + cpu_backend)
+    gameboy = GameBoy(rom_file, save_path=save_path_for(args.rom),
+                      lazy_flags=PREFS['lazy_flags'], alu_tables=tables,
+                      idle_loops=PREFS['idle_loops'] and not args.no_idle_loops,
+                      translate=PREFS['translate'] or args.translate, block_cache=BLOCK_CACHE,
+                      fusions=PREFS['fusions'] and not args.no_fusions, cpu_backend=cpu_backend)
 
     # Initialise the graphics module
-    gfx = Graphics(GB_PARAMS)
+    gfx = create_graphics(args.video, GB_PARAMS)
 
-    # Prepare graphics test pattern
-    test_pattern = gfx.get_test_pattern(mmu)
+    # Initialise frame pacing
+    if args.uncapped:
+        pacer = Pacer(PACING_UNCAPPED, present_every=args.present_every)
+    elif args.speed != 1.0:
+        pacer = Pacer(PACING_SPEED, speed=args.speed, present_every=args.present_every)
+    else:
+        pacer = Pacer(PACING_REALTIME, present_every=args.present_every)
 
     # Initialise performance timers if requested
     if PREFS['debug_perf']:
         last_fps_message_time = timer()
+        last_fps_frames = 0
 
     # MAIN EXECUTION LOOP BEGINS
+    frames = 0
     running = True
     while running:
-        # Start frame timer
-        if PREFS['debug_perf']:
-            frame_time_start = timer()
-
         # Handle input events
         events = gfx.get_events()
         if events == Events.QUIT:
             running = False
             break
+        elif events in SPEED_EVENTS:
+            pacer.set_mode(*SPEED_EVENTS[events])
 
-        # Render frame
-        gfx.draw(test_pattern)
+        # Emulate and render frame
+        if gameboy.run_frame() is None:
+            print('Breakpoint hit at ' + hex(gameboy.cpu.pc))
+            break
+        if pacer.should_present():
+            gfx.draw(gfx.get_frame_pixels(gameboy.ppu))
+        pacer.wait()
+        frames += 1
+        if frames == args.frames:
+            running = False
 
         # Measure frame rate
         if PREFS['debug_perf']:
-            frame_time_end = timer()
-            if (timer() - last_fps_message_time) > 1:
-                print("%.2f" % (1 / (frame_time_end - frame_time_start)), "fps")
-                last_fps_message_time = timer()
+            now = timer()
+            if (now - last_fps_message_time) > 1:
+                print("%.2f" % ((frames - last_fps_frames) / (now - last_fps_message_time)), "fps",
+                      "(" + pacer.describe() + ")")
+                last_fps_message_time = now
+                last_fps_frames = frames
 
     # MAIN EXECUTION LOOP ENDS
 
+    gameboy.save_block_cache()
+
+    if PREFS['debug_perf']:
+        print('Idle time in ' + args.rom + ':')
+        print(gameboy.cpu.idle_report())
+        if gameboy.cpu.translator is not None:
+            print(gameboy.cpu.translator.report())
+        if cpu_backend == 'numba':
+            print(gameboy.cpu.core_report())
+
 if __name__ == '__main__':
     sys.exit(run())
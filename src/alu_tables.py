@@ -0,0 +1,173 @@
+from array import array
+import os
+import sys
+import numpy as np
+
+# Precomputed (result, flags) lookup tables for the 8-bit ALU.
+#
+# Every entry packs the 8-bit result and the new high nibble of F as
+# (result << 8) | flags, so a helper is one lookup plus one write to F.  The
+# tables reproduce the CPU's eager helpers exactly, quirks included.
+#
+# Index layout:
+#   add, sub          (carry << 16) | (a << 8) | b
+#   and_, or_, xor    (a << 8) | b
+#   rl, rr            (carry << 8) | val
+#   daa               (((F >> 4) & 0b111) << 8) | a, i.e. N, H and C of F
+#   everything else   val
+
+TABLES_VERSION = 1
+
+TABLE_NAMES = ['add', 'sub', 'and_', 'or_', 'xor', 'inc', 'dec',
+               'rlc', 'rrc', 'rl', 'rr', 'sla', 'sra', 'srl', 'swap', 'daa']
+
+TABLE_SIZES = {
+    'add': 0x20000,
+    'sub': 0x20000,
+    'and_': 0x10000,
+    'or_': 0x10000,
+    'xor': 0x10000,
+    'rl': 0x200,
+    'rr': 0x200,
+    'daa': 0x800
+}
+
+CACHE_MAGIC = b'PYGBALU' + bytes([TABLES_VERSION])
+
+
+def pack(result, z, n, h, c):
+    return ((result & 0xFF) << 8) | (z.astype(np.int32) << 7) | (n.astype(np.int32) << 6) \
+           | (h.astype(np.int32) << 5) | (c.astype(np.int32) << 4)
+
+
+def binary_operands(with_carry):
+    index = np.arange(0x20000 if with_carry else 0x10000, dtype=np.int32)
+    return (index >> 8) & 0xFF, index & 0xFF, index >> 16
+
+
+def build_tables():
+    tables = {}
+    zero = np.zeros(1, dtype=bool)
+    one = np.ones(1, dtype=bool)
+
+    a, b, carry = binary_operands(True)
+    total = a + b + carry
+    tables['add'] = pack(total, (total & 0xFF) == 0, zero,
+                         (a & 0x0F) + (b & 0x0F) + carry > 0x0F, total > 0xFF)
+
+    total = a - b - carry
+    tables['sub'] = pack(total, (total & 0xFF) == 0, one,
+                         (a & 0x0F) < (b & 0x0F) + carry, total < 0x00)
+
+    a, b, _ = binary_operands(False)
+    result = a & b
+    tables['and_'] = pack(result, result == 0, zero, one, zero)
+    result = a | b
+    tables['or_'] = pack(result, result == 0, zero, zero, zero)
+    result = a ^ b
+    tables['xor'] = pack(result, result == 0, zero, zero, zero)
+
+    val = np.arange(0x100, dtype=np.int32)
+    msb = val >> 7
+    lsb = val & 0x01
+
+    # INC and DEC leave C alone, so their C bit is always clear here
+    result = (val + 1) & 0xFF
+    tables['inc'] = pack(result, result == 0, zero, (val & 0x0F) + 0x01 > 0x0F, zero)
+    result = (val - 1) & 0xFF
+    tables['dec'] = pack(result, result == 0, one, (val & 0x0F) == 0, zero)
+
+    result = ((val << 1) & 0xFF) | msb
+    tables['rlc'] = pack(result, result == 0, zero, zero, msb)
+    result = (val >> 1) | (lsb << 7)
+    tables['rrc'] = pack(result, result == 0, zero, zero, lsb)
+    result = (val << 1) & 0xFF
+    tables['sla'] = pack(result, result == 0, zero, zero, msb)
+    result = (val >> 1) | (val & 0x80)
+    tables['sra'] = pack(result, result == 0, zero, zero, lsb)
+    result = val >> 1
+    tables['srl'] = pack(result, result == 0, zero, zero, lsb)
+
+    # SWAP does not touch F
+    tables['swap'] = (((val & 0x0F) << 4) | (val >> 4)) << 8
+
+    val = np.arange(0x200, dtype=np.int32) & 0xFF
+    carry = np.arange(0x200, dtype=np.int32) >> 8
+    msb = val >> 7
+    lsb = val & 0x01
+    result = ((val << 1) & 0xFF) + carry
+    tables['rl'] = pack(result, result == 0, zero, zero, msb)
+    # RR tests Z on the operand with bit 0 cleared, not on the result
+    result = (val >> 1) + (carry << 7)
+    tables['rr'] = pack(result, (val - lsb) == 0, zero, zero, lsb)
+
+    index = np.arange(0x800, dtype=np.int32)
+    a = index & 0xFF
+    n = (index >> 10) & 0x01
+    h = (index >> 9) & 0x01
+    c = (index >> 8) & 0x01
+    adjust_c = (n == 0) & ((c == 1) | (a > 0x99))
+    a = np.where(n == 1, a - 0x60 * c - 0x06 * h, a + 0x60 * adjust_c)
+    a = np.where((n == 0) & ((h == 1) | ((a & 0x0F) > 0x09)), a + 0x06, a)
+    # DAA tests Z before wrapping A
+    tables['daa'] = pack(a % 0x100, a == 0, n == 1, zero, (c == 1) | adjust_c)
+
+    return {name: array('H', tables[name].astype(np.uint16).tobytes()) for name in TABLE_NAMES}
+
+
+def table_size(name):
+    return TABLE_SIZES.get(name, 0x100)
+
+
+def save_tables(tables, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'wb') as fh:
+        fh.write(CACHE_MAGIC)
+        for name in TABLE_NAMES:
+            table = tables[name]
+            if sys.byteorder != 'little':
+                table = array('H', table)
+                table.byteswap()
+            table.tofile(fh)
+
+
+def load_tables(path):
+    with open(path, 'rb') as fh:
+        if fh.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            raise ValueError('Not an ALU table cache: ' + path)
+
+        tables = {}
+        for name in TABLE_NAMES:
+            table = array('H')
+            table.fromfile(fh, table_size(name))
+            if sys.byteorder != 'little':
+                table.byteswap()
+            tables[name] = table
+
+        if fh.read(1):
+            raise ValueError('Trailing data in ALU table cache: ' + path)
+
+    return tables
+
+
+def get_tables(cache_path=None):
+    # Load the tables from cache_path if it holds a valid cache, otherwise
+    # build them and (re)write the cache
+    if cache_path is not None:
+        try:
+            return load_tables(cache_path)
+        except (OSError, EOFError, ValueError):
+            pass
+
+    tables = build_tables()
+
+    if cache_path is not None:
+        try:
+            save_tables(tables, cache_path)
+        except OSError:
+            pass
+
+    return tables
@@ -0,0 +1,319 @@
+import mmap
+import os
+import time
+import numpy as np
+
+# Cartridge header fields
+# Reference: https://gbdev.io/pandocs/The_Cartridge_Header.html
+HEADER_TYPE = 0x0147
+HEADER_ROM_SIZE = 0x0148
+HEADER_RAM_SIZE = 0x0149
+
+ROM_BANK_SIZE = 0x4000
+RAM_BANK_SIZE = 0x2000
+PAGE_SIZE = 0x100
+
+# External RAM size by header code
+RAM_SIZES = {
+    0x00: 0,
+    0x01: 0x800,
+    0x02: 0x2000,
+    0x03: 0x8000,
+    0x04: 0x20000,
+    0x05: 0x10000
+}
+
+# MBC3 real time clock registers, selected by writing 0x08-0x0C to 0x4000-0x5FFF
+RTC_S = 0x08
+RTC_M = 0x09
+RTC_H = 0x0A
+RTC_DL = 0x0B
+RTC_DH = 0x0C
+
+class DisabledRAMPage:
+    # Stands in for external RAM pages while RAM is disabled (or absent):
+    # reads float high and writes are dropped
+    def __getitem__(self, offset):
+        return 0xFF
+
+    def __setitem__(self, offset, val):
+        pass
+
+class RTCPage:
+    # Maps the whole external RAM window onto the selected RTC register
+    def __init__(self, cartridge):
+        self.cartridge = cartridge
+
+    def __getitem__(self, offset):
+        return self.cartridge.read_rtc()
+
+    def __setitem__(self, offset, val):
+        self.cartridge.write_rtc(val)
+
+DISABLED_RAM_PAGES = [DisabledRAMPage()] * (RAM_BANK_SIZE // PAGE_SIZE)
+
+class Cartridge:
+    # ROM only, optionally with up to 8K of RAM.  Control writes are ignored,
+    # as there is nothing to control.
+    #
+    # Banks are exposed to the MMU as lists of 256-byte memoryview pages,
+    # built once per bank and then only swapped in and out of the MMU page
+    # tables, so switching banks never copies cartridge data.  The same list
+    # object is returned for the same mapping, so the MMU can skip remapping
+    # regions that did not change.
+    def __init__(self, rom_file, battery = False, save_path = None):
+        self.ROM = rom_file
+        self.cart_type = int(rom_file[HEADER_TYPE]) if len(rom_file) > HEADER_TYPE else 0x00
+        self.battery = battery
+
+        self.rom_view = memoryview(rom_file)
+        self.rom_banks = max(len(rom_file) // ROM_BANK_SIZE, 2)
+        self.rom_bank_0 = 0
+        self.rom_bank = 1
+
+        # Battery-backed RAM is mapped straight onto the save file, so every
+        # write lands in the file (via the OS page cache) with no save step.
+        # Carts without RAM still get a scratch 8K window, as the old flat
+        # EXT_RAM did; RAM smaller than 8K is mirrored across the window.
+        ram_code = int(rom_file[HEADER_RAM_SIZE]) if len(rom_file) > HEADER_RAM_SIZE else 0x00
+        ram_size = RAM_SIZES.get(ram_code, 0)
+        self.save_path = None
+        self.save_map = None
+        if ram_size == 0:
+            self.RAM = np.zeros(RAM_BANK_SIZE, dtype=np.uint8)
+        elif battery and save_path is not None:
+            self.save_path = save_path
+            self.save_map = map_save_file(save_path, ram_size)
+            self.RAM = np.frombuffer(self.save_map, dtype=np.uint8)
+        else:
+            self.RAM = np.zeros(ram_size, dtype=np.uint8)
+        self.ram_view = memoryview(self.RAM)
+        self.ram_banks = max(len(self.RAM) // RAM_BANK_SIZE, 1)
+        self.ram_bank = 0
+        self.ram_enabled = True
+
+        self.rom_page_cache = {}
+        self.ram_page_cache = {}
+
+    def rom_pages(self, bank):
+        pages = self.rom_page_cache.get(bank)
+        if pages is None:
+            start = bank * ROM_BANK_SIZE
+            pages = [self.rom_view[offset:offset + PAGE_SIZE]
+                     for offset in range(start, start + ROM_BANK_SIZE, PAGE_SIZE)]
+            self.rom_page_cache[bank] = pages
+        return pages
+
+    def ram_pages(self):
+        if not self.ram_enabled:
+            return DISABLED_RAM_PAGES
+
+        pages = self.ram_page_cache.get(self.ram_bank)
+        if pages is None:
+            start = self.ram_bank * RAM_BANK_SIZE
+            pages = [self.ram_view[offset % len(self.RAM):offset % len(self.RAM) + PAGE_SIZE]
+                     for offset in range(start, start + RAM_BANK_SIZE, PAGE_SIZE)]
+            self.ram_page_cache[self.ram_bank] = pages
+        return pages
+
+    def write(self, addr, val):
+        pass
+
+class MBC1(Cartridge):
+    def __init__(self, rom_file, battery = False, save_path = None):
+        super().__init__(rom_file, battery, save_path)
+        self.ram_enabled = False
+        self.bank_low = 1
+        self.bank_high = 0
+        self.mode = 0
+
+    def write(self, addr, val):
+        # RAM enable 0x0000-0x1FFF
+        if addr <= 0x1FFF:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+
+        # ROM bank number, lower 5 bits 0x2000-0x3FFF
+        elif addr <= 0x3FFF:
+            self.bank_low = (val & 0x1F) or 1
+
+        # RAM bank number or upper ROM bank bits 0x4000-0x5FFF
+        elif addr <= 0x5FFF:
+            self.bank_high = val & 0x03
+
+        # Banking mode select 0x6000-0x7FFF
+        else:
+            self.mode = val & 0x01
+
+        self.rom_bank = ((self.bank_high << 5) | self.bank_low) % self.rom_banks
+        if self.mode:
+            self.rom_bank_0 = (self.bank_high << 5) % self.rom_banks
+            self.ram_bank = self.bank_high % self.ram_banks
+        else:
+            self.rom_bank_0 = 0
+            self.ram_bank = 0
+
+class MBC3(Cartridge):
+    def __init__(self, rom_file, battery = False, save_path = None, timer = False, clock = time.time):
+        super().__init__(rom_file, battery, save_path)
+        self.ram_enabled = False
+        self.timer = timer
+        self.rtc_select = None
+        self.rtc_pages = [RTCPage(self)] * (RAM_BANK_SIZE // PAGE_SIZE)
+
+        # The clock counts seconds since rtc_base, plus rtc_seconds carried
+        # over from before the last halt or register write
+        self.clock = clock
+        self.rtc_base = clock()
+        self.rtc_seconds = 0
+        self.rtc_halted = False
+        self.rtc_carry = False
+        self.rtc_latch = 0xFF
+        self.rtc_latched = self.rtc_registers()
+
+    def write(self, addr, val):
+        # RAM and RTC enable 0x0000-0x1FFF
+        if addr <= 0x1FFF:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+
+        # ROM bank number 0x2000-0x3FFF
+        elif addr <= 0x3FFF:
+            self.rom_bank = ((val & 0x7F) or 1) % self.rom_banks
+
+        # RAM bank number or RTC register select 0x4000-0x5FFF
+        elif addr <= 0x5FFF:
+            if self.timer and RTC_S <= val <= RTC_DH:
+                self.rtc_select = val
+            elif val <= 0x03:
+                self.rtc_select = None
+                self.ram_bank = val % self.ram_banks
+
+        # Latch clock data 0x6000-0x7FFF, on a 0x00 then 0x01 write
+        else:
+            if self.rtc_latch == 0x00 and val == 0x01:
+                self.rtc_latched = self.rtc_registers()
+            self.rtc_latch = val
+
+    def ram_pages(self):
+        if self.ram_enabled and self.rtc_select is not None:
+            return self.rtc_pages
+        return super().ram_pages()
+
+    def rtc_now(self):
+        if self.rtc_halted:
+            return self.rtc_seconds
+        return self.rtc_seconds + int(self.clock() - self.rtc_base)
+
+    def rtc_registers(self):
+        seconds = self.rtc_now()
+        days = seconds // 86400
+        if days > 0x1FF:
+            self.rtc_carry = True
+
+        return {
+            RTC_S: seconds % 60,
+            RTC_M: (seconds // 60) % 60,
+            RTC_H: (seconds // 3600) % 24,
+            RTC_DL: days & 0xFF,
+            RTC_DH: ((days >> 8) & 0x01) | (self.rtc_halted << 6) | (self.rtc_carry << 7)
+        }
+
+    def read_rtc(self):
+        return self.rtc_latched[self.rtc_select]
+
+    def write_rtc(self, val):
+        # Rebase the counter on the current time with the written register
+        # replaced
+        registers = self.rtc_registers()
+        registers[self.rtc_select] = val
+
+        days = registers[RTC_DL] | ((registers[RTC_DH] & 0x01) << 8)
+        self.rtc_seconds = (registers[RTC_S] % 60) + (registers[RTC_M] % 60) * 60 \
+                           + (registers[RTC_H] % 24) * 3600 + days * 86400
+        self.rtc_base = self.clock()
+        self.rtc_halted = bool(registers[RTC_DH] & 0x40)
+        self.rtc_carry = bool(registers[RTC_DH] & 0x80)
+        self.rtc_latched[self.rtc_select] = val
+
+class MBC5(Cartridge):
+    def __init__(self, rom_file, battery = False, save_path = None):
+        super().__init__(rom_file, battery, save_path)
+        self.ram_enabled = False
+        self.bank_low = 1
+        self.bank_high = 0
+
+    def write(self, addr, val):
+        # RAM enable 0x0000-0x1FFF
+        if addr <= 0x1FFF:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+
+        # ROM bank number, lower 8 bits 0x2000-0x2FFF
+        elif addr <= 0x2FFF:
+            self.bank_low = val
+
+        # ROM bank number, bit 8 0x3000-0x3FFF
+        elif addr <= 0x3FFF:
+            self.bank_high = val & 0x01
+
+        # RAM bank number 0x4000-0x5FFF
+        elif addr <= 0x5FFF:
+            self.ram_bank = (val & 0x0F) % self.ram_banks
+
+        # Unused 0x6000-0x7FFF
+        else:
+            return
+
+        # Unlike MBC1/MBC3, bank 0 can be mapped into 0x4000-0x7FFF
+        self.rom_bank = ((self.bank_high << 8) | self.bank_low) % self.rom_banks
+
+# Header type byte -> (controller, kwargs)
+CARTRIDGE_TYPES = {
+    0x00: (Cartridge, {}),
+    0x01: (MBC1, {}),
+    0x02: (MBC1, {}),
+    0x03: (MBC1, {'battery': True}),
+    0x08: (Cartridge, {}),
+    0x09: (Cartridge, {'battery': True}),
+    0x0F: (MBC3, {'battery': True, 'timer': True}),
+    0x10: (MBC3, {'battery': True, 'timer': True}),
+    0x11: (MBC3, {}),
+    0x12: (MBC3, {}),
+    0x13: (MBC3, {'battery': True}),
+    0x19: (MBC5, {}),
+    0x1A: (MBC5, {}),
+    0x1B: (MBC5, {'battery': True}),
+    0x1C: (MBC5, {}),
+    0x1D: (MBC5, {}),
+    0x1E: (MBC5, {'battery': True})
+}
+
+def map_save_file(path, size):
+    # Open (or create) the save file and map it read-write and shared.  A
+    # short file is zero-extended; a longer one (e.g. with an RTC footer
+    # written by another emulator) only has its first size bytes mapped.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+    finally:
+        os.close(fd)
+
+def save_path_for(rom_path):
+    return os.path.splitext(rom_path)[0] + '.sav'
+
+def load_rom(filepath):
+    # Map the ROM read-only instead of reading it in: nothing is copied at
+    # startup, and every process running the same ROM shares the OS page
+    # cache.  The mapping stays valid once the file is closed.
+    with open(filepath, 'rb') as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    print('Loaded ' + str(len(data)) + ' bytes.')
+    return data
+
+def create_cartridge(rom_file, save_path = None):
+    cart_type = int(rom_file[HEADER_TYPE]) if len(rom_file) > HEADER_TYPE else 0x00
+    try:
+        controller, kwargs = CARTRIDGE_TYPES[cart_type]
+    except KeyError:
+        raise NotImplementedError('Unsupported cartridge type ' + hex(cart_type))
+    return controller(rom_file, save_path=save_path, **kwargs)
@@ -1,61 +1,290 @@
-import numpy as np
+from functools import partial
+from mmu import IF, IE, INT_ALL, INT_JOYPAD
+
+# Register file layout.  Each 16-bit pair is stored high byte first, so a
+# pair's value is (regs[i] << 8) | regs[i + 1] for its high byte index i.
+REG_B = 0
+REG_C = 1
+REG_D = 2
+REG_E = 3
+REG_H = 4
+REG_L = 5
+REG_A = 6
+REG_F = 7
+
+REG_BC = REG_B
+REG_DE = REG_D
+REG_HL = REG_H
+REG_AF = REG_A
+
+REG_INDEX = {
+    'A': REG_A,
+    'B': REG_B,
+    'C': REG_C,
+    'D': REG_D,
+    'E': REG_E,
+    'F': REG_F,
+    'H': REG_H,
+    'L': REG_L
+}
+
+PAIR_INDEX = {
+    'AF': REG_AF,
+    'BC': REG_BC,
+    'DE': REG_DE,
+    'HL': REG_HL
+}
+
+# Operation kinds recorded for lazy flag evaluation
+FLAGS_ADD_8 = 0
+FLAGS_ADD_16 = 1
+FLAGS_SUB_8 = 2
+FLAGS_SUB_16 = 3
+
+# Register operand encoded in the low 3 bits of an opcode; index 6 is (HL)
+# and is handled by the _HL variants of each instruction.
+OPCODE_REGS = [REG_B, REG_C, REG_D, REG_E, REG_H, REG_L, None, REG_A]
+
+# Instruction timings in clock cycles (T-cycles, 4 per machine cycle, 70224
+# per frame).  Conditional jumps, calls and returns are listed with their
+# not-taken cost; the handlers return the *_TAKEN cost when the branch is
+# taken.  Unused opcodes are 0.
+# Reference: https://gbdev.io/gb-opcodes/optables/
+OP_CYCLES = [
+#   x0  x1  x2  x3  x4  x5  x6  x7  x8  x9  xA  xB  xC  xD  xE  xF
+     4, 12,  8,  8,  4,  4,  8,  4, 20,  8,  8,  8,  4,  4,  8,  4,  # 0x
+     4, 12,  8,  8,  4,  4,  8,  4, 12,  8,  8,  8,  4,  4,  8,  4,  # 1x
+     8, 12,  8,  8,  4,  4,  8,  4,  8,  8,  8,  8,  4,  4,  8,  4,  # 2x
+     8, 12,  8,  8, 12, 12, 12,  4,  8,  8,  8,  8,  4,  4,  8,  4,  # 3x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 4x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 5x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 6x
+     8,  8,  8,  8,  8,  8,  4,  8,  4,  4,  4,  4,  4,  4,  8,  4,  # 7x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 8x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # 9x
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # Ax
+     4,  4,  4,  4,  4,  4,  8,  4,  4,  4,  4,  4,  4,  4,  8,  4,  # Bx
+     8, 12, 12, 16, 12, 16,  8, 16,  8, 16, 12,  4, 12, 24,  8, 16,  # Cx
+     8, 12, 12,  0, 12, 16,  8, 16,  8, 16, 12,  0, 12,  0,  8, 16,  # Dx
+    12, 12,  8,  0,  0, 16,  8, 16, 16,  4, 16,  0,  0,  0,  8, 16,  # Ex
+    12, 12,  8,  4,  0, 16,  8, 16, 12,  8, 16,  4,  0,  0,  8, 16,  # Fx
+]
+
+JR_TAKEN = 12
+JP_TAKEN = 16
+CALL_TAKEN = 24
+RET_TAKEN = 20
+
+# CB-prefixed instructions, including the prefix byte: 8 on a register, 16
+# on (HL), except BIT b, (HL) which only reads it
+CB_CYCLES = [(12 if 0x40 <= op2 < 0x80 else 16) if op2 & 0x07 == 6 else 8
+             for op2 in range(0x100)]
+
+# Dispatching an interrupt pushes PC and jumps to the vector
+INTERRUPT_CYCLES = 20
+
+# Instructions allowed in a loop that run() may skip while it waits: they
+# read memory but never write it, and touch nothing but registers, so once
+# an iteration leaves the registers as it found them every later one does
+# too, until memory changes.  opcode -> (length, operand), where operand
+# says what the instruction reads: None, a REG_* pair read through, READ_C
+# for (0xFF00 + C), READ_N for (0xFF00 + n) or READ_NN for (nn).
+READ_C = 'C'
+READ_N = 'n'
+READ_NN = 'nn'
+
+def build_idle_loop_ops():
+    ops = {}
+    for op in [0x00, 0x07, 0x0F, 0x17, 0x1F, 0x27, 0x2F, 0x37, 0x3F]:
+        ops[op] = (1, None)
+    for i in range(8):
+        if i != 6:
+            ops[0x04 + (i << 3)] = (1, None)    # INC r
+            ops[0x05 + (i << 3)] = (1, None)    # DEC r
+            ops[0x06 + (i << 3)] = (2, None)    # LD r, n
+    for i in range(4):
+        ops[0x03 + (i << 4)] = (1, None)        # INC rr
+        ops[0x0B + (i << 4)] = (1, None)        # DEC rr
+    for op in range(0x40, 0xC0):
+        if 0x70 <= op <= 0x77:
+            continue                            # LD (HL), r and HALT
+        ops[op] = (1, REG_HL if op & 0x07 == 6 else None)
+    for op in range(0xC6, 0x100, 0x08):
+        ops[op] = (2, None)                     # ALU A, n
+    ops[0x0A] = (1, REG_BC)
+    ops[0x1A] = (1, REG_DE)
+    ops[0xF2] = (1, READ_C)
+    ops[0xF0] = (2, READ_N)
+    ops[0xFA] = (3, READ_NN)
+
+    # Jumps, conditional or not, to leave the loop or go round again.  Loops
+    # are only found on backward jumps, and JR's offset is unsigned here
+    # (JR always jumps forward), so a JR can leave a loop but never close
+    # one: JR NZ polling loops, common in real ROMs, are not skipped until
+    # JR takes a signed offset.
+    for op in [0x18, 0x20, 0x28, 0x30, 0x38]:
+        ops[op] = (2, None)
+    for op in [0xC2, 0xC3, 0xCA, 0xD2, 0xDA]:
+        ops[op] = (3, None)
+    return ops
+
+IDLE_LOOP_OPS = build_idle_loop_ops()
+
+# Loops longer than this are not worth analysing
+MAX_IDLE_LOOP_BYTES = 32
+
+# Superinstructions: common pairs of opcodes that one handler runs together
+# when the second directly follows the first (see CPU.fuse), picked with
+# bench/trace_ngrams.py.  (first, second) -> (handler, register or None).
+# FUSED_FIRST_LENGTHS is the length of each first instruction.
+def build_fusions():
+    fusions = {}
+    for i, r in enumerate(OPCODE_REGS):
+        if r is not None:
+            fusions[(0x05 + (i << 3), 0x20)] = ('DEC_r_JR_NZ', r)
+            fusions[(0x05 + (i << 3), 0xC2)] = ('DEC_r_JP_NZ', r)
+    fusions[(0xFE, 0x20)] = ('CP_n_JR_NZ', None)
+    fusions[(0xFE, 0x28)] = ('CP_n_JR_Z', None)
+    fusions[(0xFE, 0xC2)] = ('CP_n_JP_NZ', None)
+    fusions[(0xFE, 0xCA)] = ('CP_n_JP_Z', None)
+    fusions[(0x2A, 0x12)] = ('LDI_A_HL_LD_DE_A', None)
+    fusions[(0xF0, 0xE6)] = ('LDH_A_n_AND_n', None)
+    return fusions
+
+FUSIONS = build_fusions()
+FUSED_FIRST_LENGTHS = {first: 2 if first in (0xF0, 0xFE) else 1 for first, _ in FUSIONS}
+
+# Why run_cycles/run_until returned
+STOP_CYCLES = 'cycles'
+STOP_BREAKPOINT = 'breakpoint'
+STOP_INTERRUPT = 'interrupt'
+STOP_PREDICATE = 'predicate'
 
 class CPU:
-    def __init__(self, mmu):
-        self.regs = {
-            'A': 0x00,
-            'B': 0x00,
-            'C': 0x00,
-            'D': 0x00,
-            'E': 0x00,
-            'F': 0x00,
-            'H': 0x00,
-            'L': 0x00
-        }
+    def __init__(self, mmu, lazy_flags = False, alu_tables = None, idle_loops = True,
+                 translate = False, fusions = None):
+        self.regs = bytearray(8)
+
+        # With lazy flags, add/sub only record their operands here and F is
+        # brought up to date by resolve_flags when something reads it.
+        self.pending_flags = None
+        if lazy_flags:
+            self.add_8 = self.add_8_lazy
+            self.add_16 = self.add_16_lazy
+            self.sub_8 = self.sub_8_lazy
+            self.sub_16 = self.sub_16_lazy
+
+        # With ALU tables (see alu_tables.get_tables), the 8-bit helpers are
+        # a single table lookup each
+        self.alu = alu_tables
+        if alu_tables is not None:
+            self.add_8 = self.add_8_table
+            self.sub_8 = self.sub_8_table
+            self.and_8 = self.and_8_table
+            self.or_8 = self.or_8_table
+            self.xor_8 = self.xor_8_table
+            self.inc_8 = self.inc_8_table
+            self.dec_8 = self.dec_8_table
+            self.rlc_8 = self.rlc_8_table
+            self.rrc_8 = self.rrc_8_table
+            self.rl_8 = self.rl_8_table
+            self.rr_8 = self.rr_8_table
+            self.sla_8 = self.sla_8_table
+            self.sra_8 = self.sra_8_table
+            self.srl_8 = self.srl_8_table
+            self.swap_8 = self.swap_8_table
+            self.daa_8 = self.daa_8_table
 
         self.sp = 0xFFFE
         self.pc = 0x0100
         self.interrupt_master_enable = False
 
+        # Clock cycles run since reset
+        self.cycles = 0
+
+        # The cycle the current run() stops at, None between runs.
+        # Scheduler lowers it when an instruction schedules an event
+        # earlier than that.
+        self.stop_at = None
+
+        # run_cycles/run_until stop when PC reaches one of these
+        self.breakpoints = set()
+
+        # HALT and STOP leave the CPU halted until an interrupt in
+        # wake_mask is requested; the cycles skipped meanwhile are counted
+        # in idle_cycles
+        self.halted = False
+        self.wake_mask = INT_ALL
+        self.idle_cycles = 0
+
+        # Waiting loops run_cycles may skip (see skip_idle_loop); off for
+        # accuracy testing.  idle_loop_reads caches the analysis of each
+        # loop, idle_loop_stats counts [skips, cycles] per loop.
+        self.idle_loops = idle_loops
+        self.idle_loop_reads = {}
+        self.idle_loop_stats = {}
+        self.idle_state = None
+        self.skipped_cycles = 0
+
         self.mmu = mmu
 
+        self.build_dispatch_tables()
+
+        # Opcode pairs run as superinstructions: True for all of FUSIONS, or
+        # a list of its keys
+        self.fused = set()
+        if fusions:
+            self.fuse(FUSIONS if fusions is True else fusions)
+
+        # With translate, run_cycles/run_until compile code into Python a
+        # basic block at a time (see translator.BlockTranslator), falling
+        # back to the interpreter while breakpoints are set
+        self.translator = None
+        if translate:
+            from translator import BlockTranslator
+            self.translator = BlockTranslator(self)
+
+    # String-keyed register access, kept for callers outside the CPU.  The
+    # opcode handlers index self.regs directly.
+
     def get_reg_8(self, reg):
-        return self.regs[reg]
+        if (reg == 'F' and self.pending_flags is not None):
+            self.resolve_flags()
+        return self.regs[REG_INDEX[reg]]
 
     def set_reg_8(self, reg, val):
-        self.regs[reg] = val
+        if (reg == 'F'):
+            self.pending_flags = None
+        self.regs[REG_INDEX[reg]] = val
 
     def get_reg_16(self, reg):
-        if (reg == 'AF'):
-            return (self.regs['A'] << 8) | self.regs['F']
-        elif (reg == 'BC'):
-            return (self.regs['B'] << 8) | self.regs['C']
-        elif (reg == 'DE'):
-            return (self.regs['D'] << 8) | self.regs['E']
-        elif (reg == 'HL'):
-            return (self.regs['H'] << 8) | self.regs['L']
-        elif (reg == 'SP'):
+        if (reg == 'SP'):
             return self.sp
         elif (reg == 'PC'):
             return self.pc
+        else:
+            if (reg == 'AF' and self.pending_flags is not None):
+                self.resolve_flags()
+            return self.get_pair(PAIR_INDEX[reg])
 
     def set_reg_16(self, reg, val):
-        if (reg == 'AF'):
-            self.regs['A'] = (val & 0xFF00) >> 8
-            self.regs['F'] = val & 0x00FF
-        elif (reg == 'BC'):
-            self.regs['B'] = (val & 0xFF00) >> 8
-            self.regs['C'] = val & 0x00FF
-        elif (reg == 'DE'):
-            self.regs['D'] = (val & 0xFF00) >> 8
-            self.regs['E'] = val & 0x00FF
-        elif (reg == 'HL'):
-            self.regs['H'] = (val & 0xFF00) >> 8
-            self.regs['L'] = val & 0x00FF
-        elif (reg == 'SP'):
+        if (reg == 'SP'):
             self.sp = val
         elif (reg == 'PC'):
             self.pc = val
+        else:
+            if (reg == 'AF'):
+                self.pending_flags = None
+            self.set_pair(PAIR_INDEX[reg], val)
+
+    def get_pair(self, i):
+        regs = self.regs
+        return (regs[i] << 8) | regs[i + 1]
+
+    def set_pair(self, i, val):
+        regs = self.regs
+        regs[i] = (val & 0xFF00) >> 8
+        regs[i + 1] = val & 0x00FF
 
     def fetch_8(self):
         val = self.mmu.get(self.pc)
@@ -70,40 +299,46 @@ class CPU:
         return val
 
     def get_flag(self, flag):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+
         if (flag == 'Z'):
-            return (self.get_reg_8('F') & 0b10000000) >> 7
+            return (self.regs[REG_F] & 0b10000000) >> 7
         elif (flag == 'N'):
-            return (self.get_reg_8('F') & 0b01000000) >> 6
+            return (self.regs[REG_F] & 0b01000000) >> 6
         elif (flag == 'H'):
-            return (self.get_reg_8('F') & 0b00100000) >> 5
+            return (self.regs[REG_F] & 0b00100000) >> 5
         elif (flag == 'C'):
-            return (self.get_reg_8('F') & 0b00010000) >> 4
+            return (self.regs[REG_F] & 0b00010000) >> 4
         else:
             raise NotImplementedError('Unknown flag get: ' + flag)
 
     def set_flag(self, flag, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+
         if (flag == 'Z'):
-            self.set_reg_8('F', self.get_reg_8('F') & 0b01111111 | (val << 7))
+            self.regs[REG_F] = self.regs[REG_F] & 0b01111111 | (val << 7)
         elif (flag == 'N'):
-            self.set_reg_8('F', self.get_reg_8('F') & 0b10111111 | (val << 6))
+            self.regs[REG_F] = self.regs[REG_F] & 0b10111111 | (val << 6)
         elif (flag == 'H'):
-            self.set_reg_8('F', self.get_reg_8('F') & 0b11011111 | (val << 5))
+            self.regs[REG_F] = self.regs[REG_F] & 0b11011111 | (val << 5)
         elif (flag == 'C'):
-            self.set_reg_8('F', self.get_reg_8('F') & 0b11101111 | (val << 4))
+            self.regs[REG_F] = self.regs[REG_F] & 0b11101111 | (val << 4)
         else:
             raise NotImplementedError('Unknown flag set: ' + flag)
 
     def push_stack(self, addr):
-        SP = self.get_reg_16('SP')
+        SP = self.sp
         self.mmu.set(SP - 1, (addr & 0xFF00) >> 8)
         self.mmu.set(SP - 2, (addr & 0xFF))
-        self.set_reg_16('SP', SP - 2)
+        self.sp = SP - 2
 
     def pop_stack(self):
-        SP = self.get_reg_16('SP')
+        SP = self.sp
         lo = self.mmu.get(SP)
         hi = self.mmu.get(SP + 1)
-        self.set_reg_16('SP', SP + 2)
+        self.sp = SP + 2
         return (hi << 8) | lo
 
     def add_8(self, val1, val2, use_carry = False):
@@ -142,715 +377,811 @@ class CPU:
         self.set_flag('C', int(total < 0x0000))
         return wrappedTotal
 
+    def and_8(self, val1, val2):
+        result = val1 & val2
+        self.set_flag('Z', int(result == 0x00))
+        self.set_flag('N', 0)
+        self.set_flag('H', 1)
+        self.set_flag('C', 0)
+        return result
+
+    def or_8(self, val1, val2):
+        result = val1 | val2
+        self.set_flag('Z', int(result == 0x00))
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        self.set_flag('C', 0)
+        return result
+
+    def xor_8(self, val1, val2):
+        result = val1 ^ val2
+        self.set_flag('Z', int(result == 0x00))
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        self.set_flag('C', 0)
+        return result
+
+    def inc_8(self, val):
+        result = (val + 1) % 0x100
+        self.set_flag('Z', (result == 0x00))
+        self.set_flag('N', False)
+        self.set_flag('H', int(((val & 0x0F) + 0x01) > 0x0F))
+        return result
+
+    def dec_8(self, val):
+        result = (val - 1) % 0x100
+        self.set_flag('Z', (result == 0x00))
+        self.set_flag('N', True)
+        self.set_flag('H', int((val & 0x0F) == 0))
+        return result
+
+    def rlc_8(self, old):
+        val = old << 1
+
+        if ((val & 0x100) >> 8 == 1):
+            val -= 0x100
+            val += 0x01
+
+        self.set_flag('C', (old & 0b10000000) >> 7)
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def rl_8(self, old):
+        val = old << 1
+
+        if ((val & 0x100) >> 8 == 1):
+            val -= 0x100
+
+        val += self.get_flag('C')
+
+        self.set_flag('C', (old & 0b10000000) >> 7)
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def rrc_8(self, val):
+        carry = val % 2
+        self.set_flag('C', carry)
+        val -= carry
+        val = val >> 1
+        val += 0x80 * carry
+
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def rr_8(self, val):
+        old_c = self.get_flag('C')
+
+        self.set_flag('C', val % 2)
+        val -= val % 2
+
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return (val >> 1) + (old_c * 0x80)
+
+    def sla_8(self, old):
+        val = old << 1
+
+        if ((val & 0x100) >> 8 == 1):
+            val -= 0x100
+
+        self.set_flag('C', (old & 0b10000000) >> 7)
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def sra_8(self, val):
+        msb = val & 0b10000000
+
+        self.set_flag('C', val % 2)
+        val -= val % 2
+        val = val >> 1
+        val += msb
+
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def srl_8(self, val):
+        self.set_flag('C', val % 2)
+        val -= val % 2
+        val = val >> 1
+
+        self.set_flag('Z', 1 if val == 0 else 0)
+        self.set_flag('N', 0)
+        self.set_flag('H', 0)
+        return val
+
+    def swap_8(self, val):
+        hi = (val & 0xF0) >> 4
+        lo = val & 0x0F
+        return (lo << 4) | hi
+
+    def daa_8(self, a):
+        c = self.get_flag('C')
+        h = self.get_flag('H')
+
+        if (self.get_flag('N')):
+            if (c): a -= 0x60
+            if (h): a -= 0x06
+        else:
+            if (c or a > 0x99):
+                a += 0x60
+                self.set_flag('C', 1)
+            if (h or (a & 0x0F) > 0x09):
+                a += 0x06
+
+        self.set_flag('Z', int(a == 0))
+        self.set_flag('H', 0)
+        return a % 0x100
+
+    # Lazy variants of the add/sub helpers, see resolve_flags
+
+    def add_8_lazy(self, val1, val2, use_carry = False):
+        total = (int(val1) + int(val2) + int(use_carry))
+        self.pending_flags = (FLAGS_ADD_8, val1, val2, use_carry, total)
+        return total % 0x100
+
+    def add_16_lazy(self, val1, val2, use_carry = False):
+        total = (int(val1) + int(val2) + int(use_carry))
+        self.pending_flags = (FLAGS_ADD_16, val1, val2, use_carry, total)
+        return total % 0x10000
+
+    def sub_8_lazy(self, val1, val2, use_carry = False):
+        total = (int(val1) - int(val2) - int(use_carry))
+        self.pending_flags = (FLAGS_SUB_8, val1, val2, use_carry, total)
+        return total % 0x100
+
+    def sub_16_lazy(self, val1, val2, use_carry = False):
+        total = (int(val1) - int(val2) - int(use_carry))
+        self.pending_flags = (FLAGS_SUB_16, val1, val2, use_carry, total)
+        return total % 0x10000
+
+    def resolve_flags(self):
+        # Compute Z/N/H/C for the last recorded add/sub exactly as the eager
+        # helpers would, in a single write to F
+        kind, val1, val2, use_carry, total = self.pending_flags
+        self.pending_flags = None
+        carry = int(use_carry)
+
+        if (kind == FLAGS_ADD_8):
+            z = (total & 0xFF) == 0
+            n = 0
+            h = (val1 & 0x0F) + (val2 & 0x0F) + (carry & 0x0F) > 0x0F
+            c = total > 0xFF
+        elif (kind == FLAGS_SUB_8):
+            z = (total & 0xFF) == 0
+            n = 1
+            h = (val1 & 0xF) < ((val2 & 0xF) + carry)
+            c = total < 0x00
+        elif (kind == FLAGS_ADD_16):
+            z = (total & 0xFFFF) == 0
+            n = 0
+            h = (val1 & 0xFFF) + (val2 & 0xFFF) + (carry & 0x0FFF) > 0x0FFF
+            c = total > 0xFFFF
+        else:
+            z = (total & 0xFFFF) == 0
+            n = 1
+            h = (val1 & 0xFFF) < ((val2 & 0xFFF) + carry)
+            c = total < 0x0000
+
+        self.regs[REG_F] = (self.regs[REG_F] & 0x0F) | (int(z) << 7) | (n << 6) | (int(h) << 5) | (int(c) << 4)
+
+    # Table-driven variants of the 8-bit helpers.  Each entry is
+    # (result << 8) | flags, see alu_tables.
+
+    def add_8_table(self, val1, val2, use_carry = False):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        entry = self.alu['add'][(use_carry << 16) | (val1 << 8) | val2]
+        regs = self.regs
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def sub_8_table(self, val1, val2, use_carry = False):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        entry = self.alu['sub'][(use_carry << 16) | (val1 << 8) | val2]
+        regs = self.regs
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def and_8_table(self, val1, val2):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        entry = self.alu['and_'][(val1 << 8) | val2]
+        regs = self.regs
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def or_8_table(self, val1, val2):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        entry = self.alu['or_'][(val1 << 8) | val2]
+        regs = self.regs
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def xor_8_table(self, val1, val2):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        entry = self.alu['xor'][(val1 << 8) | val2]
+        regs = self.regs
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def inc_8_table(self, val):
+        # INC leaves C alone
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['inc'][val]
+        regs[REG_F] = (regs[REG_F] & 0x1F) | (entry & 0xFF)
+        return entry >> 8
+
+    def dec_8_table(self, val):
+        # DEC leaves C alone
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['dec'][val]
+        regs[REG_F] = (regs[REG_F] & 0x1F) | (entry & 0xFF)
+        return entry >> 8
+
+    def rlc_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['rlc'][val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def rrc_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['rrc'][val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def rl_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['rl'][((regs[REG_F] & 0x10) << 4) | val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def rr_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['rr'][((regs[REG_F] & 0x10) << 4) | val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def sla_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['sla'][val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def sra_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['sra'][val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def srl_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['srl'][val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    def swap_8_table(self, val):
+        # SWAP leaves F alone
+        return self.alu['swap'][val] >> 8
+
+    def daa_8_table(self, val):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        regs = self.regs
+        entry = self.alu['daa'][((regs[REG_F] & 0x70) << 4) | val]
+        regs[REG_F] = (regs[REG_F] & 0x0F) | (entry & 0xFF)
+        return entry >> 8
+
+    # Handlers return None to take their cost from OP_CYCLES, or the cycles
+    # actually spent when that depends on the outcome (taken branches, CB)
     def tick(self):
+        if self.halted:
+            cycles = self.step_halted(4)
+            self.cycles += cycles
+            return cycles
+
         op = self.fetch_8()
-        self.execute(op)
-        self.handle_interrupts()
+        cycles = (self.ops[op]() or OP_CYCLES[op]) + self.handle_interrupts()
+        self.cycles += cycles
+        return cycles
 
     def execute(self, op):
+        return self.ops[op]() or OP_CYCLES[op]
+
+    def run_cycles(self, cycles):
+        return self.run(cycles, None)
+
+    def run_until(self, predicate, max_cycles = None):
+        return self.run(max_cycles, predicate)
+
+    def run(self, max_cycles, predicate):
+        # Runs instructions, as tick() would, until the next instruction
+        # would start at or past max_cycles (None for no limit), PC lands on
+        # a breakpoint, an interrupt is dispatched or predicate(cpu) is true
+        # after an instruction.  Returns (cycles run, STOP_* reason); the
+        # instruction at a breakpoint PC runs when the loop starts there,
+        # so calling again resumes.
+        #
+        # The limit is kept in stop_at, so an event scheduled by a write
+        # during the run (a timer started through TAC, a DMA or serial
+        # transfer) ends it early, at the event.  Backends that hand part
+        # of a run to the interpreter call run_batch(), which runs up to
+        # the same stop_at.
+        #
+        # While halted nothing can change until an event outside the CPU,
+        # so the CPU skips straight to stop_at: the caller (see
+        # Scheduler.run) never asks for cycles past the next event, and an
+        # event scheduled since, by a TAC write just before the HALT say,
+        # has lowered it.  Waking up counts as STOP_INTERRUPT.
+        #
+        # Everything used per instruction is bound to a local and the opcode
+        # is read straight from the MMU page tables.  Bank switches update
+        # read_pages in place, so the local stays valid.
+        #
+        # With a cycle limit and no predicate, a jump backwards may find the
+        # CPU stuck in a waiting loop (see skip_idle_loop), which is then
+        # run up to stop_at in one go.  Memory the loop reads only changes
+        # on scheduled events, and an event scheduled during the call
+        # lowers stop_at, so none falls inside the skip.  Loop state is
+        # only compared within one call, unless the last call ended right
+        # on the loop head: the next iteration then reads only the new
+        # memory.
+        stop_at = self.stop_at
+        end = float('inf') if max_cycles is None else self.cycles + max_cycles
+        if stop_at is None or end < stop_at:
+            self.stop_at = end
+        try:
+            return self.run_batch(max_cycles, predicate)
+        finally:
+            self.stop_at = stop_at
+
+    def run_batch(self, max_cycles, predicate):
+        # As run(), up to the stop_at it has set
+        if self.translator is not None and not self.breakpoints:
+            return self.translator.run(max_cycles, predicate)
+
+        ops = self.ops
+        op_cycles = OP_CYCLES
+        read_pages = self.mmu.read_pages
+        get = self.mmu.get
+        handle_interrupts = self.handle_interrupts
+        breakpoints = self.breakpoints
+        idle_loops = self.idle_loops and max_cycles is not None and predicate is None
+        idle_loop_reads = self.idle_loop_reads
+        if self.idle_state is not None and self.idle_state[1] != self.cycles:
+            self.idle_state = None
+
+        spent = 0
+        reason = STOP_CYCLES
+        while self.cycles < self.stop_at:
+            if self.halted:
+                if max_cycles is None:
+                    skip = 4
+                else:
+                    skip = -(-(self.stop_at - self.cycles) // 4) * 4
+                cycles = self.step_halted(skip)
+                spent += cycles
+                self.cycles += cycles
+                if not self.halted:
+                    reason = STOP_INTERRUPT
+                    break
+                if predicate is not None and predicate(self):
+                    reason = STOP_PREDICATE
+                    break
+                continue
+
+            pc = self.pc
+            if pc & ~0xFFFF:
+                get(pc)     # raises MemoryAccessError, as fetch_8 would
+            self.pc = pc + 1
+            op = read_pages[pc >> 8][pc & 0xFF]
+            cycles = ops[op]() or op_cycles[op]
+
+            if self.interrupt_master_enable:
+                interrupt = handle_interrupts()
+                if interrupt:
+                    spent += cycles + interrupt
+                    self.cycles += cycles + interrupt
+                    reason = STOP_INTERRUPT
+                    break
+
+            spent += cycles
+            self.cycles += cycles
+
+            target = self.pc
+            if target in breakpoints:
+                reason = STOP_BREAKPOINT
+                break
+            # Backward jumps only: JP, not JR (see IDLE_LOOP_OPS)
+            if idle_loops and target <= pc and self.cycles < self.stop_at \
+                    and idle_loop_reads.get((target, pc)) is not False:
+                skipped = self.skip_idle_loop(target, pc, self.stop_at - self.cycles)
+                spent += skipped
+                self.cycles += skipped
+            if predicate is not None and predicate(self):
+                reason = STOP_PREDICATE
+                break
+
+        return spent, reason
+
+    def build_dispatch_tables(self):
+        regs = OPCODE_REGS
+
+        ops = [partial(self.unknown_op, op) for op in range(0x100)]
+        cb_ops = [partial(self.unknown_cb_op, op) for op in range(0x100)]
+
         ## 8-bit loads
-        # LD nn, n
-        if (op == 0x06):
-            n = self.fetch_8()
-            self.LD_nn_n('B', n)
-        elif (op == 0x0E):
-            n = self.fetch_8()
-            self.LD_nn_n('C', n)
-        elif (op == 0x16):
-            n = self.fetch_8()
-            self.LD_nn_n('D', n)
-        elif (op == 0x1E):
-            n = self.fetch_8()
-            self.LD_nn_n('E', n)
-        elif (op == 0x26):
-            n = self.fetch_8()
-            self.LD_nn_n('H', n)
-        elif (op == 0x2E):
-            n = self.fetch_8()
-            self.LD_nn_n('L', n)
-
-        # LD r1, r2
-        elif (op == 0x7F):
-            self.LD_r1_r2('A', 'A')
-        elif (op == 0x78):
-            self.LD_r1_r2('A', 'B')
-        elif (op == 0x79):
-            self.LD_r1_r2('A', 'C')
-        elif (op == 0x7A):
-            self.LD_r1_r2('A', 'D')
-        elif (op == 0x7B):
-            self.LD_r1_r2('A', 'E')
-        elif (op == 0x7C):
-            self.LD_r1_r2('A', 'H')
-        elif (op == 0x7D):
-            self.LD_r1_r2('A', 'L')
-        elif (op == 0x40):
-            self.LD_r1_r2('B', 'B')
-        elif (op == 0x41):
-            self.LD_r1_r2('B', 'C')
-        elif (op == 0x42):
-            self.LD_r1_r2('B', 'D')
-        elif (op == 0x43):
-            self.LD_r1_r2('B', 'E')
-        elif (op == 0x44):
-            self.LD_r1_r2('B', 'H')
-        elif (op == 0x45):
-            self.LD_r1_r2('B', 'L')
-        elif (op == 0x48):
-            self.LD_r1_r2('C', 'B')
-        elif (op == 0x49):
-            self.LD_r1_r2('C', 'C')
-        elif (op == 0x4A):
-            self.LD_r1_r2('C', 'D')
-        elif (op == 0x4B):
-            self.LD_r1_r2('C', 'E')
-        elif (op == 0x4C):
-            self.LD_r1_r2('C', 'H')
-        elif (op == 0x4D):
-            self.LD_r1_r2('C', 'L')
-        elif (op == 0x50):
-            self.LD_r1_r2('D', 'B')
-        elif (op == 0x51):
-            self.LD_r1_r2('D', 'C')
-        elif (op == 0x52):
-            self.LD_r1_r2('D', 'D')
-        elif (op == 0x53):
-            self.LD_r1_r2('D', 'E')
-        elif (op == 0x54):
-            self.LD_r1_r2('D', 'H')
-        elif (op == 0x55):
-            self.LD_r1_r2('D', 'L')
-        elif (op == 0x58):
-            self.LD_r1_r2('E', 'B')
-        elif (op == 0x59):
-            self.LD_r1_r2('E', 'C')
-        elif (op == 0x5A):
-            self.LD_r1_r2('E', 'D')
-        elif (op == 0x5B):
-            self.LD_r1_r2('E', 'E')
-        elif (op == 0x5C):
-            self.LD_r1_r2('E', 'H')
-        elif (op == 0x5D):
-            self.LD_r1_r2('E', 'L')
-        elif (op == 0x60):
-            self.LD_r1_r2('H', 'B')
-        elif (op == 0x61):
-            self.LD_r1_r2('H', 'C')
-        elif (op == 0x62):
-            self.LD_r1_r2('H', 'D')
-        elif (op == 0x63):
-            self.LD_r1_r2('H', 'E')
-        elif (op == 0x64):
-            self.LD_r1_r2('H', 'H')
-        elif (op == 0x65):
-            self.LD_r1_r2('H', 'L')
-        elif (op == 0x68):
-            self.LD_r1_r2('L', 'B')
-        elif (op == 0x69):
-            self.LD_r1_r2('L', 'C')
-        elif (op == 0x6A):
-            self.LD_r1_r2('L', 'D')
-        elif (op == 0x6B):
-            self.LD_r1_r2('L', 'E')
-        elif (op == 0x6C):
-            self.LD_r1_r2('L', 'H')
-        elif (op == 0x6D):
-            self.LD_r1_r2('L', 'L')
-
-        # LD r, (HL)   #Technically part of LD r1, r2
-        elif (op == 0x7E):
-            self.LD_r_HL('A')
-        elif (op == 0x46):
-            self.LD_r_HL('B')
-        elif (op == 0x4E):
-            self.LD_r_HL('C')
-        elif (op == 0x56):
-            self.LD_r_HL('D')
-        elif (op == 0x5E):
-            self.LD_r_HL('E')
-        elif (op == 0x66):
-            self.LD_r_HL('H')
-        elif (op == 0x6E):
-            self.LD_r_HL('L')
-
-        # LD (HL), r   #Technically part of LD r1, r2
-        elif (op == 0x70):
-            self.LD_HL_r('B')
-        elif (op == 0x71):
-            self.LD_HL_r('C')
-        elif (op == 0x72):
-            self.LD_HL_r('D')
-        elif (op == 0x73):
-            self.LD_HL_r('E')
-        elif (op == 0x74):
-            self.LD_HL_r('H')
-        elif (op == 0x75):
-            self.LD_HL_r('L')
+        for i, r in enumerate(regs):
+            if r is None:
+                continue
+
+            # LD nn, n
+            if r != REG_A:
+                ops[0x06 + (i << 3)] = partial(self.LD_nn_n, r)
+
+            # LD r, (HL) & LD (HL), r   #Technically part of LD r1, r2
+            ops[0x46 + (i << 3)] = partial(self.LD_r_HL, r)
+            if r != REG_A:
+                ops[0x70 + i] = partial(self.LD_HL_r, r)
+
+            # LD r1, r2
+            for j, r2 in enumerate(regs):
+                if r2 is None or (r2 == REG_A and r != REG_A):
+                    continue
+                ops[0x40 + (i << 3) + j] = partial(self.LD_r1_r2, r, r2)
 
         # LD (HL), n   #Technically part of LD r1, r2
-        elif (op == 0x36):
-            self.LD_HL_n()
+        ops[0x36] = self.LD_HL_n
 
         # LD A, n
-        elif (op == 0x0A):
-            self.LD_A_rr('BC')
-        elif (op == 0x1A):
-            self.LD_A_rr('DE')
-        elif (op == 0x7E):
-            self.LD_A_rr('HL')
-        elif (op == 0xFA):
-            self.LD_A_nn()
-        elif (op == 0x3E):
-            self.LD_A_n()
+        ops[0x0A] = partial(self.LD_A_rr, REG_BC)
+        ops[0x1A] = partial(self.LD_A_rr, REG_DE)
+        ops[0xFA] = self.LD_A_nn
+        ops[0x3E] = self.LD_A_n
 
         # LD n, A
-        elif (op == 0x47):
-            self.LD_n_A('B')
-        elif (op == 0x4F):
-            self.LD_n_A('C')
-        elif (op == 0x57):
-            self.LD_n_A('D')
-        elif (op == 0x5F):
-            self.LD_n_A('E')
-        elif (op == 0x67):
-            self.LD_n_A('H')
-        elif (op == 0x6F):
-            self.LD_n_A('L')
-        elif (op == 0x02):
-            self.LD_rr_A('BC')
-        elif (op == 0x12):
-            self.LD_rr_A('DE')
-        elif (op == 0x77):
-            self.LD_rr_A('HL')
-        elif (op == 0xEA):
-            self.LD_nn_A()
+        for i, r in enumerate(regs[:6]):
+            ops[0x47 + (i << 3)] = partial(self.LD_n_A, r)
+        ops[0x02] = partial(self.LD_rr_A, REG_BC)
+        ops[0x12] = partial(self.LD_rr_A, REG_DE)
+        ops[0x77] = partial(self.LD_rr_A, REG_HL)
+        ops[0xEA] = self.LD_nn_A
 
         # LD A,C & LD C, A
-        elif (op == 0xF2):
-            self.LD_A_C()
-        elif (op == 0xE2):
-            self.LD_C_A()
+        ops[0xF2] = self.LD_A_C
+        ops[0xE2] = self.LD_C_A
 
         # LDD & LDI
-        elif (op == 0x3A):
-            self.LDD_A_HL()
-        elif (op == 0x32):
-            self.LDD_HL_A()
-        elif (op == 0x2A):
-            self.LDI_A_HL()
-        elif (op == 0x22):
-            self.LDI_HL_A()
+        ops[0x3A] = self.LDD_A_HL
+        ops[0x32] = self.LDD_HL_A
+        ops[0x2A] = self.LDI_A_HL
+        ops[0x22] = self.LDI_HL_A
 
         # LDH
-        elif (op == 0xE0):
-            self.LDH_n_A()
-        elif (op == 0xF0):
-            self.LDH_A_n()
+        ops[0xE0] = self.LDH_n_A
+        ops[0xF0] = self.LDH_A_n
 
         ## 16-bit loads
         # LD n, nn
-        elif (op == 0x01):
-            self.LD_n_nn('BC')
-        elif (op == 0x11):
-            self.LD_n_nn('DE')
-        elif (op == 0x21):
-            self.LD_n_nn('HL')
-        elif (op == 0x31):
-            self.LD_n_nn('SP')
+        for i, rr in enumerate([REG_BC, REG_DE, REG_HL]):
+            ops[0x01 + (i << 4)] = partial(self.LD_n_nn, rr)
+        ops[0x31] = self.LD_SP_nn
 
         # LD SP
-        elif (op == 0xF9):
-            self.LD_SP_HL()
-        elif (op == 0xF8):
-            self.LD_HL_SPn()
-        elif (op == 0x08):
-            self.LD_nn_SP()
+        ops[0xF9] = self.LD_SP_HL
+        ops[0xF8] = self.LD_HL_SPn
+        ops[0x08] = self.LD_nn_SP
 
         # Stack
-        elif (op == 0xF5):
-            self.PUSH_nn('AF')
-        elif (op == 0xC5):
-            self.PUSH_nn('BC')
-        elif (op == 0xD5):
-            self.PUSH_nn('DE')
-        elif (op == 0xE5):
-            self.PUSH_nn('HL')
-        elif (op == 0xF1):
-            self.POP_nn('AF')
-        elif (op == 0xC1):
-            self.POP_nn('BC')
-        elif (op == 0xD1):
-            self.POP_nn('DE')
-        elif (op == 0xE1):
-            self.POP_nn('HL')
+        for i, rr in enumerate([REG_BC, REG_DE, REG_HL]):
+            ops[0xC5 + (i << 4)] = partial(self.PUSH_nn, rr)
+            ops[0xC1 + (i << 4)] = partial(self.POP_nn, rr)
+        ops[0xF5] = self.PUSH_AF
+        ops[0xF1] = self.POP_AF
 
         ## 8-bit ALU
-        # Addition
-        elif (op == 0x87):
-            self.ADD_A_r('A')
-        elif (op == 0x80):
-            self.ADD_A_r('B')
-        elif (op == 0x81):
-            self.ADD_A_r('C')
-        elif (op == 0x82):
-            self.ADD_A_r('D')
-        elif (op == 0x83):
-            self.ADD_A_r('E')
-        elif (op == 0x84):
-            self.ADD_A_r('H')
-        elif (op == 0x85):
-            self.ADD_A_r('L')
-        elif (op == 0x86):
-            self.ADD_A_HL()
-        elif (op == 0xC6):
-            self.ADD_A_n()
-        elif (op == 0x8F):
-            self.ADC_A_r('A')
-        elif (op == 0x88):
-            self.ADC_A_r('B')
-        elif (op == 0x89):
-            self.ADC_A_r('C')
-        elif (op == 0x8A):
-            self.ADC_A_r('D')
-        elif (op == 0x8B):
-            self.ADC_A_r('E')
-        elif (op == 0x8C):
-            self.ADC_A_r('H')
-        elif (op == 0x8D):
-            self.ADC_A_r('L')
-        elif (op == 0x8E):
-            self.ADC_A_HL()
-        elif (op == 0xCE):
-            self.ADC_A_n()
-
-        # Subtraction
-        elif (op == 0x97):
-            self.SUB_A_r('A')
-        elif (op == 0x90):
-            self.SUB_A_r('B')
-        elif (op == 0x91):
-            self.SUB_A_r('C')
-        elif (op == 0x92):
-            self.SUB_A_r('D')
-        elif (op == 0x93):
-            self.SUB_A_r('E')
-        elif (op == 0x94):
-            self.SUB_A_r('H')
-        elif (op == 0x95):
-            self.SUB_A_r('L')
-        elif (op == 0x96):
-            self.SUB_A_HL()
-        elif (op == 0xD6):
-            self.SUB_A_n()
-        elif (op == 0x9F):
-            self.SBC_A_r('A')
-        elif (op == 0x98):
-            self.SBC_A_r('B')
-        elif (op == 0x99):
-            self.SBC_A_r('C')
-        elif (op == 0x9A):
-            self.SBC_A_r('D')
-        elif (op == 0x9B):
-            self.SBC_A_r('E')
-        elif (op == 0x9C):
-            self.SBC_A_r('H')
-        elif (op == 0x9D):
-            self.SBC_A_r('L')
-        elif (op == 0x9E):
-            self.SBC_A_HL()
-        elif (op == 0xDE):
-            self.SBC_A_n()
-
-        # AND/OR/XOR
-        elif (op == 0xA7):
-            self.AND_r('A')
-        elif (op == 0xA0):
-            self.AND_r('B')
-        elif (op == 0xA1):
-            self.AND_r('C')
-        elif (op == 0xA2):
-            self.AND_r('D')
-        elif (op == 0xA3):
-            self.AND_r('E')
-        elif (op == 0xA4):
-            self.AND_r('H')
-        elif (op == 0xA5):
-            self.AND_r('L')
-        elif (op == 0xA6):
-            self.AND_HL()
-        elif (op == 0xE6):
-            self.AND_n()
-        elif (op == 0xB7):
-            self.OR_r('A')
-        elif (op == 0xB0):
-            self.OR_r('B')
-        elif (op == 0xB1):
-            self.OR_r('C')
-        elif (op == 0xB2):
-            self.OR_r('D')
-        elif (op == 0xB3):
-            self.OR_r('E')
-        elif (op == 0xB4):
-            self.OR_r('H')
-        elif (op == 0xB5):
-            self.OR_r('L')
-        elif (op == 0xB6):
-            self.OR_HL()
-        elif (op == 0xF6):
-            self.OR_n()
-        elif (op == 0xAF):
-            self.XOR_r('A')
-        elif (op == 0xA8):
-            self.XOR_r('B')
-        elif (op == 0xA9):
-            self.XOR_r('C')
-        elif (op == 0xAA):
-            self.XOR_r('D')
-        elif (op == 0xAB):
-            self.XOR_r('E')
-        elif (op == 0xAC):
-            self.XOR_r('H')
-        elif (op == 0xAD):
-            self.XOR_r('L')
-        elif (op == 0xAE):
-            self.XOR_HL()
-        elif (op == 0xEE):
-            self.XOR_n()
-        elif (op == 0xBF):
-            self.CP_r('A')
-        elif (op == 0xB8):
-            self.CP_r('B')
-        elif (op == 0xB9):
-            self.CP_r('C')
-        elif (op == 0xBA):
-            self.CP_r('D')
-        elif (op == 0xBB):
-            self.CP_r('E')
-        elif (op == 0xBC):
-            self.CP_r('H')
-        elif (op == 0xBD):
-            self.CP_r('L')
-        elif (op == 0xBE):
-            self.CP_HL()
-        elif (op == 0xFE):
-            self.CP_n()
-        elif (op == 0x3C):
-            self.INC_r('A')
-        elif (op == 0x04):
-            self.INC_r('B')
-        elif (op == 0x0C):
-            self.INC_r('C')
-        elif (op == 0x14):
-            self.INC_r('D')
-        elif (op == 0x1C):
-            self.INC_r('E')
-        elif (op == 0x24):
-            self.INC_r('H')
-        elif (op == 0x2C):
-            self.INC_r('L')
-        elif (op == 0x34):
-            self.INC_HL()
-        elif (op == 0x3D):
-            self.DEC_r('A')
-        elif (op == 0x05):
-            self.DEC_r('B')
-        elif (op == 0x0D):
-            self.DEC_r('C')
-        elif (op == 0x15):
-            self.DEC_r('D')
-        elif (op == 0x1D):
-            self.DEC_r('E')
-        elif (op == 0x25):
-            self.DEC_r('H')
-        elif (op == 0x2D):
-            self.DEC_r('L')
-        elif (op == 0x35):
-            self.DEC_HL()
+        alu_r = [self.ADD_A_r, self.ADC_A_r, self.SUB_A_r, self.SBC_A_r,
+                 self.AND_r, self.XOR_r, self.OR_r, self.CP_r]
+        alu_HL = [self.ADD_A_HL, self.ADC_A_HL, self.SUB_A_HL, self.SBC_A_HL,
+                  self.AND_HL, self.XOR_HL, self.OR_HL, self.CP_HL]
+        alu_n = [self.ADD_A_n, self.ADC_A_n, self.SUB_A_n, self.SBC_A_n,
+                 self.AND_n, self.XOR_n, self.OR_n, self.CP_n]
+        for k in range(8):
+            for i, r in enumerate(regs):
+                if r is None:
+                    ops[0x80 + (k << 3) + i] = alu_HL[k]
+                else:
+                    ops[0x80 + (k << 3) + i] = partial(alu_r[k], r)
+            ops[0xC6 + (k << 3)] = alu_n[k]
+
+        # INC/DEC
+        for i, r in enumerate(regs):
+            if r is None:
+                ops[0x34] = self.INC_HL
+                ops[0x35] = self.DEC_HL
+            else:
+                ops[0x04 + (i << 3)] = partial(self.INC_r, r)
+                ops[0x05 + (i << 3)] = partial(self.DEC_r, r)
 
         ## 16-bit ALU
-        elif (op == 0x09):
-            self.ADD_HL_n('BC')
-        elif (op == 0x19):
-            self.ADD_HL_n('DE')
-        elif (op == 0x29):
-            self.ADD_HL_n('HL')
-        elif (op == 0x39):
-            self.ADD_HL_n('SP')
-        elif (op == 0xE8):
-            self.ADD_SP_n()
-        elif (op == 0x03):
-            self.INC_nn('BC')
-        elif (op == 0x13):
-            self.INC_nn('DE')
-        elif (op == 0x23):
-            self.INC_nn('HL')
-        elif (op == 0x33):
-            self.INC_nn('SP')
-        elif (op == 0x0B):
-            self.DEC_nn('BC')
-        elif (op == 0x1B):
-            self.DEC_nn('DE')
-        elif (op == 0x2B):
-            self.DEC_nn('HL')
-        elif (op == 0x3B):
-            self.DEC_nn('SP')
+        for i, rr in enumerate([REG_BC, REG_DE, REG_HL]):
+            ops[0x09 + (i << 4)] = partial(self.ADD_HL_n, rr)
+            ops[0x03 + (i << 4)] = partial(self.INC_nn, rr)
+            ops[0x0B + (i << 4)] = partial(self.DEC_nn, rr)
+        ops[0x39] = self.ADD_HL_SP
+        ops[0x33] = self.INC_SP
+        ops[0x3B] = self.DEC_SP
+        ops[0xE8] = self.ADD_SP_n
 
         # Misc
-        elif (op == 0x27):
-            self.DAA()
-        elif (op == 0x2F):
-            self.CPL()
-        elif (op == 0x3F):
-            self.CCF()
-        elif (op == 0x37):
-            self.SCF()
+        ops[0x27] = self.DAA
+        ops[0x2F] = self.CPL
+        ops[0x3F] = self.CCF
+        ops[0x37] = self.SCF
 
         # Rotates & shifts
-        elif (op == 0x07):
-            self.RLCA()
-        elif (op == 0x17):
-            self.RLA()
-        elif (op == 0x0F):
-            self.RRCA()
-        elif (op == 0x1F):
-            self.RRA()
+        ops[0x07] = self.RLCA
+        ops[0x17] = self.RLA
+        ops[0x0F] = self.RRCA
+        ops[0x1F] = self.RRA
 
         # Control flow
         # TODO: Sort out interrupts and the likes
-        elif (op == 0x00):
-            self.NOP()
-        elif (op == 0x76):
-            self.HALT()
-        elif (op == 0x10):
-            op2 = self.fetch_8()
-            if (op2 == 0x00):
-                self.STOP()
-        elif (op == 0xF3):
-            self.DI()
-        elif (op == 0xFB):
-            self.EI()
+        ops[0x00] = self.NOP
+        ops[0x76] = self.HALT
+        ops[0x10] = self.STOP
+        ops[0xF3] = self.DI
+        ops[0xFB] = self.EI
 
         # Jumps
-        elif (op == 0xC3):
-            self.JP_nn()
-        elif (op == 0xC2):
-            self.JP_NZ()
-        elif (op == 0xCA):
-            self.JP_Z()
-        elif (op == 0xD2):
-            self.JP_NC()
-        elif (op == 0xDA):
-            self.JP_C()
-        elif (op == 0xE9):
-            self.JP_HL()
-        elif (op == 0x18):
-            self.JR_n()
-        elif (op == 0x20):
-            self.JR_NZ()
-        elif (op == 0x28):
-            self.JR_Z()
-        elif (op == 0x30):
-            self.JR_NC()
-        elif (op == 0x38):
-            self.JR_C()
+        ops[0xC3] = self.JP_nn
+        ops[0xC2] = self.JP_NZ
+        ops[0xCA] = self.JP_Z
+        ops[0xD2] = self.JP_NC
+        ops[0xDA] = self.JP_C
+        ops[0xE9] = self.JP_HL
+        ops[0x18] = self.JR_n
+        ops[0x20] = self.JR_NZ
+        ops[0x28] = self.JR_Z
+        ops[0x30] = self.JR_NC
+        ops[0x38] = self.JR_C
 
         # Calls
-        elif (op == 0xCD):
-            self.CALL_nn()
-        elif (op == 0xC4):
-            self.CALL_NZ()
-        elif (op == 0xCC):
-            self.CALL_Z()
-        elif (op == 0xD4):
-            self.CALL_NC()
-        elif (op == 0xDC):
-            self.CALL_C()
+        ops[0xCD] = self.CALL_nn
+        ops[0xC4] = self.CALL_NZ
+        ops[0xCC] = self.CALL_Z
+        ops[0xD4] = self.CALL_NC
+        ops[0xDC] = self.CALL_C
 
         # Restarts
-        elif (op == 0xC7):
-            self.RST(0x00)
-        elif (op == 0xCF):
-            self.RST(0x08)
-        elif (op == 0xD7):
-            self.RST(0x10)
-        elif (op == 0xDF):
-            self.RST(0x18)
-        elif (op == 0xE7):
-            self.RST(0x20)
-        elif (op == 0xEF):
-            self.RST(0x28)
-        elif (op == 0xF7):
-            self.RST(0x30)
-        elif (op == 0xFF):
-            self.RST(0x38)
+        for n in range(0x00, 0x40, 0x08):
+            ops[0xC7 + n] = partial(self.RST, n)
 
         # Returns
-        elif (op == 0xC9):
-            self.RET()
-        elif (op == 0xC0):
-            self.RET_NZ()
-        elif (op == 0xC8):
-            self.RET_Z()
-        elif (op == 0xD0):
-            self.RET_NC()
-        elif (op == 0xD8):
-            self.RET_C()
-        elif (op == 0xD9):
-            self.RETI()
-
-        # Extended operations:
-        elif (op == 0xCB):
-            op2 = self.fetch_8()
-
-            # Swaps
-            if (op2 == 0x37):
-                self.SWAP_r('A')
-            elif (op2 == 0x30):
-                self.SWAP_r('B')
-            elif (op2 == 0x31):
-                self.SWAP_r('C')
-            elif (op2 == 0x32):
-                self.SWAP_r('D')
-            elif (op2 == 0x33):
-                self.SWAP_r('E')
-            elif (op2 == 0x34):
-                self.SWAP_r('H')
-            elif (op2 == 0x35):
-                self.SWAP_r('L')
-            elif (op2 == 0x36):
-                self.SWAP_HL()
-
-            # Rotates
-            elif (op2 == 0x07):
-                self.RLC_n('A')
-            elif (op2 == 0x00):
-                self.RLC_n('B')
-            elif (op2 == 0x01):
-                self.RLC_n('C')
-            elif (op2 == 0x02):
-                self.RLC_n('D')
-            elif (op2 == 0x03):
-                self.RLC_n('E')
-            elif (op2 == 0x04):
-                self.RLC_n('H')
-            elif (op2 == 0x05):
-                self.RLC_n('L')
-            elif (op2 == 0x17):
-                self.RL_n('A')
-            elif (op2 == 0x10):
-                self.RL_n('B')
-            elif (op2 == 0x11):
-                self.RL_n('C')
-            elif (op2 == 0x12):
-                self.RL_n('D')
-            elif (op2 == 0x13):
-                self.RL_n('E')
-            elif (op2 == 0x14):
-                self.RL_n('H')
-            elif (op2 == 0x15):
-                self.RL_n('L')
-            elif (op2 == 0x0F):
-                self.RRC_n('A')
-            elif (op2 == 0x08):
-                self.RRC_n('B')
-            elif (op2 == 0x09):
-                self.RRC_n('C')
-            elif (op2 == 0x0A):
-                self.RRC_n('D')
-            elif (op2 == 0x0B):
-                self.RRC_n('E')
-            elif (op2 == 0x0C):
-                self.RRC_n('H')
-            elif (op2 == 0x0D):
-                self.RRC_n('L')
-            elif (op2 == 0x1F):
-                self.RR_n('A')
-            elif (op2 == 0x18):
-                self.RR_n('B')
-            elif (op2 == 0x19):
-                self.RR_n('C')
-            elif (op2 == 0x1A):
-                self.RR_n('D')
-            elif (op2 == 0x1B):
-                self.RR_n('E')
-            elif (op2 == 0x1C):
-                self.RR_n('H')
-            elif (op2 == 0x1D):
-                self.RR_n('L')
-            elif (op2 == 0x06):
-                self.RLC_HL()
-            elif (op2 == 0x16):
-                self.RL_HL()
-            elif (op2 == 0x0E):
-                self.RRC_HL()
-            elif (op2 == 0x1E):
-                self.RR_HL()
-
-            # Shifts
-
-            elif (op2 == 0x27):
-                self.SLA_n('A')
-            elif (op2 == 0x20):
-                self.SLA_n('B')
-            elif (op2 == 0x21):
-                self.SLA_n('C')
-            elif (op2 == 0x22):
-                self.SLA_n('D')
-            elif (op2 == 0x23):
-                self.SLA_n('E')
-            elif (op2 == 0x24):
-                self.SLA_n('H')
-            elif (op2 == 0x25):
-                self.SLA_n('L')
-            elif (op2 == 0x2F):
-                self.SRA_n('A')
-            elif (op2 == 0x28):
-                self.SRA_n('B')
-            elif (op2 == 0x29):
-                self.SRA_n('C')
-            elif (op2 == 0x2A):
-                self.SRA_n('D')
-            elif (op2 == 0x2B):
-                self.SRA_n('E')
-            elif (op2 == 0x2C):
-                self.SRA_n('H')
-            elif (op2 == 0x2D):
-                self.SRA_n('L')
-            elif (op2 == 0x3F):
-                self.SRL_n('A')
-            elif (op2 == 0x38):
-                self.SRL_n('B')
-            elif (op2 == 0x39):
-                self.SRL_n('C')
-            elif (op2 == 0x3A):
-                self.SRL_n('D')
-            elif (op2 == 0x3B):
-                self.SRL_n('E')
-            elif (op2 == 0x3C):
-                self.SRL_n('H')
-            elif (op2 == 0x3D):
-                self.SRL_n('L')
-            elif (op2 == 0x26):
-                self.SLA_HL()
-            elif (op2 == 0x2E):
-                self.SRA_HL()
-            elif (op2 == 0x3E):
-                self.SRL_HL()
-
-            # Bit functions
-
-            elif (op2 >= 0x40 and op2 <= 0x7F):
-                self.BIT(op2)
-            elif (op2 >= 0xC0 and op2 <= 0xFF):
-                self.SET(op2)
-            elif (op2 >= 0x80 and op2 <= 0xBF):
-                self.RES(op2)
+        ops[0xC9] = self.RET
+        ops[0xC0] = self.RET_NZ
+        ops[0xC8] = self.RET_Z
+        ops[0xD0] = self.RET_NC
+        ops[0xD8] = self.RET_C
+        ops[0xD9] = self.RETI
+
+        # Extended operations
+        ops[0xCB] = self.CB
+
+        cb_r = [self.RLC_n, self.RRC_n, self.RL_n, self.RR_n,
+                self.SLA_n, self.SRA_n, self.SWAP_r, self.SRL_n]
+        cb_HL = [self.RLC_HL, self.RRC_HL, self.RL_HL, self.RR_HL,
+                 self.SLA_HL, self.SRA_HL, self.SWAP_HL, self.SRL_HL]
+        for k in range(8):
+            for i, r in enumerate(regs):
+                if r is None:
+                    cb_ops[(k << 3) + i] = cb_HL[k]
+                else:
+                    cb_ops[(k << 3) + i] = partial(cb_r[k], r)
+
+        # Bit functions
+        for op2 in range(0x40, 0x80):
+            cb_ops[op2] = partial(self.BIT, op2)
+        for op2 in range(0x80, 0xC0):
+            cb_ops[op2] = partial(self.RES, op2)
+        for op2 in range(0xC0, 0x100):
+            cb_ops[op2] = partial(self.SET, op2)
+
+        self.ops = ops
+        self.cb_ops = cb_ops
+
+    def fuse(self, pairs):
+        # Swaps the handler of the first opcode of each pair for one that
+        # peeks at the next opcode and, if it is the pair's second, runs
+        # both instructions in one fused handler.  The pair then counts as
+        # one instruction: tick() runs both, and interrupts are only checked
+        # after the second.  A breakpoint on the second opcode splits the
+        # pair, so run_cycles still stops there.
+        seconds = {}
+        for pair in pairs:
+            pair = tuple(pair)
+            if pair not in FUSIONS:
+                raise ValueError('No fused handler for opcodes 0x%02X 0x%02X' % pair)
+            name, r = FUSIONS[pair]
+            handler = getattr(self, name)
+            seconds.setdefault(pair[0], {})[pair[1]] = handler if r is None else partial(handler, r)
+            self.fused.add(pair)
+
+        ops = self.ops
+        for first, table in seconds.items():
+            ops[first] = self.fused_op(ops[first], FUSED_FIRST_LENGTHS[first] - 1, table)
+
+    def fused_op(self, plain, offset, seconds):
+        # Handler for a first opcode: a closure rather than a partial, as
+        # it runs for every instance of the opcode, fused or not.  Bank
+        # switches update read_pages in place.
+        read_pages = self.mmu.read_pages
+        get_fused = seconds.get
+        breakpoints = self.breakpoints
+
+        def handler():
+            # PC is past the first opcode, so the second is offset bytes on
+            addr = (self.pc + offset) & 0xFFFF
+            fused = get_fused(read_pages[addr >> 8][addr & 0xFF])
+            if fused is None or addr in breakpoints:
+                return plain()
+            return fused()
+        return handler
+
+    def CB(self):
+        op2 = self.fetch_8()
+        self.cb_ops[op2]()
+        return CB_CYCLES[op2]
+
+    def skip_idle_loop(self, target, branch, remaining):
+        # Called on a jump from branch back to target.  If [target, branch]
+        # holds only IDLE_LOOP_OPS, and the registers are the same as the
+        # last time this jump was taken, the loop is waiting on memory that
+        # cannot change before the next event: skip whole iterations up to
+        # remaining cycles.  Returns the cycles skipped.
+        key = (target, branch)
+        reads = self.idle_loop_reads.get(key)
+        if reads is None:
+            reads = self.idle_loop_reads[key] = self.analyse_idle_loop(target, branch)
+        if reads is False:
+            return 0
+
+        state = (key, bytes(self.regs), self.pending_flags)
+        last = self.idle_state
+        if last is None or last[0] != state:
+            self.idle_state = (state, self.cycles)
+            return 0
+
+        # Reads through registers, with the registers now known
+        volatile = self.mmu.volatile
+        for pair in reads:
+            if pair == READ_C:
+                addr = 0xFF00 | self.regs[REG_C]
             else:
-                raise NotImplementedError('Unknown opcode: 0xCB, ' + hex(op2))
-
-
-        else:
-            raise NotImplementedError('Unknown opcode: ' + hex(op))
+                addr = self.get_pair(pair)
+            if addr in volatile:
+                return 0
+
+        period = self.cycles - last[1]
+        skipped = -(-remaining // period) * period
+        self.skipped_cycles += skipped
+        stats = self.idle_loop_stats.setdefault(key, [0, 0])
+        stats[0] += 1
+        stats[1] += skipped
+        self.idle_state = (state, self.cycles + skipped)
+        return skipped
+
+    def analyse_idle_loop(self, target, branch):
+        # The register-indirect reads of the loop, or False if it can't be
+        # skipped.  Fixed addresses are checked here, once.
+        get = self.mmu.get
+        volatile = self.mmu.volatile
+
+        # After a fused pair, run() reports the first instruction as the
+        # branch: the jump is the second
+        first = get(branch)
+        if first in FUSED_FIRST_LENGTHS and \
+                (first, get(branch + FUSED_FIRST_LENGTHS[first])) in self.fused:
+            branch += FUSED_FIRST_LENGTHS[first]
+
+        if branch - target > MAX_IDLE_LOOP_BYTES:
+            return False
+
+        reads = []
+        addr = target
+        while addr <= branch:
+            op = get(addr)
+            if op == 0xCB:
+                # Register operands, or BIT b, (HL)
+                op2 = get(addr + 1)
+                if op2 & 0x07 == 6:
+                    if not 0x40 <= op2 < 0x80:
+                        return False
+                    reads.append(REG_HL)
+                addr += 2
+                continue
+
+            entry = IDLE_LOOP_OPS.get(op)
+            if entry is None:
+                return False
+            length, operand = entry
+            if operand == READ_N:
+                if 0xFF00 | get(addr + 1) in volatile:
+                    return False
+            elif operand == READ_NN:
+                if get(addr + 1) | (get(addr + 2) << 8) in volatile:
+                    return False
+            elif operand is not None:
+                reads.append(operand)
+            addr += length
+
+        # The jump must have been the last instruction
+        if addr != branch + IDLE_LOOP_OPS.get(get(branch), (0,))[0]:
+            return False
+        return reads
+
+    def idle_report(self):
+        # Cycles skipped in HALT and in waiting loops, and where
+        total = self.cycles or 1
+        lines = ['%d cycles run, %d (%.1f%%) halted, %d (%.1f%%) skipped in idle loops'
+                 % (self.cycles, self.idle_cycles, self.idle_cycles * 100 / total,
+                    self.skipped_cycles, self.skipped_cycles * 100 / total)]
+        for (target, branch), (skips, cycles) in sorted(self.idle_loop_stats.items(),
+                                                         key=lambda item: -item[1][1]):
+            lines.append('  loop 0x%04X-0x%04X: skipped %d times, %d cycles'
+                         % (target, branch, skips, cycles))
+        return '\n'.join(lines)
+
+    def step_halted(self, cycles):
+        # Leaves HALT/STOP if an interrupt it waits for has been requested,
+        # dispatching it when IME is set, otherwise idles for cycles.
+        # Returns the cycles spent.
+        mmu = self.mmu
+        if mmu.get(IF) & mmu.get(IE) & self.wake_mask:
+            self.halted = False
+            self.wake_mask = INT_ALL
+            return 4 + self.handle_interrupts()
+
+        self.idle_cycles += cycles
+        return cycles
+
+    def unknown_op(self, op):
+        raise NotImplementedError('Unknown opcode: ' + hex(op))
+
+    def unknown_cb_op(self, op2):
+        raise NotImplementedError('Unknown opcode: 0xCB, ' + hex(op2))
 
     def handle_interrupts(self):
         if self.interrupt_master_enable:
@@ -883,362 +1214,309 @@ class CPU:
                     self.pc = 0x0060
                     self.mmu.set(0xFF0F, interrupt_flags & ~16)
                 self.interrupt_master_enable = False
+                return INTERRUPT_CYCLES
+        return 0
 
     ## OPCODE FUNCTIONS
     # 8-bit loads
 
-    def LD_nn_n(self, r, val):
-        self.regs[r] = val
+    def LD_nn_n(self, r):
+        self.regs[r] = self.fetch_8()
 
     def LD_r1_r2(self, r1, r2):
         self.regs[r1] = self.regs[r2]
 
     def LD_HL_r(self, r): #Technically part of LD r1, r2
-        addr = self.get_reg_16('HL')
-        self.mmu.set(addr, self.regs[r])
+        regs = self.regs
+        self.mmu.set((regs[REG_H] << 8) | regs[REG_L], regs[r])
 
     def LD_r_HL(self, r): #Technically part of LD r1, r2
-        addr = self.get_reg_16('HL')
-        self.regs[r] = self.mmu.get(addr)
+        regs = self.regs
+        regs[r] = self.mmu.get((regs[REG_H] << 8) | regs[REG_L])
 
     def LD_HL_n(self): #Technically part of LD r1, r2
         n = self.fetch_8()
-        addr = self.get_reg_16('HL')
-        self.mmu.set(addr, n)
+        regs = self.regs
+        self.mmu.set((regs[REG_H] << 8) | regs[REG_L], n)
 
-    def LD_A_rr(self, reg):
-        addr = self.get_reg_16(reg)
-        self.set_reg_8('A', self.mmu.get(addr))
+    def LD_A_rr(self, rr):
+        regs = self.regs
+        regs[REG_A] = self.mmu.get((regs[rr] << 8) | regs[rr + 1])
 
     def LD_A_nn(self):
         addr = self.fetch_16()
-        self.set_reg_8('A', self.mmu.get(addr))
+        self.regs[REG_A] = self.mmu.get(addr)
 
     def LD_A_n(self):
-        self.set_reg_8('A', self.fetch_8())
+        self.regs[REG_A] = self.fetch_8()
 
-    def LD_n_A(self, reg):
-        self.set_reg_8(reg, self.get_reg_8('A'))
+    def LD_n_A(self, r):
+        self.regs[r] = self.regs[REG_A]
 
-    def LD_rr_A(self, reg):
-        addr = self.get_reg_16(reg)
-        self.mmu.set(addr, self.get_reg_8('A'))
+    def LD_rr_A(self, rr):
+        regs = self.regs
+        self.mmu.set((regs[rr] << 8) | regs[rr + 1], regs[REG_A])
 
     def LD_nn_A(self):
         addr = self.fetch_16()
-        self.mmu.set(addr, self.get_reg_8('A'))
+        self.mmu.set(addr, self.regs[REG_A])
 
     def LD_A_C(self):
-        self.set_reg_8('A', self.mmu.get(0xFF00 + self.get_reg_8('C')))
+        regs = self.regs
+        regs[REG_A] = self.mmu.get(0xFF00 + regs[REG_C])
 
     def LD_C_A(self):
-        self.mmu.set(0xFF00 + self.get_reg_8('C'), self.get_reg_8('A'))
+        regs = self.regs
+        self.mmu.set(0xFF00 + regs[REG_C], regs[REG_A])
 
     def LDD_A_HL(self):
-        self.set_reg_8('A', self.mmu.get(self.get_reg_16('HL')))
-        HL = self.get_reg_16('HL')
-        self.set_reg_16('HL', HL - (1 if (HL > 0x00) else -0xFFFF))
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        regs[REG_A] = self.mmu.get(HL)
+        self.set_pair(REG_HL, HL - (1 if (HL > 0x00) else -0xFFFF))
 
     def LDD_HL_A(self):
-        self.mmu.set(self.get_reg_16('HL'), self.get_reg_8('A'))
-        HL = self.get_reg_16('HL')
-        self.set_reg_16('HL', HL - (1 if (HL > 0x00) else -0xFFFF))
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        self.mmu.set(HL, regs[REG_A])
+        self.set_pair(REG_HL, HL - (1 if (HL > 0x00) else -0xFFFF))
 
     def LDI_A_HL(self):
-        self.set_reg_8('A', self.mmu.get(self.get_reg_16('HL')))
-        HL = self.get_reg_16('HL')
-        self.set_reg_16('HL', HL + (1 if (HL < 0xFFFF) else -0xFFFF))
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        regs[REG_A] = self.mmu.get(HL)
+        self.set_pair(REG_HL, HL + (1 if (HL < 0xFFFF) else -0xFFFF))
 
     def LDI_HL_A(self):
-        self.mmu.set(self.get_reg_16('HL'), self.get_reg_8('A'))
-        HL = self.get_reg_16('HL')
-        self.set_reg_16('HL', HL + (1 if (HL < 0xFFFF) else -0xFFFF))
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        self.mmu.set(HL, regs[REG_A])
+        self.set_pair(REG_HL, HL + (1 if (HL < 0xFFFF) else -0xFFFF))
 
     def LDH_n_A(self):
         n = self.fetch_8()
-        self.mmu.set(0xFF00 + n, self.get_reg_8('A'))
+        self.mmu.set(0xFF00 + n, self.regs[REG_A])
 
     def LDH_A_n(self):
         n = self.fetch_8()
-        self.set_reg_8('A', self.mmu.get(0xFF00 + n))
+        self.regs[REG_A] = self.mmu.get(0xFF00 + n)
 
     # 16-bit loads
 
-    def LD_n_nn(self, reg):
-        self.set_reg_16(reg, self.fetch_16())
+    def LD_n_nn(self, rr):
+        self.set_pair(rr, self.fetch_16())
+
+    def LD_SP_nn(self):
+        self.sp = self.fetch_16()
 
     def LD_SP_HL(self):
-        self.set_reg_16('SP', self.get_reg_16('HL'))
+        self.sp = self.get_pair(REG_HL)
 
     def LD_HL_SPn(self):
-        self.set_reg_16('HL', self.add_16(self.fetch_8(), self.get_reg_16('SP')))
+        self.set_pair(REG_HL, self.add_16(self.fetch_8(), self.sp))
 
     def LD_nn_SP(self):
-        val = self.get_reg_16('SP')
+        val = self.sp
         addr = self.fetch_16()
         self.mmu.set(addr, (val & 0x00FF))
         self.mmu.set(addr + 1, (val & 0xFF00) >> 8)
 
-    def PUSH_nn(self, reg):
-        self.push_stack(self.get_reg_16(reg))
+    def PUSH_nn(self, rr):
+        self.push_stack(self.get_pair(rr))
 
-    def POP_nn(self, reg):
-        self.set_reg_16(reg, self.pop_stack())
+    def PUSH_AF(self):
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        self.push_stack(self.get_pair(REG_AF))
 
-    def ADD_A_r(self, reg):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.get_reg_8(reg)
-        ))
+    def POP_nn(self, rr):
+        self.set_pair(rr, self.pop_stack())
+
+    def POP_AF(self):
+        self.pending_flags = None
+        self.set_pair(REG_AF, self.pop_stack())
+
+    def ADD_A_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.add_8(regs[REG_A], regs[r])
 
     def ADD_A_HL(self):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.mmu.get(self.get_reg_16('HL'))
-        ))
+        regs = self.regs
+        regs[REG_A] = self.add_8(
+            regs[REG_A],
+            self.mmu.get((regs[REG_H] << 8) | regs[REG_L])
+        )
 
     def ADD_A_n(self):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.fetch_8()
-        ))
+        regs = self.regs
+        regs[REG_A] = self.add_8(regs[REG_A], self.fetch_8())
 
-    def ADC_A_r(self, reg):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.get_reg_8(reg),
-            True
-        ))
+    def ADC_A_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.add_8(regs[REG_A], regs[r], True)
 
     def ADC_A_HL(self):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.mmu.get(self.get_reg_16('HL')),
+        regs = self.regs
+        regs[REG_A] = self.add_8(
+            regs[REG_A],
+            self.mmu.get((regs[REG_H] << 8) | regs[REG_L]),
             True
-        ))
+        )
 
     def ADC_A_n(self):
-        self.set_reg_8('A', self.add_8(
-            self.get_reg_8('A'),
-            self.fetch_8(),
-            True
-        ))
+        regs = self.regs
+        regs[REG_A] = self.add_8(regs[REG_A], self.fetch_8(), True)
 
-    def SUB_A_r(self, reg):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.get_reg_8(reg)
-        ))
+    def SUB_A_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.sub_8(regs[REG_A], regs[r])
 
     def SUB_A_HL(self):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.mmu.get(self.get_reg_16('HL'))
-        ))
+        regs = self.regs
+        regs[REG_A] = self.sub_8(
+            regs[REG_A],
+            self.mmu.get((regs[REG_H] << 8) | regs[REG_L])
+        )
 
     def SUB_A_n(self):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.fetch_8()
-        ))
+        regs = self.regs
+        regs[REG_A] = self.sub_8(regs[REG_A], self.fetch_8())
 
-    def SBC_A_r(self, reg):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.get_reg_8(reg),
-            True
-        ))
+    def SBC_A_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.sub_8(regs[REG_A], regs[r], True)
 
     def SBC_A_HL(self):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.mmu.get(self.get_reg_16('HL')),
+        regs = self.regs
+        regs[REG_A] = self.sub_8(
+            regs[REG_A],
+            self.mmu.get((regs[REG_H] << 8) | regs[REG_L]),
             True
-        ))
+        )
 
     def SBC_A_n(self):
-        self.set_reg_8('A', self.sub_8(
-            self.get_reg_8('A'),
-            self.fetch_8(),
-            True
-        ))
+        regs = self.regs
+        regs[REG_A] = self.sub_8(regs[REG_A], self.fetch_8(), True)
 
-    def AND_r(self, reg):
-        result = self.get_reg_8('A') & self.get_reg_8(reg)
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 1)
-        self.set_flag('C', 0)
+    def AND_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.and_8(regs[REG_A], regs[r])
 
     def AND_HL(self):
-        result = self.get_reg_8('A') & self.mmu.get(self.get_reg_16('HL'))
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 1)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.and_8(regs[REG_A], self.mmu.get((regs[REG_H] << 8) | regs[REG_L]))
 
     def AND_n(self):
-        result = self.get_reg_8('A') & self.fetch_8()
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 1)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.and_8(regs[REG_A], self.fetch_8())
 
-    def OR_r(self, reg):
-        result = self.get_reg_8('A') | self.get_reg_8(reg)
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+    def OR_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.or_8(regs[REG_A], regs[r])
 
     def OR_HL(self):
-        result = self.get_reg_8('A') | self.mmu.get(self.get_reg_16('HL'))
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.or_8(regs[REG_A], self.mmu.get((regs[REG_H] << 8) | regs[REG_L]))
 
     def OR_n(self):
-        result = self.get_reg_8('A') | self.fetch_8()
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.or_8(regs[REG_A], self.fetch_8())
 
-    def XOR_r(self, reg):
-        result = self.get_reg_8('A') ^ self.get_reg_8(reg)
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+    def XOR_r(self, r):
+        regs = self.regs
+        regs[REG_A] = self.xor_8(regs[REG_A], regs[r])
 
     def XOR_HL(self):
-        result = self.get_reg_8('A') ^ self.mmu.get(self.get_reg_16('HL'))
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.xor_8(regs[REG_A], self.mmu.get((regs[REG_H] << 8) | regs[REG_L]))
 
     def XOR_n(self):
-        result = self.get_reg_8('A') ^ self.fetch_8()
-        self.set_reg_8('A', result)
-        self.set_flag('Z', int(result == 0x00))
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_flag('C', 0)
+        regs = self.regs
+        regs[REG_A] = self.xor_8(regs[REG_A], self.fetch_8())
 
-    def CP_r(self, reg):
-        a = self.get_reg_8('A')
-        self.SUB_A_r(reg)
-        self.set_reg_8('A', a)
+    def CP_r(self, r):
+        regs = self.regs
+        self.sub_8(regs[REG_A], regs[r])
 
     def CP_HL(self):
-        a = self.get_reg_8('A')
-        self.SUB_A_HL()
-        self.set_reg_8('A', a)
+        regs = self.regs
+        self.sub_8(regs[REG_A], self.mmu.get((regs[REG_H] << 8) | regs[REG_L]))
 
     def CP_n(self):
-        a = self.get_reg_8('A')
-        self.SUB_A_n()
-        self.set_reg_8('A', a)
+        self.sub_8(self.regs[REG_A], self.fetch_8())
 
-    def INC_r(self, reg):
-        result = (self.get_reg_8(reg) + 1) % 0x100
-        self.set_flag('Z', (result == 0x00))
-        self.set_flag('N', False)
-        self.set_flag('H', int(((self.get_reg_8(reg) & 0x0F) + 0x01) > 0x0F))
-        self.set_reg_8(reg, result)
+    def INC_r(self, r):
+        regs = self.regs
+        regs[r] = self.inc_8(regs[r])
 
     def INC_HL(self):
-        result = (self.mmu.get(self.get_reg_16('HL')) + 1) % 0x100
-        self.set_flag('Z', (result == 0x00))
-        self.set_flag('N', False)
-        self.set_flag('H', int(((self.mmu.get(self.get_reg_16('HL')) & 0x0F) + 0x01) > 0x0F))
-        self.mmu.set(self.get_reg_16('HL'), result)
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        self.mmu.set(HL, self.inc_8(self.mmu.get(HL)))
 
-    def DEC_r(self, reg):
-        result = (self.get_reg_8(reg) - 1) % 0x100
-        self.set_flag('Z', (result == 0x00))
-        self.set_flag('N', True)
-        self.set_flag('H', int(self.get_reg_8(reg) & 0x0F) == 0)
-        self.set_reg_8(reg, result)
+    def DEC_r(self, r):
+        regs = self.regs
+        regs[r] = self.dec_8(regs[r])
 
     def DEC_HL(self):
-        result = (self.mmu.get(self.get_reg_16('HL')) - 1) % 0x100
-        self.set_flag('Z', (result == 0x00))
-        self.set_flag('N', True)
-        self.set_flag('H', int((self.mmu.get(self.get_reg_16('HL')) & 0x0F) == 0))
-        self.mmu.set(self.get_reg_16('HL'), result)
+        regs = self.regs
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        self.mmu.set(HL, self.dec_8(self.mmu.get(HL)))
 
-    def ADD_HL_n(self, reg):
+    def ADD_HL_n(self, rr):
         # Ensure Z isn't affected
         z = self.get_flag('Z')
-        self.set_reg_16('HL', self.add_16(
-            self.get_reg_16('HL'),
-            self.get_reg_16(reg),
+        self.set_pair(REG_HL, self.add_16(
+            self.get_pair(REG_HL),
+            self.get_pair(rr),
+            False
+        ))
+        self.set_flag('Z', z)
+
+    def ADD_HL_SP(self):
+        # Ensure Z isn't affected
+        z = self.get_flag('Z')
+        self.set_pair(REG_HL, self.add_16(
+            self.get_pair(REG_HL),
+            self.sp,
             False
         ))
         self.set_flag('Z', z)
 
     def ADD_SP_n(self):
-        self.set_reg_16('SP', self.add_16(
-            self.get_reg_16('SP'),
+        self.sp = self.add_16(
+            self.sp,
             self.fetch_16(),
             False
-        ))
+        )
         self.set_flag('Z', 0)
 
-    def INC_nn(self, reg):
-        self.set_reg_16(reg, (self.get_reg_16(reg) + 1) % 0x10000)
+    def INC_nn(self, rr):
+        self.set_pair(rr, (self.get_pair(rr) + 1) % 0x10000)
 
-    def DEC_nn(self, reg):
-        self.set_reg_16(reg, (self.get_reg_16(reg) - 1) % 0x10000)
+    def INC_SP(self):
+        self.sp = (self.sp + 1) % 0x10000
 
-    def SWAP_r(self, reg):
-        oldval = self.get_reg_8(reg)
-        hi = (oldval & 0xF0) >> 4
-        lo = oldval & 0x0F
-        newval = (lo << 4) | hi
+    def DEC_nn(self, rr):
+        self.set_pair(rr, (self.get_pair(rr) - 1) % 0x10000)
 
-        self.set_reg_8(reg, newval)
+    def DEC_SP(self):
+        self.sp = (self.sp - 1) % 0x10000
 
-    def SWAP_HL(self):
-        oldval = self.mmu.get(self.get_reg_16('HL'))
-        hi = (oldval & 0xF0) >> 4
-        lo = oldval & 0x0F
-        newval = (lo << 4) | hi
+    def SWAP_r(self, r):
+        regs = self.regs
+        regs[r] = self.swap_8(regs[r])
 
-        self.mmu.set(self.get_reg_16('HL'), newval)
+    def SWAP_HL(self):
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.swap_8(self.mmu.get(HL)))
 
     def DAA(self):
-        a = self.get_reg_8('A')
-        c = self.get_flag('C')
-        h = self.get_flag('H')
-
-        if (self.get_flag('N')):
-            if (c): a -= 0x60
-            if (h): a -= 0x06
-        else:
-            if (c or a > 0x99):
-                a += 0x60
-                self.set_flag('C', 1)
-            if (h or (a & 0x0F) > 0x09):
-                a += 0x06
-
-        self.set_reg_8('A', a % 0x100)
-        self.set_flag('Z', int(a == 0))
-        self.set_flag('H', 0)
+        regs = self.regs
+        regs[REG_A] = self.daa_8(regs[REG_A])
 
     def CPL(self):
-        self.set_reg_8('A', self.get_reg_8('A') ^ 0xFF)
+        self.regs[REG_A] ^= 0xFF
         self.set_flag('N', 1)
         self.set_flag('H', 1)
 
@@ -1256,12 +1534,26 @@ class CPU:
         pass
 
     def HALT(self):
-        print('HALT called, not implemented, passing')
-        pass
+        mmu = self.mmu
+        if not mmu.get(IF) & mmu.get(IE) & INT_ALL:
+            self.halted = True
+        elif not self.interrupt_master_enable:
+            # HALT bug: with an interrupt already pending and IME clear, HALT
+            # falls straight through and the next opcode byte is read twice,
+            # as PC fails to advance past it.  Run that instruction here with
+            # PC still on its opcode.
+            op = mmu.get(self.pc)
+            return OP_CYCLES[0x76] + (self.ops[op]() or OP_CYCLES[op])
+        # Otherwise IME is set and the pending interrupt is dispatched
+        # straight after this instruction
 
     def STOP(self):
-        print('STOP called, not implemented, passing')
-        pass
+        # STOP is encoded as 0x10 0x00.  It halts until a button is pressed,
+        # and resets DIV.
+        self.fetch_8()
+        self.mmu.set(0xFF04, 0)
+        self.halted = True
+        self.wake_mask = INT_JOYPAD
 
     def DI(self):
         self.interrupt_master_enable = False
@@ -1272,332 +1564,112 @@ class CPU:
     # Rotates
 
     def RLCA(self):
-        val = self.get_reg_8('A') << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-            val += 0x01
-
-        self.set_flag('C', (self.get_reg_8('A') & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_reg_8('A', val)
+        self.RLC_n(REG_A)
 
     def RLA(self):
-        val = self.get_reg_8('A') << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-
-        val += self.get_flag('C')
-
-        self.set_flag('C', (self.get_reg_8('A') & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_reg_8('A', val)
+        self.RL_n(REG_A)
 
     def RRCA(self):
-        val = self.get_reg_8('A')
-
-        carry = val % 2
-        self.set_flag('C', carry)
-        val -= carry
-        val = val >> 1
-        val += 0x80 * carry
-
-        self.set_reg_8('A', val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+        self.RRC_n(REG_A)
 
     def RRA(self):
-        val = self.get_reg_8('A')
-        old_c = self.get_flag('C')
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-
-        self.set_reg_8('A', (val >> 1) + (old_c * 0x80))
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-
-    def RLC_n(self, reg):
-        val = self.get_reg_8(reg) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-            val += 0x01
-
-        self.set_flag('C', (self.get_reg_8(reg) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_reg_8(reg, val)
-
-    def RL_n(self, reg):
-        val = self.get_reg_8(reg) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-
-        val += self.get_flag('C')
+        self.RR_n(REG_A)
 
-        self.set_flag('C', (self.get_reg_8(reg) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_reg_8(reg, val)
+    def RLC_n(self, r):
+        regs = self.regs
+        regs[r] = self.rlc_8(regs[r])
 
-    def RRC_n(self, reg):
-        val = self.get_reg_8(reg)
+    def RL_n(self, r):
+        regs = self.regs
+        regs[r] = self.rl_8(regs[r])
 
-        carry = val % 2
-        self.set_flag('C', carry)
-        val -= carry
-        val = val >> 1
-        val += 0x80 * carry
+    def RRC_n(self, r):
+        regs = self.regs
+        regs[r] = self.rrc_8(regs[r])
 
-        self.set_reg_8(reg, val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-
-    def RR_n(self, reg):
-        val = self.get_reg_8(reg)
-        old_c = self.get_flag('C')
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-
-        self.set_reg_8(reg, (val >> 1) + (old_c * 0x80))
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+    def RR_n(self, r):
+        regs = self.regs
+        regs[r] = self.rr_8(regs[r])
 
     def RLC_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL')) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-            val += 0x01
-
-        self.set_flag('C', (self.mmu.get(self.get_reg_16('HL')) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.mmu.set(self.get_reg_16('HL'), val)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.rlc_8(self.mmu.get(HL)))
 
     def RL_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL')) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-
-        val += self.get_flag('C')
-
-        self.set_flag('C', (self.mmu.get(self.get_reg_16('HL')) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.mmu.set(self.get_reg_16('HL'), val)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.rl_8(self.mmu.get(HL)))
 
     def RRC_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL'))
-
-        carry = val % 2
-        self.set_flag('C', carry)
-        val -= carry
-        val = val >> 1
-        val += 0x80 * carry
-
-        self.mmu.set(self.get_reg_16('HL'), val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.rrc_8(self.mmu.get(HL)))
 
     def RR_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL'))
-        old_c = self.get_flag('C')
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-
-        self.mmu.set(self.get_reg_16('HL'), (val >> 1) + (old_c * 0x80))
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.rr_8(self.mmu.get(HL)))
 
     # Shifts
 
-    def SLA_n(self, reg):
-        val = self.get_reg_8(reg) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-
-        self.set_flag('C', (self.get_reg_8(reg) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.set_reg_8(reg, val)
-
-    def SRA_n(self, reg):
-        val = self.get_reg_8(reg)
-        msb = val & 0b10000000
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-        val = val >> 1
-        val += msb
-
-        self.set_reg_8(reg, val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-
-    def SRL_n(self, reg):
-        val = self.get_reg_8(reg)
+    def SLA_n(self, r):
+        regs = self.regs
+        regs[r] = self.sla_8(regs[r])
 
-        self.set_flag('C', val % 2)
-        val -= val % 2
-        val = val >> 1
+    def SRA_n(self, r):
+        regs = self.regs
+        regs[r] = self.sra_8(regs[r])
 
-        self.set_reg_8(reg, val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+    def SRL_n(self, r):
+        regs = self.regs
+        regs[r] = self.srl_8(regs[r])
 
     def SLA_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL')) << 1
-
-        if ((val & 0x100) >> 8 == 1):
-            val -= 0x100
-
-        self.set_flag('C', (self.mmu.get(self.get_reg_16('HL')) & 0b10000000) >> 7)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
-        self.mmu.set(self.get_reg_16('HL'), val)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.sla_8(self.mmu.get(HL)))
 
     def SRA_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL'))
-        msb = val & 0b10000000
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-        val = val >> 1
-        val += msb
-
-        self.mmu.set(self.get_reg_16('HL'), val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.sra_8(self.mmu.get(HL)))
 
     def SRL_HL(self):
-        val = self.mmu.get(self.get_reg_16('HL'))
-
-        self.set_flag('C', val % 2)
-        val -= val % 2
-        val = val >> 1
+        HL = self.get_pair(REG_HL)
+        self.mmu.set(HL, self.srl_8(self.mmu.get(HL)))
 
-        self.mmu.set(self.get_reg_16('HL'), val)
-        self.set_flag('Z', 1 if val == 0 else 0)
-        self.set_flag('N', 0)
-        self.set_flag('H', 0)
+    # Bit functions
 
     def BIT(self, opcode):
         opcode -= 0x40
-        reg_index = opcode & 0b00000111
-
-        reg = ''
-        if (reg_index == 0):
-            reg = 'B'
-        elif (reg_index == 1):
-            reg = 'C'
-        elif (reg_index == 2):
-            reg = 'D'
-        elif (reg_index == 3):
-            reg = 'E'
-        elif (reg_index == 4):
-            reg = 'H'
-        elif (reg_index == 5):
-            reg = 'L'
-        elif (reg_index == 6):
-            reg = 'HL'
-        elif (reg_index == 7):
-            reg = 'A'
-
-        bit = int((opcode & 0b11111000) / 0x08)
-
-        if (reg == 'HL'):
-            self.set_flag('Z', (self.mmu.get(self.get_reg_16(reg)) >> bit) ^ 0x01)
+        r = OPCODE_REGS[opcode & 0b00000111]
+        bit = (opcode & 0b11111000) >> 3
+
+        if (r is None):
+            self.set_flag('Z', ((self.mmu.get(self.get_pair(REG_HL)) >> bit) & 0x01) ^ 0x01)
         else:
-            self.set_flag('Z', (self.get_reg_8(reg) >> bit) ^ 0x01)
+            self.set_flag('Z', ((self.regs[r] >> bit) & 0x01) ^ 0x01)
 
         self.set_flag('N', 0)
         self.set_flag('H', 1)
 
     def SET(self, opcode):
         opcode -= 0xC0
-        reg_index = opcode & 0b00000111
-
-        reg = ''
-        if (reg_index == 0):
-            reg = 'B'
-        elif (reg_index == 1):
-            reg = 'C'
-        elif (reg_index == 2):
-            reg = 'D'
-        elif (reg_index == 3):
-            reg = 'E'
-        elif (reg_index == 4):
-            reg = 'H'
-        elif (reg_index == 5):
-            reg = 'L'
-        elif (reg_index == 6):
-            reg = 'HL'
-        elif (reg_index == 7):
-            reg = 'A'
-
-        bit = int((opcode & 0b11111000) / 0x08)
-
-        if (reg == 'HL'):
-            self.mmu.set(self.get_reg_16(reg), self.mmu.get(self.get_reg_16(reg)) | (0x01 << bit))
+        r = OPCODE_REGS[opcode & 0b00000111]
+        bit = (opcode & 0b11111000) >> 3
+
+        if (r is None):
+            HL = self.get_pair(REG_HL)
+            self.mmu.set(HL, self.mmu.get(HL) | (0x01 << bit))
         else:
-            self.set_reg_8(reg, self.get_reg_8(reg) | (0x01 << bit))
+            self.regs[r] |= (0x01 << bit)
         self.set_flag('H', 1)
 
     def RES(self, opcode):
         opcode -= 0x80
-        reg_index = opcode & 0b00000111
-
-        reg = ''
-        if (reg_index == 0):
-            reg = 'B'
-        elif (reg_index == 1):
-            reg = 'C'
-        elif (reg_index == 2):
-            reg = 'D'
-        elif (reg_index == 3):
-            reg = 'E'
-        elif (reg_index == 4):
-            reg = 'H'
-        elif (reg_index == 5):
-            reg = 'L'
-        elif (reg_index == 6):
-            reg = 'HL'
-        elif (reg_index == 7):
-            reg = 'A'
-
-        bit = int((opcode & 0b11111000) / 0x08)
-
-        if (reg == 'HL'):
-            self.mmu.set(self.get_reg_16(reg), self.mmu.get(self.get_reg_16(reg)) & ((0x01 << bit)^ 0xFF))
+        r = OPCODE_REGS[opcode & 0b00000111]
+        bit = (opcode & 0b11111000) >> 3
+
+        if (r is None):
+            HL = self.get_pair(REG_HL)
+            self.mmu.set(HL, self.mmu.get(HL) & ((0x01 << bit) ^ 0xFF))
         else:
-            self.set_reg_8(reg, self.get_reg_8(reg) & ((0x01 << bit) ^ 0xFF))
+            self.regs[r] &= ((0x01 << bit) ^ 0xFF)
 
     # Jumps
 
@@ -1607,29 +1679,33 @@ class CPU:
     def JP_NZ(self):
         if (self.get_flag('Z') == 0):
             self.pc = self.fetch_16()
+            return JP_TAKEN
         else:
             self.pc += 2
 
     def JP_Z(self):
         if (self.get_flag('Z') == 1):
             self.pc = self.fetch_16()
+            return JP_TAKEN
         else:
             self.pc += 2
 
     def JP_NC(self):
         if (self.get_flag('C') == 0):
             self.pc = self.fetch_16()
+            return JP_TAKEN
         else:
             self.pc += 2
 
     def JP_C(self):
         if (self.get_flag('C') == 1):
             self.pc = self.fetch_16()
+            return JP_TAKEN
         else:
             self.pc += 2
 
     def JP_HL(self):
-        self.pc = self.get_reg_16('HL')
+        self.pc = self.get_pair(REG_HL)
 
     def JR_n(self):
         self.pc += self.fetch_8()
@@ -1637,24 +1713,28 @@ class CPU:
     def JR_NZ(self):
         if (self.get_flag('Z') == 0):
             self.pc += self.fetch_8()
+            return JR_TAKEN
         else:
             self.pc += 1
 
     def JR_Z(self):
         if (self.get_flag('Z') == 1):
             self.pc += self.fetch_8()
+            return JR_TAKEN
         else:
             self.pc += 1
 
     def JR_NC(self):
         if (self.get_flag('C') == 0):
             self.pc += self.fetch_8()
+            return JR_TAKEN
         else:
             self.pc += 1
 
     def JR_C(self):
         if (self.get_flag('C') == 1):
             self.pc += self.fetch_8()
+            return JR_TAKEN
         else:
             self.pc += 1
 
@@ -1667,24 +1747,28 @@ class CPU:
     def CALL_NZ(self):
         if (self.get_flag('Z') == 0):
             self.CALL_nn()
+            return CALL_TAKEN
         else:
             self.pc += 2
 
     def CALL_Z(self):
         if (self.get_flag('Z') == 1):
             self.CALL_nn()
+            return CALL_TAKEN
         else:
             self.pc += 2
 
     def CALL_NC(self):
         if (self.get_flag('C') == 0):
             self.CALL_nn()
+            return CALL_TAKEN
         else:
             self.pc += 2
 
     def CALL_C(self):
         if (self.get_flag('C') == 1):
             self.CALL_nn()
+            return CALL_TAKEN
         else:
             self.pc += 2
 
@@ -1702,19 +1786,102 @@ class CPU:
     def RET_NZ(self):
         if (self.get_flag('Z') == 0):
             self.RET()
+            return RET_TAKEN
 
     def RET_Z(self):
         if (self.get_flag('Z') == 1):
             self.RET()
+            return RET_TAKEN
 
     def RET_NC(self):
         if (self.get_flag('C') == 0):
             self.RET()
+            return RET_TAKEN
 
     def RET_C(self):
         if (self.get_flag('C') == 1):
             self.RET()
+            return RET_TAKEN
 
     def RETI(self):
         self.EI()
         self.RET()
+
+    # Superinstructions (see fuse).  PC is past the first opcode.  Each
+    # returns the cycles of both instructions, and leaves the same state
+    # as running them one after the other.
+
+    def DEC_r_JR_NZ(self, r):
+        regs = self.regs
+        regs[r] = self.dec_8(regs[r])
+        pc = self.pc
+        if regs[r]:
+            self.pc = pc + 1 + self.mmu.get(pc + 1)
+            return OP_CYCLES[0x05] + JR_TAKEN
+        self.pc = pc + 2
+        return OP_CYCLES[0x05] + OP_CYCLES[0x20]
+
+    def DEC_r_JP_NZ(self, r):
+        regs = self.regs
+        regs[r] = self.dec_8(regs[r])
+        pc = self.pc
+        if regs[r]:
+            mmu = self.mmu
+            self.pc = mmu.get(pc + 1) | (mmu.get(pc + 2) << 8)
+            return OP_CYCLES[0x05] + JP_TAKEN
+        self.pc = pc + 3
+        return OP_CYCLES[0x05] + OP_CYCLES[0xC2]
+
+    def CP_n_JR(self, equal):
+        # CP n sets Z exactly when A == n
+        mmu = self.mmu
+        pc = self.pc
+        n = mmu.get(pc)
+        a = self.regs[REG_A]
+        self.sub_8(a, n)
+        if (a == n) == equal:
+            self.pc = pc + 2 + mmu.get(pc + 2)
+            return OP_CYCLES[0xFE] + JR_TAKEN
+        self.pc = pc + 3
+        return OP_CYCLES[0xFE] + OP_CYCLES[0x20]
+
+    def CP_n_JR_NZ(self):
+        return self.CP_n_JR(False)
+
+    def CP_n_JR_Z(self):
+        return self.CP_n_JR(True)
+
+    def CP_n_JP(self, equal):
+        mmu = self.mmu
+        pc = self.pc
+        n = mmu.get(pc)
+        a = self.regs[REG_A]
+        self.sub_8(a, n)
+        if (a == n) == equal:
+            self.pc = mmu.get(pc + 2) | (mmu.get(pc + 3) << 8)
+            return OP_CYCLES[0xFE] + JP_TAKEN
+        self.pc = pc + 4
+        return OP_CYCLES[0xFE] + OP_CYCLES[0xC2]
+
+    def CP_n_JP_NZ(self):
+        return self.CP_n_JP(False)
+
+    def CP_n_JP_Z(self):
+        return self.CP_n_JP(True)
+
+    def LDI_A_HL_LD_DE_A(self):
+        regs = self.regs
+        mmu = self.mmu
+        HL = (regs[REG_H] << 8) | regs[REG_L]
+        a = regs[REG_A] = mmu.get(HL)
+        self.set_pair(REG_HL, HL + (1 if (HL < 0xFFFF) else -0xFFFF))
+        mmu.set((regs[REG_D] << 8) | regs[REG_E], a)
+        self.pc += 1
+        return OP_CYCLES[0x2A] + OP_CYCLES[0x12]
+
+    def LDH_A_n_AND_n(self):
+        mmu = self.mmu
+        pc = self.pc
+        self.regs[REG_A] = self.and_8(mmu.get(0xFF00 + mmu.get(pc)), mmu.get(pc + 2))
+        self.pc = pc + 3
+        return OP_CYCLES[0xF0] + OP_CYCLES[0xE6]
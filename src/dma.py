@@ -0,0 +1,40 @@
+from scheduler import EVENT_DMA
+
+# OAM DMA source register: writing XX copies XX00-XX9F into OAM
+DMA = 0xFF46
+
+OAM_SIZE = 0xA0
+
+# 160 machine cycles, one byte each
+DMA_CYCLES = 640
+
+class OAMDMA:
+    # The copy is made in one go when the transfer completes.  Games wait
+    # out the transfer in high RAM, so nothing they can see depends on the
+    # order the bytes arrive in.
+    def __init__(self, mmu, scheduler):
+        self.mmu = mmu
+        self.scheduler = scheduler
+        self.source = 0
+        self.transfers = 0
+
+        mmu.map_io(DMA, self.read_dma, self.write_dma)
+
+    def read_dma(self, addr):
+        return self.source
+
+    def write_dma(self, addr, val):
+        self.source = val
+        # A new transfer restarts the running one
+        self.scheduler.cancel(EVENT_DMA)
+        self.scheduler.schedule(DMA_CYCLES, EVENT_DMA, self.complete)
+
+    def complete(self, time):
+        # Sources from 0xE000 up read the echo of work RAM
+        start = self.source << 8
+        if start >= 0xE000:
+            start -= 0x2000
+
+        get = self.mmu.get
+        self.mmu.OAM[:OAM_SIZE] = [get(addr) for addr in range(start, start + OAM_SIZE)]
+        self.transfers += 1
@@ -2,4 +2,8 @@ from enum import Enum, auto
 
 class Events(Enum):
     QUIT = auto()
+    SPEED_REALTIME = auto()
+    SPEED_2X = auto()
+    SPEED_4X = auto()
+    SPEED_UNCAPPED = auto()
 
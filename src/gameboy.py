@@ -0,0 +1,70 @@
+from cpu import CPU, STOP_BREAKPOINT
+from dma import OAMDMA
+from link import SerialPort
+from mmu import MMU
+from ppu import PPU, CYCLES_PER_FRAME, LCDC, BGP, OBP0, OBP1
+from scheduler import Scheduler
+from timer import Timer
+from translator import cache_path
+
+# Register values left behind by the DMG boot ROM, which is not run
+POST_BOOT_REGISTERS = {
+    LCDC: 0x91,
+    BGP: 0xFC,
+    OBP0: 0xFF,
+    OBP1: 0xFF
+}
+
+class GameBoy:
+    # The whole machine: CPU, memory and the scheduled hardware around them,
+    # all running off the CPU's clock through one Scheduler.
+    def __init__(self, rom_file, save_path = None, flat_memory = False,
+                 lazy_flags = False, alu_tables = None, idle_loops = True, translate = False,
+                 block_cache = None, fusions = None, cpu_backend = 'python'):
+        self.mmu = MMU(rom_file, flat_memory=flat_memory, save_path=save_path)
+
+        # The CPU class by backend name, see numba_cpu.BACKENDS
+        cpu_class = CPU
+        if cpu_backend != 'python':
+            from numba_cpu import BACKENDS
+            if cpu_backend not in BACKENDS:
+                raise ValueError('Unknown CPU backend: ' + str(cpu_backend))
+            cpu_class = BACKENDS[cpu_backend]
+        self.cpu = cpu_class(self.mmu, lazy_flags=lazy_flags, alu_tables=alu_tables,
+                             idle_loops=idle_loops, translate=translate, fusions=fusions)
+        self.scheduler = Scheduler(self.cpu)
+
+        # Translated ROM blocks are kept in the block_cache directory
+        # between runs, if given; see save_block_cache
+        self.block_cache_path = None
+        translator = self.cpu.translator
+        if translator is not None and block_cache is not None:
+            self.block_cache_path = cache_path(block_cache, rom_file, translator.inline_flags)
+            translator.load_cache(self.block_cache_path)
+
+        self.ppu = PPU(self.mmu)
+        self.ppu.attach(self.scheduler)
+        self.timer = Timer(self.mmu, self.scheduler)
+        self.dma = OAMDMA(self.mmu, self.scheduler)
+        self.serial = SerialPort(self.mmu, self.scheduler)
+
+        for addr, val in POST_BOOT_REGISTERS.items():
+            self.mmu.set(addr, val)
+
+        # Frames end on a fixed grid, however far the last instruction of a
+        # frame overshoots
+        self.frame_end = self.cpu.cycles
+
+    def run_frame(self):
+        # Runs one frame, CYCLES_PER_FRAME, and returns the framebuffer.
+        # Stops early, returning None, if a CPU breakpoint is hit.
+        self.frame_end += CYCLES_PER_FRAME
+        if self.scheduler.run(self.frame_end) == STOP_BREAKPOINT:
+            self.frame_end = self.cpu.cycles
+            return None
+        return self.ppu.framebuffer
+
+    def save_block_cache(self):
+        # Writes the blocks translated so far to the block cache, if any
+        if self.block_cache_path is not None:
+            self.cpu.translator.save_cache(self.block_cache_path)
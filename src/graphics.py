@@ -1,37 +1,107 @@
 from events import Events
-import pygame
+from palette import PaletteLUT
 import numpy as np
 
+# Video backends share Graphics; only PygameGraphics imports pygame, so
+# headless runs never pay for loading or initialising it.
+
 class Graphics:
     def get_test_pattern(self, mmu):
-        pixel_values = np.zeros(shape=(self.GB_PARAMS['screen_res'][0], self.GB_PARAMS['screen_res'][1],3), dtype='uint8')
+        width, height = self.GB_PARAMS['screen_res']
+
+        # Print ROM bytes as pixel data as a test pattern: pixel (x, y) shows
+        # the byte at 0x150 + x*160 + y, so the whole pattern is a strided
+        # view over the ROM starting at 0x150
+        rom = np.frombuffer(mmu.ROM, dtype=np.uint8)
+        if 0x150 + (width - 1) * 160 + height > len(rom):
+            raise IndexError('ROM too small for test pattern')
+        rom_bytes = np.lib.stride_tricks.as_strided(rom[0x150:], shape=(width, height),
+                                                    strides=(160, 1), writeable=False)
 
-        for x in range(0, self.GB_PARAMS['screen_res'][0]):
-            for y in range(0, self.GB_PARAMS['screen_res'][1]):
-                # Print ROM bytes as pixel data as a test pattern
-                pixel_values[x][y] = [mmu.get((x*160)+y+0x150)&224,      #RED = Highest 3 bits  (byte AND 11100000)
-                                      (mmu.get((x*160)+y+0x150)&28)<<3,  #BLUE = Middle 3 bits  (byte AND 00011100 << 3)
-                                      (mmu.get((x*160)+y+0x150)&3)<<6]   #GREEN = Lowest 2 bits (byte AND 00000011 << 6)
+        pixel_values = np.empty(shape=(width, height, 3), dtype='uint8')
+        pixel_values[:, :, 0] = rom_bytes & 224          #RED = Highest 3 bits  (byte AND 11100000)
+        pixel_values[:, :, 1] = (rom_bytes & 28) << 3    #BLUE = Middle 3 bits  (byte AND 00011100 << 3)
+        pixel_values[:, :, 2] = (rom_bytes & 3) << 6     #GREEN = Lowest 2 bits (byte AND 00000011 << 6)
 
         return pixel_values
 
+    def get_frame_pixels(self, ppu):
+        return self.palette_lut.convert(ppu.framebuffer, ppu.line_palettes)
+
     def draw(self, pixel_values):
-        pygame.surfarray.blit_array(self.screen, pixel_values)
-        self.clock.tick(60)
-        pygame.display.flip()
+        raise NotImplementedError('No video backend selected')
 
     def get_events(self):
+        raise NotImplementedError('No video backend selected')
+
+    def __init__(self, GB_PARAMS):
+        self.GB_PARAMS = GB_PARAMS
+        self.palette_lut = PaletteLUT(*self.GB_PARAMS['screen_res'])
+
+class PygameGraphics(Graphics):
+    # The pygame window.  Frame pacing is up to the caller (see pacing.py).
+    # Keys 1, 2 and 4 select realtime, 2x and 4x speed, and 0 uncapped.
+    def draw(self, pixel_values):
+        self.pygame.surfarray.blit_array(self.screen, pixel_values)
+        self.pygame.display.flip()
+
+    def get_events(self):
+        pygame = self.pygame
         try:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     return Events.QUIT
+                if event.type == pygame.KEYDOWN and event.key in self.speed_keys:
+                    return self.speed_keys[event.key]
         except:
             print("Can't get events, video system not initialised.")
 
     def __init__(self, GB_PARAMS):
-        self.GB_PARAMS = GB_PARAMS
-        
+        super().__init__(GB_PARAMS)
+
+        import pygame
+        self.pygame = pygame
+
         pygame.init()
         self.screen = pygame.display.set_mode(self.GB_PARAMS['screen_res'])
         pygame.display.set_caption('pygbemu')
-        self.clock = pygame.time.Clock()
+        self.speed_keys = {
+            pygame.K_1: Events.SPEED_REALTIME,
+            pygame.K_2: Events.SPEED_2X,
+            pygame.K_4: Events.SPEED_4X,
+            pygame.K_0: Events.SPEED_UNCAPPED
+        }
+
+class NullGraphics(Graphics):
+    # Discards frames; for batch runs that only need the emulation
+    def draw(self, pixel_values):
+        pass
+
+    def get_events(self):
+        return None
+
+class FramebufferGraphics(Graphics):
+    # Keeps the last frame drawn in self.frame, a preallocated (width,
+    # height, 3) array, for callers that want the pixels without a display
+    def draw(self, pixel_values):
+        self.frame[:] = pixel_values
+        self.frames_drawn += 1
+
+    def get_events(self):
+        return None
+
+    def __init__(self, GB_PARAMS):
+        super().__init__(GB_PARAMS)
+        self.frame = np.zeros(shape=(self.GB_PARAMS['screen_res'][0], self.GB_PARAMS['screen_res'][1], 3), dtype='uint8')
+        self.frames_drawn = 0
+
+VIDEO_BACKENDS = {
+    'pygame': PygameGraphics,
+    'null': NullGraphics,
+    'numpy': FramebufferGraphics
+}
+
+def create_graphics(backend, GB_PARAMS):
+    if backend not in VIDEO_BACKENDS:
+        raise NotImplementedError('Unknown video backend ' + backend)
+    return VIDEO_BACKENDS[backend](GB_PARAMS)
@@ -0,0 +1,38 @@
+from mmu import INT_SERIAL
+from scheduler import EVENT_SERIAL
+
+# Serial registers
+SB = 0xFF01
+SC = 0xFF02
+
+SC_START = 0x80
+SC_INTERNAL_CLOCK = 0x01
+
+# 8 bits at 8192 Hz
+TRANSFER_CYCLES = 8 * 512
+
+class SerialPort:
+    # A link port with no cable attached.  A transfer on the internal clock
+    # completes after TRANSFER_CYCLES, shifting in 0xFF, and requests the
+    # serial interrupt; on the external clock it never completes.  Every
+    # byte sent is kept in self.output, as test ROMs print through it.
+    def __init__(self, mmu, scheduler):
+        self.mmu = mmu
+        self.scheduler = scheduler
+        self.output = bytearray()
+
+        mmu.map_io(SC, write=self.write_sc)
+
+    def write_sc(self, addr, val):
+        regs = self.mmu.HW_REGS_TEMP
+        regs[SC - 0xFF00] = val
+        if val & SC_START and val & SC_INTERNAL_CLOCK:
+            self.output.append(int(regs[SB - 0xFF00]))
+            self.scheduler.cancel(EVENT_SERIAL)
+            self.scheduler.schedule(TRANSFER_CYCLES, EVENT_SERIAL, self.complete)
+
+    def complete(self, time):
+        regs = self.mmu.HW_REGS_TEMP
+        regs[SB - 0xFF00] = 0xFF
+        regs[SC - 0xFF00] &= ~SC_START & 0xFF
+        self.mmu.request_interrupt(INT_SERIAL)
@@ -1,154 +1,239 @@
 import numpy as np
+from cartridge import create_cartridge
 from exceptions.memory_access_error import MemoryAccessError
 
+# Interrupt flag and enable registers, and their bits
+IF = 0xFF0F
+IE = 0xFFFF
+INT_VBLANK = 0x01
+INT_STAT = 0x02
+INT_TIMER = 0x04
+INT_SERIAL = 0x08
+INT_JOYPAD = 0x10
+INT_ALL = 0x1F
+
+class HandlerPage:
+    # Stands in for a memory view in the page tables for pages that need
+    # more than a plain buffer access.  read/write are called with the full
+    # address.
+    def __init__(self, base, read, write):
+        self.base = base
+        self.read = read
+        self.write = write
+
+    def __getitem__(self, offset):
+        return self.read(self.base + offset)
+
+    def __setitem__(self, offset, val):
+        self.write(self.base + offset, val)
+
 class MMU:
 
-    def __init__(self, rom_file):
+    def __init__(self, rom_file, flat_memory = False, save_path = None):
         self.ROM = rom_file
-        self.WORK_RAM = np.zeros(8192, dtype=np.uint8)
-        self.EXT_RAM = np.zeros(8192, dtype=np.uint8)
-        self.CHAR_RAM = np.zeros(6144, dtype=np.uint8)
-        self.BG_MAP_1 = np.zeros(1024, dtype=np.uint8)
-        self.BG_MAP_2 = np.zeros(1024, dtype=np.uint8)
-        self.OAM = np.zeros(1024, dtype=np.uint8)
-        self.HIGH_RAM = np.zeros(127, dtype=np.uint8)
+        self.flat_memory = flat_memory
+
+        # The cartridge owns the ROM and external RAM banks.  Battery-backed
+        # RAM is kept in save_path, if given.
+        self.cartridge = create_cartridge(rom_file, save_path)
+        self.EXT_RAM = self.cartridge.RAM
+
+        if flat_memory:
+            # One buffer laid out like the address map, with the regions as
+            # views into it, so bulk copies can slice self.memory directly.
+            # The cartridge ROM and RAM banks live in the cartridge, so
+            # 0x0000-0x7FFF, 0xA000-0xBFFF and the echo/unusable ranges of
+            # the buffer are never mapped.
+            self.memory = bytearray(0x10000)
+            self.WORK_RAM = self.region(0xC000, 8192)
+            self.CHAR_RAM = self.region(0x8000, 6144)
+            self.BG_MAP_1 = self.region(0x9800, 1024)
+            self.BG_MAP_2 = self.region(0x9C00, 1024)
+            self.OAM = self.region(0xFE00, 160)
+            self.HIGH_RAM = self.region(0xFF80, 127)
+            self.HW_REGS_TEMP = self.region(0xFF00, 128)
+        else:
+            self.memory = None
+            self.WORK_RAM = np.zeros(8192, dtype=np.uint8)
+            self.CHAR_RAM = np.zeros(6144, dtype=np.uint8)
+            self.BG_MAP_1 = np.zeros(1024, dtype=np.uint8)
+            self.BG_MAP_2 = np.zeros(1024, dtype=np.uint8)
+            self.OAM = np.zeros(1024, dtype=np.uint8)
+            self.HIGH_RAM = np.zeros(127, dtype=np.uint8)
+            self.HW_REGS_TEMP = np.zeros(128, dtype=np.uint8)
+
         self.INTERRUPT = 0x00
 
-        self.HW_REGS_TEMP = np.zeros(128, dtype=np.uint8)
+        # Hardware registers backed by a component rather than HW_REGS_TEMP,
+        # by address (see map_io)
+        self.io_read = {}
+        self.io_write = {}
 
-    def get(self, addr):
+        # Registers whose value moves with the clock between scheduled
+        # events (DIV...), which a waiting loop may not be skipped over
+        self.volatile = set()
+
+        self.build_page_tables()
+
+    def build_page_tables(self):
         # Memory map reference: http://gameboy.mongenel.com/dmg/asmmemmap.html
+        #
+        # One entry per 256-byte page (addr >> 8).  Plain memory pages hold a
+        # view of their backing buffer starting at the page boundary, so an
+        # access is pages[addr >> 8][addr & 0xFF].  Everything else holds a
+        # HandlerPage.
+        self.read_pages = [None] * 0x100
+        self.write_pages = [None] * 0x100
 
         # Cartridge ROM bank 0 0x0000-0x3FFF
-        if addr >= 0x0000 and addr <= 0x3FFF:
-            addr_adj = addr
-            return self.ROM[addr_adj]
-
         # Cartridge ROM switchable bank 0x4000-0x7FFF
-        elif addr >= 0x4000 and addr <= 0x7FFF:
-            # TODO: Implement bank switching; currently just 32K max rom size
-            addr_adj = addr
-            return self.ROM[addr_adj]
+        # Writes go to the memory bank controller
+        for page in range(0x00, 0x80):
+            self.write_pages[page] = HandlerPage(page << 8, self.unimplemented, self.write_cartridge)
 
         # Character RAM 0x8000-0x97FF
-        elif addr >= 0x8000 and addr <= 0x97FF:
-            addr_adj = addr - 0x8000
-            return self.CHAR_RAM[addr_adj]
+        # Writes also mark the tile dirty for the PPU's decoded tile cache
+        self.map_pages(0x8000, 0x9800, self.CHAR_RAM)
+        self.char_ram_view = memoryview(self.CHAR_RAM)
+        self.dirty_tiles = set()
+        for page in range(0x80, 0x98):
+            self.write_pages[page] = HandlerPage(page << 8, self.unimplemented, self.set_char_ram)
 
-        # BG Map Data 1 0x9800-0x9BF
-        elif addr >= 0x9800 and addr <= 0x9BFF:
-            addr_adj = addr - 0x9800
-            return self.BG_MAP_1[addr_adj]
+        # BG Map Data 1 0x9800-0x9BFF
+        self.map_pages(0x9800, 0x9C00, self.BG_MAP_1)
 
         # BG Map Data 2 0x9C00-0x9FFF
-        elif addr >= 0x9C00 and addr <= 0x9FFF:
-            addr_adj = addr - 0x9C00
-            return self.BG_MAP_2[addr_adj]
+        self.map_pages(0x9C00, 0xA000, self.BG_MAP_2)
 
         # External RAM (if available) 0xA000-0xBFFF
-        elif addr >= 0xA000 and addr <= 0xBFFF:
-            addr_adj = addr - 0xA000
-            return self.EXT_RAM[addr_adj]
+        self.map_cartridge()
 
         # Work RAM 0xC000-0xDFFF
-        elif addr >= 0xC000 and addr <= 0xDFFF:
-            addr_adj = addr - 0xC000
-            return self.WORK_RAM[addr_adj]
+        self.map_pages(0xC000, 0xE000, self.WORK_RAM)
 
         # Echo RAM (Reserved, shouldn't be used) 0xE000-0xFDFF
-        elif addr >= 0xE000 and addr <= 0xFDFF:
-            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+        for page in range(0xE0, 0xFE):
+            self.read_pages[page] = self.write_pages[page] = \
+                HandlerPage(page << 8, self.unimplemented, self.unimplemented)
+
+        # OAM 0xFE00-0xFE9F, Unusable Memory 0xFEA0-0xFEFF,
+        # Hardware I/O Registers 0xFF00-0xFF7F, High RAM 0xFF80-0xFFFE and
+        # the Interrupt register 0xFFFF share pages
+        self.read_pages[0xFE] = HandlerPage(0xFE00, self.get_high, self.set_high)
+        self.read_pages[0xFF] = HandlerPage(0xFF00, self.get_high, self.set_high)
+        self.write_pages[0xFE] = self.read_pages[0xFE]
+        self.write_pages[0xFF] = self.read_pages[0xFF]
+
+    def region(self, start, size):
+        return np.frombuffer(self.memory, dtype=np.uint8, count=size, offset=start)
+
+    def map_pages(self, start, end, buf):
+        view = memoryview(buf)
+        for page in range(start >> 8, end >> 8):
+            offset = (page << 8) - start
+            self.read_pages[page] = view[offset:offset + 0x100]
+            self.write_pages[page] = self.read_pages[page]
+
+    def map_cartridge(self):
+        # Swap the current banks' pages into the page tables, skipping the
+        # regions that are already mapped
+        cartridge = self.cartridge
+
+        pages = cartridge.rom_pages(cartridge.rom_bank_0)
+        if self.read_pages[0x00] is not pages[0]:
+            self.read_pages[0x00:0x40] = pages
+
+        pages = cartridge.rom_pages(cartridge.rom_bank)
+        if self.read_pages[0x40] is not pages[0]:
+            self.read_pages[0x40:0x80] = pages
+
+        pages = cartridge.ram_pages()
+        if self.write_pages[0xA0] is not pages[0]:
+            self.read_pages[0xA0:0xC0] = pages
+            self.write_pages[0xA0:0xC0] = pages
+
+    def write_cartridge(self, addr, val):
+        self.cartridge.write(addr, val)
+        self.map_cartridge()
+
+    def get(self, addr):
+        if addr & ~0xFFFF:
+            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
+        return self.read_pages[addr >> 8][addr & 0xFF]
 
+    def set(self, addr, val):
+        if addr & ~0xFFFF:
+            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
+        self.write_pages[addr >> 8][addr & 0xFF] = val
+
+    def map_io(self, addr, read = None, write = None, volatile = False):
+        # Hand a hardware register over to a component: read(addr) returns
+        # its value and write(addr, val) stores it.  Either can be left as
+        # None to keep plain HW_REGS_TEMP storage for that direction.
+        # volatile marks a register that can change without a scheduled
+        # event.
+        if read is not None:
+            self.io_read[addr] = read
+        if write is not None:
+            self.io_write[addr] = write
+        if volatile:
+            self.volatile.add(addr)
+
+    def request_interrupt(self, bit):
+        self.HW_REGS_TEMP[IF - 0xFF00] |= bit
+
+    def set_char_ram(self, addr, val):
+        self.char_ram_view[addr - 0x8000] = val
+        self.dirty_tiles.add((addr - 0x8000) >> 4)
+
+    def unimplemented(self, addr, val=None):
+        raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+
+    def get_high(self, addr):
         # OAM - Object Attribute Memory 0xFE00-0xFE9F
-        elif addr >= 0xFE00 and addr <= 0xFE9F:
-            addr_adj = addr - 0xFE00
-            return self.OAM[addr_adj]
+        if addr <= 0xFE9F:
+            return int(self.OAM[addr - 0xFE00])
 
         # Unusable Memory 0xFEA0-0xFEFF
-        elif addr >= 0xFEA0 and addr <= 0xFEFF:
+        elif addr <= 0xFEFF:
             raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
 
         # Hardware I/O Registers 0xFF00-0xFF7F
-        elif addr >= 0xFF00 and addr <= 0xFF7F:
-            # TODO: Implement HW regs GET
-            addr_adj = addr - 0xFF00
-            return self.HW_REGS_TEMP[addr_adj]
+        elif addr <= 0xFF7F:
+            read = self.io_read.get(addr)
+            if read is not None:
+                return read(addr)
+            return int(self.HW_REGS_TEMP[addr - 0xFF00])
 
         # High RAM 0xFF80-0xFFFE
-        elif addr >= 0xFF80 and addr <= 0xFFFE:
-            addr_adj = addr - 0xFF80
-            return self.HIGH_RAM[addr_adj]
+        elif addr <= 0xFFFE:
+            return int(self.HIGH_RAM[addr - 0xFF80])
 
         # Interrupt register 0xFFFF
-        elif addr == 0xFFFF:
-            return self.INTERRUPT
-
         else:
-            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
-
-
-    def set(self, addr, val):
-        # Cartridge ROM bank 0 0x0000-0x3FFF
-        if addr >= 0x0000 and addr <= 0x3FFF:
-            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
-
-        # Cartridge ROM switchable bank 0x4000-0x7FFF
-        elif addr >= 0x4000 and addr <= 0x7FFF:
-            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
-
-        # Character RAM 0x8000-0x97FF
-        elif addr >= 0x8000 and addr <= 0x97FF:
-            # return self.VRAM[addr - 0x8000]
-            addr_adj = addr - 0x8000
-            self.CHAR_RAM[addr_adj] = val
-
-        # BG Map Data 1 0x9800-0x9BFF
-        elif addr >= 0x9800 and addr <= 0x9BFF:
-            addr_adj = addr - 0x9800
-            self.BG_MAP_1[addr_adj] = val
-
-        # BG Map Data 2 0x9C00-0x9FFF
-        elif addr >= 0x9C00 and addr <= 0x9FFF:
-            addr_adj = addr - 0x9C00
-            self.BG_MAP_2[addr_adj] = val
-
-        # External RAM (if available) 0xA000-0xBFFF
-        elif addr >= 0xA000 and addr <= 0xBFFF:
-            addr_adj = addr - 0xA000
-            self.EXT_RAM[addr_adj] = val
-
-        # Work RAM 0xC000-0xDFFF
-        elif addr >= 0xC000 and addr <= 0xDFFF:
-            addr_adj = addr - 0xC000
-            self.WORK_RAM[addr_adj] = val
-
-        # Echo RAM (Reserved, shouldn't be used) 0xE000-0xFDFF
-        elif addr >= 0xE000 and addr <= 0xFDFF:
-            raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
+            return self.INTERRUPT
 
+    def set_high(self, addr, val):
         # OAM - Object Attribute Memory 0xFE00-0xFE9F
-        elif addr >= 0xFE00 and addr <= 0xFE9F:
-            addr_adj = addr - 0xFE00
-            self.OAM[addr_adj] = val
+        if addr <= 0xFE9F:
+            self.OAM[addr - 0xFE00] = val
 
         # Unusable Memory 0xFEA0-0xFEFF
-        elif addr >= 0xFEA0 and addr <= 0xFEFF:
+        elif addr <= 0xFEFF:
             raise NotImplementedError('Access of unimplemented memory space ' + str(addr))
 
         # Hardware I/O Registers 0xFF00-0xFF7F
-        elif addr >= 0xFF00 and addr <= 0xFF7F:
-            # TODO: Implement HW regs SET
-            addr_adj = addr - 0xFF00
-            self.HW_REGS_TEMP[addr_adj] = val
+        elif addr <= 0xFF7F:
+            write = self.io_write.get(addr)
+            if write is not None:
+                write(addr, val)
+            else:
+                self.HW_REGS_TEMP[addr - 0xFF00] = val
 
         # High RAM 0xFF80-0xFFFE
-        elif addr >= 0xFF80 and addr <= 0xFFFE:
-            addr_adj = addr - 0xFF80
-            self.HIGH_RAM[addr_adj] = val
+        elif addr <= 0xFFFE:
+            self.HIGH_RAM[addr - 0xFF80] = val
 
         # Interrupt register 0xFFFF
-        elif addr == 0xFFFF:
-            self.INTERRUPT = val
-
         else:
-            raise MemoryAccessError('Crazy out of range address requested from MMU: ' + str(addr))
+            self.INTERRUPT = val
@@ -0,0 +1,738 @@
+from array import array
+import numpy as np
+
+from cpu import CPU, OP_CYCLES, CB_CYCLES, JR_TAKEN, JP_TAKEN, CALL_TAKEN, RET_TAKEN, \
+    REG_A, REG_F, REG_B, REG_C, REG_H, REG_L, STOP_CYCLES, STOP_PREDICATE
+from mmu import IF, IE
+import alu_tables
+
+# Optional numba backend for the CPU.  run_core runs instructions in a loop
+# over the register file, memory and the ALU tables as flat integer arrays,
+# compiled with numba's @njit when it is installed.  Without numba the
+# backend can't be used: NumbaCPU raises ValueError unless the tests have
+# set INTERPRETED_CORE to run the core as plain Python, which is far slower
+# than CPU and only there to test the backend anywhere.
+#
+# Anything the core can't do on its own - I/O registers, memory behind a
+# HandlerPage, HALT, STOP, EI/DI/RETI, unknown opcodes, addresses out of
+# range - makes it stop before the instruction with nothing changed, and
+# NumbaCPU runs that one instruction in the interpreter instead.
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+INTERPRETED_CORE = False
+
+# Reads from the uint8/uint16 arrays as signed integers, so arithmetic
+# on them never mixes signed and unsigned types under numba
+as_int = np.int64 if HAVE_NUMBA else int
+
+# Offsets of each ALU table in the one array the core is given, see
+# alu_tables for their index layouts
+ALU_ADD = 0
+ALU_SUB = ALU_ADD + alu_tables.table_size('add')
+ALU_AND = ALU_SUB + alu_tables.table_size('sub')
+ALU_OR = ALU_AND + alu_tables.table_size('and_')
+ALU_XOR = ALU_OR + alu_tables.table_size('or_')
+ALU_INC = ALU_XOR + alu_tables.table_size('xor')
+ALU_DEC = ALU_INC + alu_tables.table_size('inc')
+ALU_RLC = ALU_DEC + alu_tables.table_size('dec')
+ALU_RRC = ALU_RLC + alu_tables.table_size('rlc')
+ALU_RL = ALU_RRC + alu_tables.table_size('rrc')
+ALU_RR = ALU_RL + alu_tables.table_size('rl')
+ALU_SLA = ALU_RR + alu_tables.table_size('rr')
+ALU_SRA = ALU_SLA + alu_tables.table_size('sla')
+ALU_SRL = ALU_SRA + alu_tables.table_size('sra')
+ALU_SWAP = ALU_SRL + alu_tables.table_size('srl')
+ALU_DAA = ALU_SWAP + alu_tables.table_size('swap')
+ALU_TABLE_NAMES = ['add', 'sub', 'and_', 'or_', 'xor', 'inc', 'dec', 'rlc',
+                   'rrc', 'rl', 'rr', 'sla', 'sra', 'srl', 'swap', 'daa']
+
+CORE_OP_CYCLES = np.array(OP_CYCLES, dtype=np.int64)
+CORE_CB_CYCLES = np.array(CB_CYCLES, dtype=np.int64)
+
+# Returned by step for an instruction it leaves to the interpreter
+BAIL = -1
+
+# Buffers the core can see memory pages in, at most
+MAX_SOURCES = 8
+
+HIGH_RAM_START = 0xFF80
+HIGH_RAM_END = 0xFFFF
+
+_alu = None
+
+def core_alu_tables():
+    # All the ALU tables in one array, built once per process
+    global _alu
+    if _alu is None:
+        tables = alu_tables.build_tables()
+        table = array('H')
+        for name in ALU_TABLE_NAMES:
+            table.extend(tables[name])
+        _alu = np.frombuffer(table, dtype=np.uint16) if HAVE_NUMBA else table
+    return _alu
+
+
+@njit(cache=True)
+def read(addr, sources, page_src, page_off, hram):
+    # The byte at addr, or -1 if the MMU has to read it
+    if addr < 0 or addr > 0xFFFF:
+        return -1
+    page = addr >> 8
+    src = page_src[page]
+    if src >= 0:
+        return as_int(sources[src][page_off[page] + (addr & 0xFF)])
+    if HIGH_RAM_START <= addr < HIGH_RAM_END:
+        return as_int(hram[addr - HIGH_RAM_START])
+    return -1
+
+
+@njit(cache=True)
+def writable(addr, page_write):
+    if addr < 0 or addr > 0xFFFF:
+        return False
+    return page_write[addr >> 8] >= 0 or HIGH_RAM_START <= addr < HIGH_RAM_END
+
+
+@njit(cache=True)
+def write(addr, val, write_sources, page_off, page_write, hram):
+    # addr must be writable
+    page = addr >> 8
+    if page_write[page] >= 0:
+        write_sources[page_write[page]][page_off[page] + (addr & 0xFF)] = val & 0xFF
+    else:
+        hram[addr - HIGH_RAM_START] = val & 0xFF
+
+
+@njit(cache=True)
+def condition(cc, f):
+    # NZ, Z, NC, C
+    if cc == 0:
+        return f & 0x80 == 0
+    if cc == 1:
+        return f & 0x80 != 0
+    if cc == 2:
+        return f & 0x10 == 0
+    return f & 0x10 != 0
+
+
+@njit(cache=True)
+def alu_8(k, a, v, f, alu):
+    # ADD, ADC, SUB, SBC, AND, XOR, OR, CP.  ADC and SBC always carry, as
+    # in CPU.  Returns (result, F).
+    index = (a << 8) | v
+    if k == 0:
+        entry = as_int(alu[ALU_ADD + index])
+    elif k == 1:
+        entry = as_int(alu[ALU_ADD + 0x10000 + index])
+    elif k == 2 or k == 7:
+        entry = as_int(alu[ALU_SUB + index])
+    elif k == 3:
+        entry = as_int(alu[ALU_SUB + 0x10000 + index])
+    elif k == 4:
+        entry = as_int(alu[ALU_AND + index])
+    elif k == 5:
+        entry = as_int(alu[ALU_XOR + index])
+    else:
+        entry = as_int(alu[ALU_OR + index])
+    return entry >> 8, (f & 0x0F) | (entry & 0xFF)
+
+
+@njit(cache=True)
+def shift_8(k, v, f, alu):
+    # RLC, RRC, RL, RR, SLA, SRA, SWAP, SRL.  Returns (result, F).
+    if k == 0:
+        entry = as_int(alu[ALU_RLC + v])
+    elif k == 1:
+        entry = as_int(alu[ALU_RRC + v])
+    elif k == 2:
+        entry = as_int(alu[ALU_RL + (((f & 0x10) << 4) | v)])
+    elif k == 3:
+        entry = as_int(alu[ALU_RR + (((f & 0x10) << 4) | v)])
+    elif k == 4:
+        entry = as_int(alu[ALU_SLA + v])
+    elif k == 5:
+        entry = as_int(alu[ALU_SRA + v])
+    elif k == 6:
+        return as_int(alu[ALU_SWAP + v]) >> 8, f
+    else:
+        entry = as_int(alu[ALU_SRL + v])
+    return entry >> 8, (f & 0x0F) | (entry & 0xFF)
+
+
+@njit(cache=True)
+def add_16(v1, v2, f):
+    # As CPU.add_16 without a carry.  Returns (result, F).
+    total = v1 + v2
+    result = total & 0xFFFF
+    f = f & 0x0F
+    if result == 0:
+        f |= 0x80
+    if (v1 & 0xFFF) + (v2 & 0xFFF) > 0xFFF:
+        f |= 0x20
+    if total > 0xFFFF:
+        f |= 0x10
+    return result, f
+
+
+@njit(cache=True)
+def step(regs, pc, sp, sources, write_sources, page_src, page_off, page_write, hram, alu):
+    # Runs the instruction at pc.  Returns (cycles, pc, sp), or BAIL with
+    # nothing changed if it has to be left to the interpreter.  Operands
+    # are read up front and only checked where they are used.
+    op = read(pc, sources, page_src, page_off, hram)
+    if op < 0:
+        return BAIL, pc, sp
+    n1 = read(pc + 1, sources, page_src, page_off, hram)
+    n2 = read(pc + 2, sources, page_src, page_off, hram)
+    nn = (n2 << 8) | n1
+
+    x = op >> 6
+    y = (op >> 3) & 0x07
+    z = op & 0x07
+    p = y >> 1
+    q = y & 0x01
+    a = as_int(regs[REG_A])
+    f = as_int(regs[REG_F])
+    hl = (as_int(regs[REG_H]) << 8) | as_int(regs[REG_L])
+    cycles = as_int(CORE_OP_CYCLES[op])
+
+    # LD r, r', LD r, (HL), LD (HL), r
+    if x == 1:
+        if op == 0x76:
+            return BAIL, pc, sp
+        if z == 6:
+            v = read(hl, sources, page_src, page_off, hram)
+            if v < 0:
+                return BAIL, pc, sp
+        else:
+            v = as_int(regs[z if z < 6 else REG_A])
+        if y == 6:
+            if not writable(hl, page_write):
+                return BAIL, pc, sp
+            write(hl, v, write_sources, page_off, page_write, hram)
+        else:
+            regs[y if y < 6 else REG_A] = v
+        return cycles, pc + 1, sp
+
+    # 8-bit ALU on A
+    if x == 2:
+        if z == 6:
+            v = read(hl, sources, page_src, page_off, hram)
+            if v < 0:
+                return BAIL, pc, sp
+        else:
+            v = as_int(regs[z if z < 6 else REG_A])
+        result, f = alu_8(y, a, v, f, alu)
+        if y != 7:
+            regs[REG_A] = result
+        regs[REG_F] = f
+        return cycles, pc + 1, sp
+
+    if x == 0:
+        if z == 0:
+            if y == 0:                                  # NOP
+                return cycles, pc + 1, sp
+            if y == 1:                                  # LD (nn), SP
+                if n1 < 0 or n2 < 0 or not writable(nn, page_write) \
+                        or not writable(nn + 1, page_write):
+                    return BAIL, pc, sp
+                write(nn, sp & 0xFF, write_sources, page_off, page_write, hram)
+                write(nn + 1, (sp & 0xFF00) >> 8, write_sources, page_off, page_write, hram)
+                return cycles, pc + 3, sp
+            if y == 2:                                  # STOP
+                return BAIL, pc, sp
+            # JR n, JR cc, n: relative to the offset byte, unsigned
+            if y == 3 or condition(y - 4, f):
+                if n1 < 0:
+                    return BAIL, pc, sp
+                return JR_TAKEN, pc + 1 + n1, sp
+            return cycles, pc + 2, sp
+
+        if z == 1:
+            if q == 0:                                  # LD rr, nn
+                if n1 < 0 or n2 < 0:
+                    return BAIL, pc, sp
+                if p == 3:
+                    return cycles, pc + 3, nn
+                regs[p << 1] = n2
+                regs[(p << 1) + 1] = n1
+                return cycles, pc + 3, sp
+            # ADD HL, rr, leaving Z alone
+            if p == 3:
+                v = sp
+            else:
+                v = (as_int(regs[p << 1]) << 8) | as_int(regs[(p << 1) + 1])
+            result, g = add_16(hl, v, f)
+            regs[REG_H] = result >> 8
+            regs[REG_L] = result & 0xFF
+            regs[REG_F] = (g & 0x7F) | (f & 0x80)
+            return cycles, pc + 1, sp
+
+        if z == 2:
+            # LD (BC), A, LD (DE), A, LDI (HL), A, LDD (HL), A and back
+            if p == 0:
+                addr = (as_int(regs[REG_B]) << 8) | as_int(regs[REG_C])
+            elif p == 1:
+                addr = (as_int(regs[REG_B + 2]) << 8) | as_int(regs[REG_C + 2])
+            else:
+                addr = hl
+            if q == 0:
+                if not writable(addr, page_write):
+                    return BAIL, pc, sp
+                write(addr, a, write_sources, page_off, page_write, hram)
+            else:
+                v = read(addr, sources, page_src, page_off, hram)
+                if v < 0:
+                    return BAIL, pc, sp
+                regs[REG_A] = v
+            if p >= 2:
+                hl = (hl + 1 if p == 2 else hl - 1) & 0xFFFF
+                regs[REG_H] = hl >> 8
+                regs[REG_L] = hl & 0xFF
+            return cycles, pc + 1, sp
+
+        if z == 3:                                      # INC rr, DEC rr
+            delta = 1 if q == 0 else -1
+            if p == 3:
+                return cycles, pc + 1, (sp + delta) & 0xFFFF
+            v = (((as_int(regs[p << 1]) << 8) | as_int(regs[(p << 1) + 1])) + delta) & 0xFFFF
+            regs[p << 1] = v >> 8
+            regs[(p << 1) + 1] = v & 0xFF
+            return cycles, pc + 1, sp
+
+        if z == 4 or z == 5:                            # INC r, DEC r
+            if y == 6:
+                v = read(hl, sources, page_src, page_off, hram)
+                if v < 0 or not writable(hl, page_write):
+                    return BAIL, pc, sp
+            else:
+                v = as_int(regs[y if y < 6 else REG_A])
+            entry = as_int(alu[(ALU_INC if z == 4 else ALU_DEC) + v])
+            if y == 6:
+                write(hl, entry >> 8, write_sources, page_off, page_write, hram)
+            else:
+                regs[y if y < 6 else REG_A] = entry >> 8
+            regs[REG_F] = (f & 0x1F) | (entry & 0xFF)
+            return cycles, pc + 1, sp
+
+        if z == 6:                                      # LD r, n
+            if n1 < 0:
+                return BAIL, pc, sp
+            if y == 6:
+                if not writable(hl, page_write):
+                    return BAIL, pc, sp
+                write(hl, n1, write_sources, page_off, page_write, hram)
+            else:
+                regs[y if y < 6 else REG_A] = n1
+            return cycles, pc + 2, sp
+
+        # RLCA, RRCA, RLA, RRA, DAA, CPL, SCF, CCF
+        if y < 4:
+            result, f = shift_8(y, a, f, alu)
+            regs[REG_A] = result
+        elif y == 4:
+            entry = as_int(alu[ALU_DAA + (((f & 0x70) << 4) | a)])
+            regs[REG_A] = entry >> 8
+            f = (f & 0x0F) | (entry & 0xFF)
+        elif y == 5:
+            regs[REG_A] = a ^ 0xFF
+            f |= 0x60
+        elif y == 6:
+            f = (f | 0x10) & 0x9F
+        else:
+            f = (f ^ 0x10) & 0x9F
+        regs[REG_F] = f
+        return cycles, pc + 1, sp
+
+    # x == 3
+    if z == 0:
+        if y < 4:                                       # RET cc
+            if not condition(y, f):
+                return cycles, pc + 1, sp
+            lo = read(sp, sources, page_src, page_off, hram)
+            hi = read(sp + 1, sources, page_src, page_off, hram)
+            if lo < 0 or hi < 0:
+                return BAIL, pc, sp
+            return RET_TAKEN, (hi << 8) | lo, sp + 2
+        if y == 4:                                      # LDH (n), A
+            if n1 < 0 or not writable(0xFF00 + n1, page_write):
+                return BAIL, pc, sp
+            write(0xFF00 + n1, a, write_sources, page_off, page_write, hram)
+            return cycles, pc + 2, sp
+        if y == 5:                                      # ADD SP, n (16-bit operand)
+            if n1 < 0 or n2 < 0:
+                return BAIL, pc, sp
+            result, f = add_16(sp, nn, f)
+            regs[REG_F] = f & 0x7F
+            return cycles, pc + 3, result
+        if y == 6:                                      # LDH A, (n)
+            v = read(0xFF00 + n1, sources, page_src, page_off, hram) if n1 >= 0 else -1
+            if v < 0:
+                return BAIL, pc, sp
+            regs[REG_A] = v
+            return cycles, pc + 2, sp
+        # LD HL, SP + n
+        if n1 < 0:
+            return BAIL, pc, sp
+        result, f = add_16(n1, sp, f)
+        regs[REG_H] = result >> 8
+        regs[REG_L] = result & 0xFF
+        regs[REG_F] = f
+        return cycles, pc + 2, sp
+
+    if z == 1:
+        if q == 0 or p == 0:                            # POP rr, RET
+            lo = read(sp, sources, page_src, page_off, hram)
+            hi = read(sp + 1, sources, page_src, page_off, hram)
+            if lo < 0 or hi < 0:
+                return BAIL, pc, sp
+            if q == 1:
+                return cycles, (hi << 8) | lo, sp + 2
+            i = REG_A if p == 3 else p << 1
+            regs[i] = hi
+            regs[i + 1] = lo
+            return cycles, pc + 1, sp + 2
+        if p == 1:                                      # RETI
+            return BAIL, pc, sp
+        if p == 2:                                      # JP HL
+            return cycles, hl, sp
+        return cycles, pc + 1, hl                       # LD SP, HL
+
+    if z == 2:
+        if y < 4:                                       # JP cc, nn
+            if not condition(y, f):
+                return cycles, pc + 3, sp
+            if n1 < 0 or n2 < 0:
+                return BAIL, pc, sp
+            return JP_TAKEN, nn, sp
+        if y == 4 or y == 6:                            # LD (C), A, LD A, (C)
+            addr = 0xFF00 + as_int(regs[REG_C])
+            length = 1
+        else:                                           # LD (nn), A, LD A, (nn)
+            if n1 < 0 or n2 < 0:
+                return BAIL, pc, sp
+            addr = nn
+            length = 3
+        if y < 6:
+            if not writable(addr, page_write):
+                return BAIL, pc, sp
+            write(addr, a, write_sources, page_off, page_write, hram)
+        else:
+            v = read(addr, sources, page_src, page_off, hram)
+            if v < 0:
+                return BAIL, pc, sp
+            regs[REG_A] = v
+        return cycles, pc + length, sp
+
+    if z == 3:
+        if y == 0:                                      # JP nn
+            if n1 < 0 or n2 < 0:
+                return BAIL, pc, sp
+            return cycles, nn, sp
+        if y != 1:                                      # DI, EI, unknown
+            return BAIL, pc, sp
+
+        # CB-prefixed
+        if n1 < 0:
+            return BAIL, pc, sp
+        k = n1 >> 6
+        y = (n1 >> 3) & 0x07
+        z = n1 & 0x07
+        if z == 6:
+            v = read(hl, sources, page_src, page_off, hram)
+            if v < 0 or (k != 1 and not writable(hl, page_write)):
+                return BAIL, pc, sp
+        else:
+            v = as_int(regs[z if z < 6 else REG_A])
+        if k == 0:
+            result, f = shift_8(y, v, f, alu)
+        elif k == 1:                                    # BIT
+            regs[REG_F] = (f & 0x1F) | ((((v >> y) & 0x01) ^ 0x01) << 7) | 0x20
+            return as_int(CORE_CB_CYCLES[n1]), pc + 2, sp
+        elif k == 2:                                    # RES
+            result = v & ((0x01 << y) ^ 0xFF)
+        else:                                           # SET, which sets H
+            result = v | (0x01 << y)
+            f |= 0x20
+        if z == 6:
+            write(hl, result, write_sources, page_off, page_write, hram)
+        else:
+            regs[z if z < 6 else REG_A] = result
+        regs[REG_F] = f
+        return as_int(CORE_CB_CYCLES[n1]), pc + 2, sp
+
+    if z == 4 or (z == 5 and q == 1):
+        # CALL cc, nn, CALL nn, pushing the address after the operand
+        if z == 5 and p != 0:
+            return BAIL, pc, sp
+        if z == 4:
+            if y >= 4:
+                return BAIL, pc, sp
+            if not condition(y, f):
+                return cycles, pc + 3, sp
+        if n1 < 0 or n2 < 0 or not writable(sp - 1, page_write) \
+                or not writable(sp - 2, page_write):
+            return BAIL, pc, sp
+        ret = pc + 3
+        write(sp - 1, (ret & 0xFF00) >> 8, write_sources, page_off, page_write, hram)
+        write(sp - 2, ret & 0xFF, write_sources, page_off, page_write, hram)
+        return CALL_TAKEN, nn, sp - 2
+
+    if z == 5:                                          # PUSH rr
+        if not writable(sp - 1, page_write) or not writable(sp - 2, page_write):
+            return BAIL, pc, sp
+        i = REG_A if p == 3 else p << 1
+        write(sp - 1, as_int(regs[i]), write_sources, page_off, page_write, hram)
+        write(sp - 2, as_int(regs[i + 1]), write_sources, page_off, page_write, hram)
+        return cycles, pc + 1, sp - 2
+
+    if z == 6:                                          # ALU A, n
+        if n1 < 0:
+            return BAIL, pc, sp
+        result, f = alu_8(y, a, n1, f, alu)
+        if y != 7:
+            regs[REG_A] = result
+        regs[REG_F] = f
+        return cycles, pc + 2, sp
+
+    # RST n
+    if not writable(sp - 1, page_write) or not writable(sp - 2, page_write):
+        return BAIL, pc, sp
+    ret = pc + 1
+    write(sp - 1, (ret & 0xFF00) >> 8, write_sources, page_off, page_write, hram)
+    write(sp - 2, ret & 0xFF, write_sources, page_off, page_write, hram)
+    return cycles, y << 3, sp - 2
+
+
+@njit(cache=True)
+def run_core(regs, pc, sp, budget, sources, write_sources, page_src, page_off, page_write,
+             hram, alu):
+    # Runs instructions until budget cycles are spent, as CPU.run would, or
+    # one has to be left to the interpreter.  Returns (cycles spent, pc,
+    # sp, whether it stopped on such an instruction).
+    spent = 0
+    while spent < budget:
+        cycles, pc, sp = step(regs, pc, sp, sources, write_sources, page_src, page_off, page_write,
+                              hram, alu)
+        if cycles < 0:
+            return spent, pc, sp, True
+        spent += cycles
+    return spent, pc, sp, False
+
+
+def source_array(base):
+    # The object behind a memoryview page as a flat uint8 array sharing
+    # its memory, or None if the core can't use it
+    try:
+        buf = base if isinstance(base, np.ndarray) else np.frombuffer(base, dtype=np.uint8)
+    except (TypeError, ValueError):
+        return None
+    if buf.dtype != np.uint8 or buf.ndim != 1 or not buf.flags.c_contiguous:
+        return None
+    return buf
+
+
+def address(buf):
+    return buf.__array_interface__['data'][0]
+
+
+class MemoryMap:
+    # The core's view of the MMU page tables: for each page, the index in
+    # sources of the buffer behind it (-1 to leave accesses to the MMU),
+    # its offset in that buffer, and the index of the same buffer in
+    # write_sources if writes may go straight there (-1 otherwise).
+    # Built from the plain memoryview pages; every other page is a
+    # HandlerPage and stays with the MMU.  numba wants one array type for
+    # all of sources, so they are all read-only views, and a read-only ROM
+    # mapped by load_rom is used as it is, never copied.
+    def __init__(self, mmu):
+        self.read_pages = list(mmu.read_pages)
+        self.write_pages = list(mmu.write_pages)
+
+        buffers = []
+        write_buffers = []
+        found = {}
+        page_src = np.full(0x100, -1, dtype=np.int64)
+        page_off = np.zeros(0x100, dtype=np.int64)
+        page_write = np.full(0x100, -1, dtype=np.int64)
+        for page, view in enumerate(self.read_pages):
+            if not isinstance(view, memoryview):
+                continue
+            base = view.obj
+            source = found.get(id(base))
+            if source is None:
+                buf = source_array(base)
+                if buf is None or len(buffers) == MAX_SOURCES:
+                    continue
+                write_index = -1
+                if buf.flags.writeable:
+                    write_index = len(write_buffers)
+                    write_buffers.append(buf)
+                    buf = buf.view()
+                    buf.flags.writeable = False
+                source = found[id(base)] = (len(buffers), write_index, address(buf), len(buf))
+                buffers.append(buf)
+
+            index, write_index, start, size = source
+            offset = address(np.frombuffer(view, dtype=np.uint8)) - start
+            if not 0 <= offset <= size - 0x100:
+                continue
+            page_src[page] = index
+            page_off[page] = offset
+            if self.write_pages[page] is view:
+                page_write[page] = write_index
+
+        padding = np.zeros(0x100, dtype=np.uint8)
+        write_buffers += [padding] * (MAX_SOURCES - len(write_buffers))
+        padding = padding.view()
+        padding.flags.writeable = False
+        buffers += [padding] * (MAX_SOURCES - len(buffers))
+        if HAVE_NUMBA:
+            self.args = (tuple(buffers), tuple(write_buffers), page_src, page_off, page_write)
+        else:
+            self.args = (tuple(memoryview(buf) for buf in buffers),
+                         tuple(memoryview(buf) for buf in write_buffers),
+                         page_src.tolist(), page_off.tolist(), page_write.tolist())
+
+    def current(self, mmu):
+        # Whether the page tables are still the ones this was built from.
+        # Outside the translator (which the core never runs alongside),
+        # only bank switches change them after the MMU is built, and
+        # map_cartridge swaps whole regions: checking the first page of
+        # each region is enough, as there.
+        read_pages = mmu.read_pages
+        return read_pages[0x00] is self.read_pages[0x00] and \
+            read_pages[0x40] is self.read_pages[0x40] and \
+            read_pages[0xA0] is self.read_pages[0xA0] and \
+            mmu.write_pages[0xA0] is self.write_pages[0xA0]
+
+
+class NumbaCPU(CPU):
+    # CPU with run_cycles, run_until and tick going through run_core where
+    # they can.  Everything else - the helpers, the handlers the
+    # interpreter falls back on, lazy flags, fusions, the translator - is
+    # CPU's.  Breakpoints, predicates and translation always use the
+    # interpreter.
+    def __init__(self, mmu, lazy_flags = False, alu_tables = None, idle_loops = True,
+                 translate = False, fusions = None):
+        if not HAVE_NUMBA and not INTERPRETED_CORE:
+            raise ValueError('The numba CPU backend needs numba, which is not installed')
+        self.fused_firsts = set()
+        super().__init__(mmu, lazy_flags=lazy_flags, alu_tables=alu_tables,
+                         idle_loops=idle_loops, translate=translate, fusions=fusions)
+        self.core_regs = np.frombuffer(self.regs, dtype=np.uint8) if HAVE_NUMBA else self.regs
+        self.core_hram = mmu.HIGH_RAM if HAVE_NUMBA else memoryview(mmu.HIGH_RAM)
+        self.core_alu = core_alu_tables()
+        self.memory_map = None
+        # PCs of loops the core stopped in twice, left to the interpreter
+        # straight away from then on
+        self.core_loops = set()
+
+        # Instructions left to the interpreter, and cycles run in the core
+        self.core_bails = 0
+        self.core_cycles = 0
+
+    def core_report(self):
+        total = self.cycles or 1
+        return '%d cycles (%.1f%%) run in the compiled core, %d instructions left to the interpreter' \
+            % (self.core_cycles, self.core_cycles * 100 / total, self.core_bails)
+
+    def run_core(self, budget):
+        # Runs up to budget cycles in the core.  Returns (cycles spent,
+        # whether it stopped on an instruction the interpreter must run).
+        if self.pending_flags is not None:
+            self.resolve_flags()
+        memory_map = self.memory_map
+        if memory_map is None or not memory_map.current(self.mmu):
+            memory_map = self.memory_map = MemoryMap(self.mmu)
+        sources, write_sources, page_src, page_off, page_write = memory_map.args
+
+        spent, self.pc, self.sp, bailed = run_core(
+            self.core_regs, self.pc, self.sp, budget, sources, write_sources,
+            page_src, page_off, page_write, self.core_hram, self.core_alu)
+        spent = int(spent)
+        self.cycles += spent
+        self.core_cycles += spent
+        self.core_bails += bailed
+        return spent, bailed
+
+    def fuse(self, pairs):
+        # As CPU.fuse, keeping the first opcodes of the fused pairs for tick
+        super().fuse(pairs)
+        self.fused_firsts = {first for first, _ in self.fused}
+
+    def tick(self):
+        # A fused pair is one tick, as in CPU
+        pc = self.pc
+        if self.halted or self.translator is not None or (self.fused_firsts and not pc & ~0xFFFF
+                and self.mmu.read_pages[pc >> 8][pc & 0xFF] in self.fused_firsts):
+            return CPU.tick(self)
+        spent, bailed = self.run_core(1)
+        if bailed:
+            return CPU.tick(self)
+        interrupt = self.handle_interrupts()
+        self.cycles += interrupt
+        return spent + interrupt
+
+    def run_batch(self, max_cycles, predicate):
+        # As CPU.run_batch.  The core stops for interrupts and halts by
+        # handing back to the interpreter for one instruction, which
+        # dispatches them.  A second stop at the same instruction means a
+        # loop the core can't run (polling an I/O register, copying to
+        # character RAM...): the interpreter runs the rest of the budget,
+        # and may skip the loop if it is waiting.  The core hands over at
+        # once the next time it stops in the same loop.
+        #
+        # The budget is worked out from stop_at each time, as the
+        # instruction the interpreter ran may have scheduled an event.
+        if max_cycles is None or predicate is not None or self.breakpoints \
+                or self.translator is not None:
+            return CPU.run_batch(self, max_cycles, predicate)
+
+        mmu = self.mmu
+        start = self.cycles
+        bail_pc = None
+        while self.cycles < self.stop_at:
+            if not self.halted and \
+                    not (self.interrupt_master_enable and mmu.get(IF) & mmu.get(IE)):
+                ran, bailed = self.run_core(self.stop_at - self.cycles)
+                if not bailed:
+                    break
+                if self.pc == bail_pc or self.pc in self.core_loops:
+                    self.core_loops.add(self.pc)
+                    ran, reason = CPU.run_batch(self, self.stop_at - self.cycles, None)
+                    return self.cycles - start, reason
+                bail_pc = self.pc
+
+            if self.halted:
+                ran, reason = CPU.run_batch(self, self.stop_at - self.cycles, None)
+            else:
+                ran, reason = CPU.run_batch(self, None, one_instruction)
+            if reason not in (STOP_CYCLES, STOP_PREDICATE):
+                return self.cycles - start, reason
+        return self.cycles - start, STOP_CYCLES
+
+
+def one_instruction(cpu):
+    # A run_until predicate that stops after the first instruction
+    return True
+
+
+# CPU backends by name, for GameBoy
+BACKENDS = {
+    'python': CPU,
+    'numba': NumbaCPU
+}
+
+def default_backend():
+    # numba where it is installed, the interpreter otherwise
+    return 'numba' if HAVE_NUMBA else 'python'
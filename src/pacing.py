@@ -0,0 +1,68 @@
+import time
+
+# DMG frame rate: 4194304 Hz / 70224 cycles per frame
+FRAME_RATE = 59.73
+
+PACING_REALTIME = 'realtime'
+PACING_SPEED = 'speed'
+PACING_UNCAPPED = 'uncapped'
+
+# Falling further behind than this many frames resets the schedule rather
+# than running flat out to catch up
+MAX_FRAMES_BEHIND = 5
+
+class Pacer:
+    # Keeps the main loop at the selected speed.  wait() is called once per
+    # emulated frame and sleeps until that frame is due; should_present()
+    # says whether the frame is worth drawing.
+    #
+    #   realtime  one frame every 1/59.73 s, every frame presented
+    #   speed     realtime times a multiplier (2x, 4x...), every frame presented
+    #   uncapped  no waiting, only every present_every-th frame presented
+    def __init__(self, mode = PACING_REALTIME, speed = 1.0, present_every = 10,
+                 clock = time.perf_counter, sleep = time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.frame = 0
+        self.set_mode(mode, speed, present_every)
+
+    def set_mode(self, mode, speed = None, present_every = None):
+        if mode not in (PACING_REALTIME, PACING_SPEED, PACING_UNCAPPED):
+            raise ValueError('Unknown pacing mode ' + str(mode))
+
+        self.mode = mode
+        if mode == PACING_REALTIME:
+            self.speed = 1.0
+        elif speed is not None:
+            self.speed = float(speed)
+        if present_every is not None:
+            self.present_every = max(int(present_every), 1)
+
+        self.period = 1.0 / (FRAME_RATE * self.speed)
+        self.next_frame = self.clock() + self.period
+
+    def should_present(self):
+        if self.mode == PACING_UNCAPPED:
+            return self.frame % self.present_every == 0
+        return True
+
+    def wait(self):
+        self.frame += 1
+        if self.mode == PACING_UNCAPPED:
+            return
+
+        now = self.clock()
+        if now < self.next_frame:
+            self.sleep(self.next_frame - now)
+            self.next_frame += self.period
+        elif now - self.next_frame > MAX_FRAMES_BEHIND * self.period:
+            self.next_frame = now + self.period
+        else:
+            self.next_frame += self.period
+
+    def describe(self):
+        if self.mode == PACING_UNCAPPED:
+            return 'uncapped, presenting 1/' + str(self.present_every)
+        if self.mode == PACING_SPEED:
+            return '%gx' % self.speed
+        return 'realtime'
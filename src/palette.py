@@ -0,0 +1,79 @@
+import numpy as np
+
+# DMG shades 0-3 as RGB, lightest first
+SHADES = np.array([[0xFF, 0xFF, 0xFF],
+                   [0xAA, 0xAA, 0xAA],
+                   [0x55, 0x55, 0x55],
+                   [0x00, 0x00, 0x00]], dtype='uint8')
+
+# The PPU framebuffer holds palette * 4 + colour index, so the palette
+# registers are only applied here, once per frame
+PALETTE_BGP = 0
+PALETTE_OBP0 = 1
+PALETTE_OBP1 = 2
+# Fixed palette for blank lines (LCD off), mapping colour n to shade n
+PALETTE_BLANK = 3
+BLANK_PALETTE_REG = 0xE4
+
+# Shade of each colour index under each palette register value
+PALETTES = np.array([[(reg >> (colour * 2)) & 0x03 for colour in range(4)] for reg in range(0x100)],
+                    dtype=np.uint8)
+
+# PALETTES as intp, so indexing SHADES with it needs no conversion
+PALETTE_SHADES = PALETTES.astype(np.intp)
+
+class PaletteLUT:
+    # Turns a (height, width) framebuffer into the (width, height, 3) RGB
+    # array pygame blits, with one np.take into a preallocated array.
+    #
+    # line_palettes holds the (BGP, OBP0, OBP1) values each line was drawn
+    # with.  Normally they are the same for the whole frame, and the 16 entry
+    # RGB table is only rebuilt when they change.  If a game changed them
+    # mid-frame, a table per line is built for that frame instead, into
+    # preallocated arrays.  Apart from the rebuild on a change, converting
+    # a frame allocates nothing: the framebuffer is widened into a
+    # preallocated index array, and np.take runs with mode='clip', which
+    # writes straight into out (mode='raise' buffers it).
+    def __init__(self, width, height):
+        self.pixels = np.zeros((width, height, 3), dtype=np.uint8)
+        self.registers = None
+        self.lut = None
+        # line * 16 for every pixel, in full as a broadcast add buffers
+        self.line_index = np.repeat(np.arange(height, dtype=np.intp)[None, :] * 16, width, axis=0)
+        self.index = np.zeros((width, height), dtype=np.intp)
+        self.line_registers = np.full((height, 4), BLANK_PALETTE_REG, dtype=np.intp)
+        self.line_shades = np.zeros((height, 4, 4), dtype=np.intp)
+        self.line_luts = np.zeros((height, 4, 4, 3), dtype=np.uint8)
+        self.rebuilds = 0
+
+    def build(self, registers):
+        # registers: (..., 3) BGP/OBP0/OBP1 values -> (..., 16, 3) RGB
+        registers = np.asarray(registers, dtype=np.intp)
+        blank = np.full(registers.shape[:-1] + (1,), BLANK_PALETTE_REG, dtype=np.intp)
+        shades = PALETTES[np.concatenate((registers, blank), axis=-1)]
+        return SHADES[shades].reshape(registers.shape[:-1] + (16, 3))
+
+    def build_lines(self, line_palettes):
+        # As build, for every line, into line_luts
+        np.copyto(self.line_registers[:, :3], line_palettes)
+        np.take(PALETTE_SHADES, self.line_registers, axis=0, mode='clip', out=self.line_shades)
+        np.take(SHADES, self.line_shades, axis=0, mode='clip', out=self.line_luts)
+        return self.line_luts.reshape(-1, 3)
+
+    def convert(self, framebuffer, line_palettes):
+        first = line_palettes[0]
+        if (line_palettes == first).all():
+            registers = tuple(first.tolist())
+            if registers != self.registers:
+                self.lut = self.build(registers)
+                self.registers = registers
+                self.rebuilds += 1
+            np.copyto(self.index, framebuffer.T)
+            np.take(self.lut, self.index, axis=0, mode='clip', out=self.pixels)
+        else:
+            luts = self.build_lines(line_palettes)
+            # Widened first, as adding mixed types would buffer the cast
+            np.copyto(self.index, framebuffer.T)
+            np.add(self.index, self.line_index, out=self.index)
+            np.take(luts, self.index, axis=0, mode='clip', out=self.pixels)
+        return self.pixels
@@ -0,0 +1,318 @@
+import numpy as np
+from mmu import INT_STAT, INT_VBLANK
+from palette import PALETTE_BGP, PALETTE_OBP0, PALETTE_OBP1, PALETTE_BLANK
+from scheduler import EVENT_SCANLINE
+
+# LCD registers
+LCDC = 0xFF40
+STAT = 0xFF41
+SCY = 0xFF42
+SCX = 0xFF43
+LY = 0xFF44
+LYC = 0xFF45
+BGP = 0xFF47
+OBP0 = 0xFF48
+OBP1 = 0xFF49
+WY = 0xFF4A
+WX = 0xFF4B
+
+# LCDC bits
+LCDC_BG_ENABLE = 0x01
+LCDC_OBJ_ENABLE = 0x02
+LCDC_OBJ_SIZE = 0x04
+LCDC_BG_MAP = 0x08
+LCDC_TILE_DATA = 0x10
+LCDC_WINDOW_ENABLE = 0x20
+LCDC_WINDOW_MAP = 0x40
+LCDC_LCD_ENABLE = 0x80
+
+# STAT bits
+STAT_MODE = 0x03
+STAT_LYC_EQUAL = 0x04
+STAT_LYC_INTERRUPT = 0x40
+STAT_WRITABLE = 0x78
+
+# STAT modes
+MODE_HBLANK = 0
+MODE_VBLANK = 1
+MODE_OAM_SCAN = 2
+MODE_TRANSFER = 3
+
+# Line timing in clock cycles: OAM scan, then pixel transfer, then H-Blank
+# for the rest of the line.  Lines 144-153 are V-Blank.
+CYCLES_PER_LINE = 456
+OAM_SCAN_CYCLES = 80
+TRANSFER_END = 252
+LINES_PER_FRAME = 154
+CYCLES_PER_FRAME = CYCLES_PER_LINE * LINES_PER_FRAME
+
+# OAM attribute bits
+OBJ_PALETTE = 0x10
+OBJ_X_FLIP = 0x20
+OBJ_Y_FLIP = 0x40
+OBJ_BEHIND_BG = 0x80
+
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 144
+MAX_SPRITES_PER_LINE = 10
+
+TILE_COUNT = 384
+
+# Tile number (index into CHAR_RAM tiles) of each tile id, for 0x8800
+# (signed, around 0x9000) and 0x8000 (unsigned) addressing:
+# TILE_NUMBERS[LCDC bit 4][tile id]
+TILE_NUMBERS = np.array([np.arange(0x100, dtype=np.uint8).view(np.int8).astype(np.intp) + 256,
+                         np.arange(0x100, dtype=np.intp)])
+
+# Map row indices of the 160 visible pixels for each scroll offset
+SCROLL_INDEX = (np.arange(0x100)[:, None] + np.arange(SCREEN_WIDTH)) & 0xFF
+
+
+class TileCache:
+    # All 384 tiles of CHAR_RAM decoded to (8, 8) colour indices.
+    #
+    # The MMU adds the tile number of every CHAR_RAM write to
+    # mmu.dirty_tiles; update() re-decodes just those tiles, all at once.
+    # Anything that writes CHAR_RAM behind the MMU's back must call
+    # invalidate().
+    #
+    # Counters: hits counts tile rows read from the cache, misses counts
+    # update() calls that found stale tiles, and redecodes counts tiles
+    # decoded.
+    def __init__(self, mmu):
+        self.mmu = mmu
+        self.tiles = np.zeros((TILE_COUNT, 8, 8), dtype=np.uint8)
+        self.hits = 0
+        self.misses = 0
+        self.redecodes = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self.mmu.dirty_tiles.update(range(TILE_COUNT))
+        self.update()
+
+    def update(self):
+        dirty = self.mmu.dirty_tiles
+        if not dirty:
+            return
+
+        tiles = np.fromiter(dirty, dtype=np.intp, count=len(dirty))
+        dirty.clear()
+
+        # Each tile is 8 rows of (low, high) bit plane bytes
+        planes = self.mmu.CHAR_RAM.reshape(TILE_COUNT, 8, 2)[tiles]
+        low = np.unpackbits(planes[:, :, 0:1], axis=2)
+        high = np.unpackbits(planes[:, :, 1:2], axis=2)
+        self.tiles[tiles] = low | (high << 1)
+
+        self.misses += 1
+        self.redecodes += len(tiles)
+
+class PPU:
+    # Renders one scanline at a time into self.framebuffer, a preallocated
+    # (144, 160) array of palette * 4 + colour index (see palette.py), row
+    # by row as the screen is scanned.  The palette registers each line was
+    # drawn with are kept in self.line_palettes for the output stage.
+    #
+    # Tiles come pre-decoded from a TileCache, brought up to date before
+    # each line, so a 32-tile map row is two fancy-index lookups; the
+    # visible 160 pixels are then picked out of that 256 pixel row.
+    def __init__(self, mmu):
+        self.mmu = mmu
+        self.framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
+        self.line_palettes = np.zeros((SCREEN_HEIGHT, 3), dtype=np.uint8)
+        self.tile_cache = TileCache(mmu)
+
+        # Internal window line counter; only advances on lines the window is
+        # actually drawn on
+        self.window_line = 0
+
+        # Line timing, once attach()ed to a scheduler
+        self.scheduler = None
+        self.ly = 0
+        self.line_start = 0
+        self.stat = 0
+        self.frames = 0
+
+    def attach(self, scheduler):
+        # Draw each line as it ends, on a scanline event every
+        # CYCLES_PER_LINE.  LY and the STAT mode are worked out from the
+        # clock when read, so nothing else happens per instruction.
+        self.scheduler = scheduler
+        self.ly = 0
+        self.line_start = scheduler.now
+        self.mmu.map_io(LY, self.read_ly, self.write_ly)
+        self.mmu.map_io(STAT, self.read_stat, self.write_stat, volatile=True)
+        scheduler.schedule_at(self.line_start + CYCLES_PER_LINE, EVENT_SCANLINE, self.end_scanline)
+
+    def end_scanline(self, time):
+        mmu = self.mmu
+        if self.ly < SCREEN_HEIGHT:
+            self.render_scanline(self.ly)
+
+        ly = self.ly = (self.ly + 1) % LINES_PER_FRAME
+        self.line_start = time
+
+        if mmu.get(LCDC) & LCDC_LCD_ENABLE:
+            if ly == SCREEN_HEIGHT:
+                mmu.request_interrupt(INT_VBLANK)
+            if ly == mmu.get(LYC) and self.stat & STAT_LYC_INTERRUPT:
+                mmu.request_interrupt(INT_STAT)
+        if ly == SCREEN_HEIGHT:
+            self.frames += 1
+
+        self.scheduler.schedule_at(time + CYCLES_PER_LINE, EVENT_SCANLINE, self.end_scanline)
+
+    def read_ly(self, addr):
+        if not self.mmu.get(LCDC) & LCDC_LCD_ENABLE:
+            return 0
+        return self.ly
+
+    def write_ly(self, addr, val):
+        # Read only
+        pass
+
+    def read_stat(self, addr):
+        mmu = self.mmu
+        stat = 0x80 | self.stat
+        if not mmu.get(LCDC) & LCDC_LCD_ENABLE:
+            return stat
+
+        ly = self.ly
+        if ly == mmu.get(LYC):
+            stat |= STAT_LYC_EQUAL
+        if ly >= SCREEN_HEIGHT:
+            return stat | MODE_VBLANK
+
+        offset = self.scheduler.now - self.line_start
+        if offset < OAM_SCAN_CYCLES:
+            return stat | MODE_OAM_SCAN
+        if offset < TRANSFER_END:
+            return stat | MODE_TRANSFER
+        return stat | MODE_HBLANK
+
+    def write_stat(self, addr, val):
+        self.stat = val & STAT_WRITABLE
+
+    def render_frame(self):
+        self.window_line = 0
+        for ly in range(SCREEN_HEIGHT):
+            self.render_scanline(ly)
+        return self.framebuffer
+
+    def render_scanline(self, ly):
+        if ly == 0:
+            self.window_line = 0
+
+        if self.mmu.dirty_tiles:
+            self.tile_cache.update()
+
+        get = self.mmu.get
+        lcdc = get(LCDC)
+        line = self.framebuffer[ly]
+
+        self.line_palettes[ly] = (get(BGP), get(OBP0), get(OBP1))
+
+        if not lcdc & LCDC_LCD_ENABLE:
+            line[:] = PALETTE_BLANK * 4
+            return
+
+        # BG and window pixels use BGP, palette 0, so their values are just
+        # the colour indices; sprite priority reads them back from the line
+        if lcdc & LCDC_BG_ENABLE:
+            # Background, wrapping around the 256x256 map
+            row = self.decode_map_row(lcdc & LCDC_BG_MAP, lcdc, (ly + get(SCY)) & 0xFF)
+            line[:] = row[SCROLL_INDEX[get(SCX)]]
+
+            # Window, from WX-7 to the right edge, without wrapping
+            wx = get(WX) - 7
+            if lcdc & LCDC_WINDOW_ENABLE and ly >= get(WY) and wx < SCREEN_WIDTH:
+                row = self.decode_map_row(lcdc & LCDC_WINDOW_MAP, lcdc, self.window_line)
+                if wx >= 0:
+                    line[wx:] = row[:SCREEN_WIDTH - wx]
+                else:
+                    line[:] = row[-wx:SCREEN_WIDTH - wx]
+                self.window_line += 1
+        else:
+            # BG and window off: colour 0 everywhere
+            line[:] = PALETTE_BGP * 4
+
+        if lcdc & LCDC_OBJ_ENABLE:
+            self.render_sprites(ly, lcdc, line)
+
+    def decode_map_row(self, high_map, lcdc, y):
+        # Colour indices of one 256 pixel row of a tile map
+        mmu = self.mmu
+        tile_map = mmu.BG_MAP_2 if high_map else mmu.BG_MAP_1
+        tile_ids = tile_map[(y >> 3) * 32:(y >> 3) * 32 + 32]
+
+        cache = self.tile_cache
+        cache.hits += 32
+        tiles = TILE_NUMBERS[1 if lcdc & LCDC_TILE_DATA else 0][tile_ids]
+        return cache.tiles[tiles, y & 7].ravel()
+
+    def render_sprites(self, ly, lcdc, line):
+        # At most ten sprites touch a line, so this is plain Python over the
+        # handful of pixels involved, with one array write at the end
+        mmu = self.mmu
+        oam = mmu.OAM[:160].tolist()
+        height = 16 if lcdc & LCDC_OBJ_SIZE else 8
+
+        # The first ten sprites in OAM order that cover this line
+        visible = []
+        for i in range(0, 160, 4):
+            if 0 <= ly - (oam[i] - 16) < height:
+                visible.append(i)
+                if len(visible) == MAX_SPRITES_PER_LINE:
+                    break
+        if not visible:
+            return
+
+        # Priority order: lower X wins, then lower OAM index
+        visible.sort(key=lambda i: oam[i + 1])
+
+        cache = self.tile_cache
+        bg_colours = None
+
+        # Pixels already taken by a higher priority sprite.  A behind-BG
+        # sprite still takes its opaque pixels even where the BG hides it.
+        taken = set()
+        pixel_x = []
+        values = []
+
+        for i in visible:
+            y, x, tile, flags = oam[i:i + 4]
+            x -= 8
+            if x <= -8 or x >= SCREEN_WIDTH:
+                continue
+
+            row = ly - (y - 16)
+            if flags & OBJ_Y_FLIP:
+                row = height - 1 - row
+            if height == 16:
+                tile = (tile & 0xFE) + (row >> 3)
+
+            cache.hits += 1
+            colours = cache.tiles[tile, row & 7].tolist()
+            if flags & OBJ_X_FLIP:
+                colours.reverse()
+
+            palette = (PALETTE_OBP1 if flags & OBJ_PALETTE else PALETTE_OBP0) * 4
+            behind = flags & OBJ_BEHIND_BG
+            if behind and bg_colours is None:
+                bg_colours = line.tolist()
+
+            for px in range(max(x, 0), min(x + 8, SCREEN_WIDTH)):
+                colour = colours[px - x]
+                # Colour 0 is transparent
+                if colour == 0 or px in taken:
+                    continue
+                taken.add(px)
+                # Behind-BG sprites only show over BG colour 0
+                if behind and bg_colours[px] != 0:
+                    continue
+                pixel_x.append(px)
+                values.append(palette + colour)
+
+        if pixel_x:
+            line[pixel_x] = values
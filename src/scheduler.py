@@ -0,0 +1,74 @@
+import heapq
+from itertools import count
+from cpu import STOP_BREAKPOINT, STOP_CYCLES
+
+# Event kinds, used to cancel pending events of one kind
+EVENT_SCANLINE = 'scanline'
+EVENT_TIMER = 'timer'
+EVENT_SERIAL = 'serial'
+EVENT_DMA = 'dma'
+
+class Scheduler:
+    # Keeps time for every component on the CPU's clock (cpu.cycles), from
+    # a priority queue of (time, event, callback) entries.
+    #
+    # run() lets the CPU go in one run_cycles batch up to the next due
+    # event (or one the batch itself schedules, see schedule_at), then
+    # calls that event's callback with the time it was due at;
+    # periodic events reschedule themselves from that time, so the few
+    # cycles the CPU overshoots by never accumulate.  Components with
+    # nothing pending cost nothing per instruction: registers that depend
+    # on the time (DIV, LY...) are computed when they are read.
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.queue = []
+        # Tie-breaker so events due at the same time run in the order they
+        # were scheduled
+        self.order = count()
+
+    @property
+    def now(self):
+        return self.cpu.cycles
+
+    def schedule_at(self, time, event, callback):
+        heapq.heappush(self.queue, (time, next(self.order), event, callback))
+        # Scheduled by an instruction in the middle of a run_cycles batch:
+        # end the batch at the new event rather than the one it was aimed at
+        stop_at = self.cpu.stop_at
+        if stop_at is not None and time < stop_at:
+            self.cpu.stop_at = time
+
+    def schedule(self, delay, event, callback):
+        self.schedule_at(self.cpu.cycles + delay, event, callback)
+
+    def cancel(self, event):
+        queue = [entry for entry in self.queue if entry[2] != event]
+        if len(queue) != len(self.queue):
+            heapq.heapify(queue)
+            self.queue = queue
+
+    def pending(self, event):
+        return any(entry[2] == event for entry in self.queue)
+
+    def run(self, until):
+        # Runs the CPU and due events until cpu.cycles reaches until.
+        # Returns STOP_BREAKPOINT if a CPU breakpoint stopped it early,
+        # otherwise STOP_CYCLES.
+        cpu = self.cpu
+        heappop = heapq.heappop
+
+        while cpu.cycles < until:
+            queue = self.queue
+            target = min(queue[0][0], until) if queue else until
+
+            if target > cpu.cycles:
+                spent, reason = cpu.run_cycles(target - cpu.cycles)
+                if reason == STOP_BREAKPOINT:
+                    return STOP_BREAKPOINT
+
+            # cancel() can replace the queue, so look it up each time
+            while self.queue and self.queue[0][0] <= cpu.cycles:
+                time, _, event, callback = heappop(self.queue)
+                callback(time)
+
+        return STOP_CYCLES
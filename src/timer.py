@@ -0,0 +1,98 @@
+from mmu import INT_TIMER
+from scheduler import EVENT_TIMER
+
+# Timer registers
+DIV = 0xFF04
+TIMA = 0xFF05
+TMA = 0xFF06
+TAC = 0xFF07
+
+TAC_ENABLE = 0x04
+
+# DIV counts up every 256 clock cycles (16384 Hz)
+DIV_PERIOD = 256
+
+# Clock cycles per TIMA increment, by the TAC clock select bits
+TIMA_PERIODS = [1024, 16, 64, 256]
+
+class Timer:
+    # DIV and TIMA are never stepped: their values are worked out from the
+    # clock when they are read, and the only scheduled event is the next
+    # TIMA overflow, which reloads TMA and requests the timer interrupt.
+    # Writes to TIMA, TMA or TAC bring TIMA up to date and reschedule.
+    #
+    # TIMA counts from the last write or overflow rather than off DIV's
+    # internal bits, so the DIV-reset and TAC-change glitches of the real
+    # hardware are not reproduced.
+    def __init__(self, mmu, scheduler):
+        self.mmu = mmu
+        self.scheduler = scheduler
+
+        self.div_base = scheduler.now
+        self.tima = 0
+        self.tima_base = scheduler.now
+        self.tma = 0
+        self.tac = 0
+
+        mmu.map_io(DIV, self.read_div, self.write_div, volatile=True)
+        mmu.map_io(TIMA, self.read_tima, self.write_tima, volatile=True)
+        mmu.map_io(TMA, self.read_tma, self.write_tma)
+        mmu.map_io(TAC, self.read_tac, self.write_tac)
+
+    def period(self):
+        return TIMA_PERIODS[self.tac & 0x03]
+
+    def read_div(self, addr):
+        return ((self.scheduler.now - self.div_base) // DIV_PERIOD) & 0xFF
+
+    def write_div(self, addr, val):
+        # Any write resets DIV
+        self.div_base = self.scheduler.now
+
+    def read_tima(self, addr):
+        self.sync()
+        return self.tima
+
+    def write_tima(self, addr, val):
+        self.sync()
+        self.tima = val
+        self.reschedule()
+
+    def read_tma(self, addr):
+        return self.tma
+
+    def write_tma(self, addr, val):
+        self.tma = val
+
+    def read_tac(self, addr):
+        return self.tac | 0xF8
+
+    def write_tac(self, addr, val):
+        self.sync()
+        self.tac = val & 0x07
+        self.reschedule()
+
+    def sync(self):
+        # Fold the increments since tima_base into tima.  An overflow is
+        # always an event, so this never wraps.
+        now = self.scheduler.now
+        if self.tac & TAC_ENABLE:
+            period = self.period()
+            ticks = (now - self.tima_base) // period
+            self.tima = min(self.tima + ticks, 0xFF)
+            self.tima_base += ticks * period
+        else:
+            self.tima_base = now
+
+    def reschedule(self):
+        scheduler = self.scheduler
+        scheduler.cancel(EVENT_TIMER)
+        if self.tac & TAC_ENABLE:
+            overflow = self.tima_base + (0x100 - self.tima) * self.period()
+            scheduler.schedule_at(overflow, EVENT_TIMER, self.overflow)
+
+    def overflow(self, time):
+        self.tima = self.tma
+        self.tima_base = time
+        self.mmu.request_interrupt(INT_TIMER)
+        self.reschedule()
@@ -0,0 +1,684 @@
+import hashlib
+import marshal
+import os
+import sys
+from cpu import (OP_CYCLES, CB_CYCLES, JR_TAKEN, JP_TAKEN, CALL_TAKEN, RET_TAKEN,
+                 REG_B, REG_C, REG_D, REG_E, REG_H, REG_L, REG_A, REG_F,
+                 STOP_CYCLES, STOP_INTERRUPT, STOP_PREDICATE)
+from mmu import HandlerPage
+from version import VERSION
+
+# Straight-line runs of code are decoded once into Python source for a whole
+# block, compiled, and cached by (ROM bank, address).  Registers live in
+# locals for the length of the block, operands are folded into the source
+# as constants, and memory is accessed through the MMU page tables directly.
+# Only ROM and work RAM are translated; code anywhere else (high RAM DMA
+# routines...) is interpreted an instruction at a time.
+#
+# Differences from the interpreter, which is still used whenever a
+# breakpoint is set:
+#   - interrupts are dispatched, and the cycle budget checked, between
+#     blocks rather than between instructions
+#   - a block that overwrites its own code finishes running the old code
+#
+# ROM blocks can be kept on disk between runs (see cache_path), as
+# marshalled code objects, so a warm start compiles nothing.
+
+MAX_BLOCK_INSTRUCTIONS = 32
+
+# Block cache file header.  Bump BLOCK_CACHE_VERSION when the generated code
+# changes without a new emulator VERSION.
+BLOCK_CACHE_VERSION = 1
+CACHE_MAGIC = b'PYGBBLK' + bytes([BLOCK_CACHE_VERSION])
+
+# Local variable names of the registers in generated code
+REG_NAMES = {REG_B: 'b', REG_C: 'c', REG_D: 'd', REG_E: 'e', REG_H: 'h', REG_L: 'l', REG_A: 'a',
+             REG_F: 'f'}
+
+# Register operand in the low 3 bits of an opcode, 6 being (HL)
+OPERANDS = [REG_B, REG_C, REG_D, REG_E, REG_H, REG_L, None, REG_A]
+
+# 8-bit ALU operations by bits 3-5 of the opcode: (helper, with carry,
+# stores result)
+ALU_OPS = [('add_8', False, True), ('add_8', True, True), ('sub_8', False, True),
+           ('sub_8', True, True), ('and_8', False, True), ('xor_8', False, True),
+           ('or_8', False, True), ('sub_8', False, False)]
+
+# Branch conditions by bits 3-4 of the opcode, testing F
+CONDITIONS = ['not %s & 0x80', '%s & 0x80', 'not %s & 0x10', '%s & 0x10']
+
+# Flag updates written out in generated code, for the eager flag helpers.
+# Each keeps F's low nibble as set_flag does.  ADC and SBC always take the
+# carry in, as add_8/sub_8 are called with use_carry=True.
+ALU_FLAGS = {
+    'add_8': ['t = %(a)s + %(v)s%(carry)s',
+              'f = f & 0x0F | (0 if t & 0xFF else 0x80)'
+              ' | (0x20 if (%(a)s & 0x0F) + (%(v)s & 0x0F)%(carry)s > 0x0F else 0)'
+              ' | (0x10 if t > 0xFF else 0)',
+              't &= 0xFF'],
+    'sub_8': ['t = %(a)s - %(v)s%(borrow)s',
+              'f = f & 0x0F | (0 if t & 0xFF else 0x80) | 0x40'
+              ' | (0x20 if (%(a)s & 0x0F) < (%(v)s & 0x0F)%(carry)s else 0)'
+              ' | (0x10 if t < 0 else 0)',
+              't &= 0xFF'],
+    'and_8': ['t = %(a)s & %(v)s', 'f = f & 0x0F | (0x20 if t else 0xA0)'],
+    'or_8': ['t = %(a)s | %(v)s', 'f = f & 0x0F | (0 if t else 0x80)'],
+    'xor_8': ['t = %(a)s ^ %(v)s', 'f = f & 0x0F | (0 if t else 0x80)'],
+    'inc_8': ['t = (%(v)s + 1) & 0xFF',
+              'f = f & 0x1F | (0 if t else 0x80) | (0x20 if %(v)s & 0x0F == 0x0F else 0)'],
+    'dec_8': ['t = (%(v)s - 1) & 0xFF',
+              'f = f & 0x1F | 0x40 | (0 if t else 0x80) | (0x20 if %(v)s & 0x0F == 0 else 0)']
+}
+
+# Opcodes left to their interpreter handler within a block, by the number of
+# bytes the handler consumes.  Anything not listed here or translated below
+# ends the block, as it may jump or change the interrupt state.
+HANDLER_LENGTHS = {op: 1 for op in [0x07, 0x0F, 0x17, 0x1F, 0x27, 0x2F, 0x37, 0x3F,
+                                    0x09, 0x19, 0x29, 0x39, 0xF9, 0xF3, 0xF1, 0xF5]}
+HANDLER_LENGTHS[0xF8] = 2
+HANDLER_LENGTHS[0x08] = 3
+HANDLER_LENGTHS[0xE8] = 3       # ADD SP, n reads a 16-bit operand here
+
+# Translatable regions: (start, end), and the regions' bank lookup
+ROM_BANK_0 = (0x0000, 0x4000)
+ROM_BANK_N = (0x4000, 0x8000)
+WORK_RAM = (0xC000, 0xE000)
+WORK_RAM_BANK = -1
+
+def cache_path(directory, rom_file, inline_flags):
+    # Block cache file for a ROM.  Code objects only load into the Python
+    # that marshalled them, hence the cache tag, and blocks generated for
+    # inline flags call no flag helpers.  The ROM is hashed in place,
+    # through the buffer protocol, rather than copied to bytes.
+    digest = hashlib.sha1(rom_file).hexdigest()
+    return os.path.join(directory, '%s-%s-%s-%s.blocks' % (
+        digest, VERSION, sys.implementation.cache_tag, 'inline' if inline_flags else 'helpers'))
+
+class BlockBuilder:
+    # Generates the source of one block.  Tracks which registers are loaded
+    # into locals and which locals need writing back, and how many of the
+    # block's cycles have been added to cpu.cycles: they are brought up to
+    # date before each memory access, so the hardware sees the same time
+    # the interpreter would show it.
+    def __init__(self, inline_flags):
+        self.inline_flags = inline_flags
+        self.lines = []
+        self.loaded = set()
+        self.dirty = set()
+        self.cycles = 0
+        self.synced = 0
+
+    def emit(self, line, indent = 1):
+        self.lines.append('    ' * indent + line)
+
+    def reg(self, r):
+        if r not in self.loaded:
+            self.emit('%s = regs[%d]' % (REG_NAMES[r], r))
+            self.loaded.add(r)
+        return REG_NAMES[r]
+
+    def set_reg(self, r, expr):
+        self.emit('%s = %s' % (REG_NAMES[r], expr))
+        self.loaded.add(r)
+        self.dirty.add(r)
+
+    def set_pair(self, hi, expr):
+        self.emit('t = %s' % expr)
+        self.set_reg(hi, 't >> 8')
+        self.set_reg(hi + 1, 't & 0xFF')
+
+    def pair(self, hi):
+        return '(%s << 8 | %s)' % (self.reg(hi), self.reg(hi + 1))
+
+    def flush(self, indent = 1):
+        for r in sorted(self.dirty):
+            self.emit('regs[%d] = %s' % (r, REG_NAMES[r]), indent)
+        self.dirty.clear()
+
+    def sync(self):
+        if self.cycles > self.synced:
+            self.emit('cpu.cycles += %d' % (self.cycles - self.synced))
+            self.synced = self.cycles
+
+    def read(self, addr):
+        # addr is a constant or an expression
+        if isinstance(addr, int):
+            if addr >= 0xFF00:
+                self.sync()
+            return 'rp[0x%02X][0x%02X]' % (addr >> 8, addr & 0xFF)
+        self.sync()
+        self.emit('t = %s' % addr)
+        return 'rp[t >> 8][t & 0xFF]'
+
+    def write(self, addr, val):
+        if isinstance(addr, int):
+            if addr >= 0xFF00:
+                self.sync()
+            self.emit('wp[0x%02X][0x%02X] = %s' % (addr >> 8, addr & 0xFF, val))
+        else:
+            self.sync()
+            self.emit('t = %s' % addr)
+            self.emit('wp[t >> 8][t & 0xFF] = %s' % val)
+
+    def alu(self, helper, a, v, carry = False):
+        # Emits an 8-bit ALU operation on a and v, returning an expression
+        # for the result: the helper call, or with inline flags t, after
+        # the flag update is written out on the local f
+        if not self.inline_flags:
+            if helper in ('inc_8', 'dec_8'):
+                return '%s(%s)' % (helper, v)
+            return '%s(%s, %s%s)' % (helper, a, v, ', True' if carry else '')
+        if not v.isidentifier() and not v.isdigit():
+            self.emit('v = %s' % v)
+            v = 'v'
+        self.reg(REG_F)
+        self.dirty.add(REG_F)
+        for line in ALU_FLAGS[helper]:
+            self.emit(line % {'a': a, 'v': v, 'carry': ' + 1' if carry else '',
+                              'borrow': ' - 1' if carry else ''})
+        return 't'
+
+    def handler(self, pc, clobbers = None):
+        # Hand an instruction to the interpreter, with the registers in the
+        # register file and PC set to pc.  Locals of the registers in
+        # clobbers (all of them if None) are reloaded after it.
+        self.flush()
+        if clobbers is None:
+            self.loaded.clear()
+        else:
+            self.loaded -= clobbers
+        self.sync()
+        self.emit('cpu.pc = 0x%04X' % pc)
+
+    def exit(self, pc, total, indent = 1):
+        # pc is a constant or None when already set.  Registers must have
+        # been flushed.
+        if pc is not None:
+            self.emit('cpu.pc = 0x%04X' % pc, indent)
+        if total > self.synced:
+            self.emit('cpu.cycles += %d' % (total - self.synced), indent)
+        self.emit('return %d' % total, indent)
+
+    def branch(self, condition, taken_pc, taken_cycles, not_taken_pc, not_taken_cycles, push = None):
+        # condition is an index into CONDITIONS
+        condition = CONDITIONS[condition] % (self.reg(REG_F) if self.inline_flags else 'regs[7]')
+        self.flush()
+        if not self.inline_flags:
+            self.emit('if cpu.pending_flags is not None:')
+            self.emit('cpu.resolve_flags()', 2)
+        self.emit('if %s:' % condition)
+        if push is not None:
+            self.emit('push_stack(0x%04X)' % push, 2)
+        if taken_pc is None:
+            self.emit('cpu.pc = pop_stack()', 2)
+        self.exit(taken_pc, self.cycles + taken_cycles, 2)
+        self.exit(not_taken_pc, self.cycles + not_taken_cycles)
+
+    def source(self):
+        return 'def block():\n' + '\n'.join(self.lines) + '\n'
+
+class BlockTranslator:
+    # Runs the CPU a block at a time, translating blocks on first use.
+    #
+    # Blocks in work RAM are dropped when their memory is written: each page
+    # holding translated code has its write page swapped for a HandlerPage
+    # that writes through, drops the page's blocks and restores the plain
+    # page.  ROM blocks are keyed by bank, so bank switching needs nothing.
+    def __init__(self, cpu):
+        self.cpu = cpu
+        mmu = self.mmu = cpu.mmu
+
+        self.blocks = {}
+        self.page_blocks = {}
+        self.watched = {}
+
+        # Counters: blocks translated, blocks run, instructions interpreted
+        # outside translatable memory, and blocks dropped on writes
+        self.translated = 0
+        self.executed = 0
+        self.interpreted = 0
+        self.invalidated = 0
+
+        # Code objects of the ROM blocks, {key: (code, branch)}, and those
+        # loaded from a block cache and not compiled yet
+        self.code = {}
+        self.cached = {}
+        self.cache_hits = 0
+
+        # Flags are worked out in the generated code unless the helpers
+        # have been swapped for the lazy or table-driven ones
+        self.inline_flags = 'add_8' not in vars(cpu)
+
+        self.namespace = {
+            'cpu': cpu,
+            'regs': cpu.regs,
+            'rp': mmu.read_pages,
+            'wp': mmu.write_pages,
+            'ops': cpu.ops,
+            'cb_ops': cpu.cb_ops,
+            'push_stack': cpu.push_stack,
+            'pop_stack': cpu.pop_stack,
+            'add_8': cpu.add_8,
+            'sub_8': cpu.sub_8,
+            'and_8': cpu.and_8,
+            'or_8': cpu.or_8,
+            'xor_8': cpu.xor_8,
+            'inc_8': cpu.inc_8,
+            'dec_8': cpu.dec_8
+        }
+
+    def block_key(self, pc):
+        cartridge = self.mmu.cartridge
+        if pc < 0x4000:
+            return (cartridge.rom_bank_0, pc)
+        if pc < 0x8000:
+            return (cartridge.rom_bank, pc)
+        if WORK_RAM[0] <= pc < WORK_RAM[1]:
+            return (WORK_RAM_BANK, pc)
+        return None
+
+    def run(self, max_cycles, predicate):
+        # As CPU.run_batch, a block at a time
+        cpu = self.cpu
+        ops = cpu.ops
+        read_pages = self.mmu.read_pages
+        blocks = self.blocks
+        block_key = self.block_key
+        handle_interrupts = cpu.handle_interrupts
+        idle_loops = cpu.idle_loops and max_cycles is not None and predicate is None
+        idle_loop_reads = cpu.idle_loop_reads
+        if cpu.idle_state is not None and cpu.idle_state[1] != cpu.cycles:
+            cpu.idle_state = None
+
+        spent = 0
+        reason = STOP_CYCLES
+        while cpu.cycles < cpu.stop_at:
+            if cpu.halted:
+                if max_cycles is None:
+                    skip = 4
+                else:
+                    skip = -(-(cpu.stop_at - cpu.cycles) // 4) * 4
+                cycles = cpu.step_halted(skip)
+                spent += cycles
+                cpu.cycles += cycles
+                if not cpu.halted:
+                    reason = STOP_INTERRUPT
+                    break
+                if predicate is not None and predicate(cpu):
+                    reason = STOP_PREDICATE
+                    break
+                continue
+
+            pc = cpu.pc
+            key = block_key(pc)
+            if key is None:
+                # Not translatable: one instruction, as the interpreter does
+                if pc & ~0xFFFF:
+                    self.mmu.get(pc)
+                cpu.pc = pc + 1
+                op = read_pages[pc >> 8][pc & 0xFF]
+                cycles = ops[op]() or OP_CYCLES[op]
+                cpu.cycles += cycles
+                branch = pc
+                self.interpreted += 1
+            else:
+                block = blocks.get(key)
+                if block is None:
+                    block = blocks[key] = self.translate(pc, key)
+                cycles = block()
+                branch = block.branch
+                self.executed += 1
+
+            if cpu.interrupt_master_enable:
+                interrupt = handle_interrupts()
+                if interrupt:
+                    spent += cycles + interrupt
+                    cpu.cycles += interrupt
+                    reason = STOP_INTERRUPT
+                    break
+
+            spent += cycles
+
+            target = cpu.pc
+            if idle_loops and target <= branch and cpu.cycles < cpu.stop_at \
+                    and idle_loop_reads.get((target, branch)) is not False:
+                skipped = cpu.skip_idle_loop(target, branch, cpu.stop_at - cpu.cycles)
+                spent += skipped
+                cpu.cycles += skipped
+            if predicate is not None and predicate(cpu):
+                reason = STOP_PREDICATE
+                break
+
+        return spent, reason
+
+    def make_block(self, code, branch):
+        namespace = self.namespace
+        exec(code, namespace)
+        block = namespace.pop('block')
+        block.branch = branch
+        return block
+
+    def translate(self, start, key):
+        cached = self.cached.pop(key, None)
+        if cached is not None:
+            self.code[key] = cached
+            self.cache_hits += 1
+            return self.make_block(*cached)
+
+        get = self.mmu.get
+        region_end = ROM_BANK_0[1] if start < ROM_BANK_0[1] else \
+                     ROM_BANK_N[1] if start < ROM_BANK_N[1] else WORK_RAM[1]
+        # Code in the switchable bank may switch itself out with any store
+        stores_end = ROM_BANK_N[0] <= start < ROM_BANK_N[1]
+
+        builder = BlockBuilder(self.inline_flags)
+        addr = start
+        last = start
+        ended = False
+        for _ in range(MAX_BLOCK_INSTRUCTIONS):
+            op = get(addr)
+            if addr + 3 > region_end and addr + self.length(op) > region_end:
+                # Straddles the end of the region: the next block starts
+                # here, or if this is the first instruction the handler
+                # fetches its operands
+                if addr == start:
+                    ended, addr = self.interpret(builder, op, addr)
+                break
+            last = addr
+            ended, addr = self.translate_op(builder, op, addr, stores_end)
+            if ended:
+                break
+
+        if not ended:
+            builder.flush()
+            builder.exit(addr, builder.cycles)
+
+        code = compile(builder.source(), '<block %d:0x%04X>' % key, 'exec')
+        block = self.make_block(code, last)
+        self.translated += 1
+        if key[0] != WORK_RAM_BANK:
+            self.code[key] = (code, last)
+
+        if key[0] == WORK_RAM_BANK:
+            for page in range(start >> 8, ((addr - 1) >> 8) + 1):
+                self.watch(page, key)
+        return block
+
+    def length(self, op):
+        if op in HANDLER_LENGTHS:
+            return HANDLER_LENGTHS[op]
+        if op in (0x01, 0x11, 0x21, 0x31, 0xC2, 0xC3, 0xC4, 0xCA, 0xCC, 0xCD,
+                  0xD2, 0xD4, 0xDA, 0xDC, 0xEA, 0xFA):
+            return 3
+        if op & 0xC7 == 0x06 or op & 0xC7 == 0xC6 or op in (0x18, 0x20, 0x28, 0x30, 0x38,
+                                                            0xE0, 0xF0, 0x10, 0xCB):
+            return 2
+        return 1
+
+    def translate_op(self, b, op, addr, stores_end):
+        # Emits one instruction.  Returns (block ended, next address).
+        get = self.mmu.get
+        n = get(addr + 1) if self.length(op) > 1 else None
+        nn = n | (get(addr + 2) << 8) if self.length(op) > 2 else None
+        cycles = OP_CYCLES[op]
+
+        # LD r, r' / LD r, (HL) / LD (HL), r
+        if 0x40 <= op < 0x80 and op != 0x76:
+            src = OPERANDS[op & 0x07]
+            dst = OPERANDS[(op >> 3) & 0x07]
+            if src is None:
+                b.set_reg(dst, b.read(b.pair(REG_H)))
+            elif dst is None:
+                b.write(b.pair(REG_H), b.reg(src))
+                if stores_end:
+                    return self.end(b, cycles, addr + 1)
+            else:
+                b.set_reg(dst, b.reg(src))
+
+        # LD r, n / LD (HL), n
+        elif op & 0xC7 == 0x06 and op < 0x40:
+            dst = OPERANDS[(op >> 3) & 0x07]
+            if dst is None:
+                b.write(b.pair(REG_H), str(n))
+                if stores_end:
+                    return self.end(b, cycles, addr + 2)
+            else:
+                b.set_reg(dst, str(n))
+
+        # LD A, (BC) / LD A, (DE)
+        elif op in (0x0A, 0x1A):
+            b.set_reg(REG_A, b.read(b.pair(REG_B if op == 0x0A else REG_D)))
+
+        # LD (BC), A / LD (DE), A
+        elif op in (0x02, 0x12):
+            b.write(b.pair(REG_B if op == 0x02 else REG_D), b.reg(REG_A))
+            if stores_end:
+                return self.end(b, cycles, addr + 1)
+
+        # LD A, (nn) / LDH A, (n) / LD A, (C)
+        elif op == 0xFA:
+            b.set_reg(REG_A, b.read(nn))
+        elif op == 0xF0:
+            b.set_reg(REG_A, b.read(0xFF00 + n))
+        elif op == 0xF2:
+            b.set_reg(REG_A, b.read('0xFF00 + %s' % b.reg(REG_C)))
+
+        # LD (nn), A / LDH (n), A / LD (C), A
+        elif op == 0xEA:
+            b.write(nn, b.reg(REG_A))
+            if nn < 0x8000 or stores_end:
+                # Memory bank controller: the bank may have changed
+                return self.end(b, cycles, addr + 3)
+        elif op == 0xE0:
+            b.write(0xFF00 + n, b.reg(REG_A))
+        elif op == 0xE2:
+            b.write('0xFF00 + %s' % b.reg(REG_C), b.reg(REG_A))
+
+        # LDI/LDD (HL), A and A, (HL)
+        elif op in (0x22, 0x2A, 0x32, 0x3A):
+            hl = b.pair(REG_H)
+            if op & 0x08:
+                b.set_reg(REG_A, b.read(hl))
+            else:
+                b.write(hl, b.reg(REG_A))
+            b.set_pair(REG_H, '(t %s 1) & 0xFFFF' % ('+' if op < 0x30 else '-'))
+            if stores_end and not op & 0x08:
+                return self.end(b, cycles, addr + 1)
+
+        # LD rr, nn / LD SP, nn
+        elif op in (0x01, 0x11, 0x21):
+            hi = (op >> 4) * 2
+            b.set_reg(hi, str(nn >> 8))
+            b.set_reg(hi + 1, str(nn & 0xFF))
+        elif op == 0x31:
+            b.emit('cpu.sp = %d' % nn)
+
+        # 8-bit ALU on a register, (HL) or n
+        elif 0x80 <= op < 0xC0 or op & 0xC7 == 0xC6:
+            helper, carry, store = ALU_OPS[(op >> 3) & 0x07]
+            if op >= 0xC0:
+                val = str(n)
+            elif OPERANDS[op & 0x07] is None:
+                val = b.read(b.pair(REG_H))
+            else:
+                val = b.reg(OPERANDS[op & 0x07])
+            expr = b.alu(helper, b.reg(REG_A), val, carry)
+            if store:
+                b.set_reg(REG_A, expr)
+            elif not b.inline_flags:
+                b.emit(expr)
+
+        # INC/DEC r / (HL)
+        elif op < 0x40 and op & 0x06 == 0x04:
+            helper = 'dec_8' if op & 0x01 else 'inc_8'
+            r = OPERANDS[(op >> 3) & 0x07]
+            if r is None:
+                b.sync()
+                b.emit('hl = %s' % b.pair(REG_H))
+                b.emit('wp[hl >> 8][hl & 0xFF] = %s' % b.alu(helper, None, 'rp[hl >> 8][hl & 0xFF]'))
+                if stores_end:
+                    return self.end(b, cycles, addr + 1)
+            else:
+                b.set_reg(r, b.alu(helper, None, b.reg(r)))
+
+        # INC/DEC rr / SP
+        elif op < 0x40 and op & 0x07 == 0x03:
+            sign = '-' if op & 0x08 else '+'
+            if op >> 4 == 3:
+                b.emit('cpu.sp = (cpu.sp %s 1) %% 0x10000' % sign)
+            else:
+                hi = (op >> 4) * 2
+                b.set_pair(hi, '(%s %s 1) & 0xFFFF' % (b.pair(hi), sign))
+
+        elif op == 0x00:
+            pass
+
+        # Jumps, calls and returns end the block
+        elif op == 0xC3:
+            b.cycles += cycles
+            b.flush()
+            b.exit(nn, b.cycles)
+            return True, addr + 3
+        elif op in (0xC2, 0xCA, 0xD2, 0xDA):
+            b.branch((op >> 3) & 0x03, nn, JP_TAKEN, addr + 3, cycles)
+            return True, addr + 3
+        elif op == 0x18:
+            b.cycles += cycles
+            b.flush()
+            b.exit(addr + 1 + n, b.cycles)
+            return True, addr + 2
+        elif op in (0x20, 0x28, 0x30, 0x38):
+            # The offset is unsigned and counted from the offset byte, as
+            # in the interpreter
+            b.branch((op >> 3) & 0x03, addr + 1 + n, JR_TAKEN, addr + 2, cycles)
+            return True, addr + 2
+        elif op == 0xCD:
+            b.flush()
+            b.sync()
+            b.emit('push_stack(0x%04X)' % (addr + 3))
+            b.cycles += cycles
+            b.exit(nn, b.cycles)
+            return True, addr + 3
+        elif op in (0xC4, 0xCC, 0xD4, 0xDC):
+            b.sync()
+            b.branch((op >> 3) & 0x03, nn, CALL_TAKEN, addr + 3, cycles, push=addr + 3)
+            return True, addr + 3
+        elif op == 0xC9:
+            b.flush()
+            b.sync()
+            b.emit('cpu.pc = pop_stack()')
+            b.cycles += cycles
+            b.exit(None, b.cycles)
+            return True, addr + 1
+        elif op in (0xC0, 0xC8, 0xD0, 0xD8):
+            b.sync()
+            b.branch((op >> 3) & 0x03, None, RET_TAKEN, addr + 1, cycles)
+            return True, addr + 1
+
+        # PUSH rr / POP rr, but not AF
+        elif op in (0xC5, 0xD5, 0xE5):
+            b.sync()
+            b.emit('push_stack(%s)' % b.pair((op >> 4) * 2 - 0x18))
+        elif op in (0xC1, 0xD1, 0xE1):
+            b.sync()
+            b.set_pair((op >> 4) * 2 - 0x18, 'pop_stack()')
+
+        # CB-prefixed ops only change their operand register and F
+        elif op == 0xCB:
+            b.handler(addr + 2, {OPERANDS[n & 0x07], REG_F})
+            b.emit('cb_ops[0x%02X]()' % n)
+            b.cycles += CB_CYCLES[n]
+            return False, addr + 2
+
+        # Everything else goes to the interpreter's handler
+        elif op in HANDLER_LENGTHS:
+            b.handler(addr + 1)
+            b.emit('ops[0x%02X]()' % op)
+            b.cycles += cycles
+            return False, addr + HANDLER_LENGTHS[op]
+        else:
+            return self.interpret(b, op, addr)
+
+        b.cycles += cycles
+        return False, addr + self.length(op)
+
+    def interpret(self, b, op, addr):
+        # Ends the block with the interpreter's handler, which sets PC
+        b.handler(addr + 1)
+        b.emit('c = ops[0x%02X]() or %d' % (op, OP_CYCLES[op]))
+        b.emit('cpu.cycles += c + %d' % (b.cycles - b.synced))
+        b.emit('return c + %d' % b.cycles)
+        return True, addr + 1
+
+    def end(self, b, cycles, next_addr):
+        b.cycles += cycles
+        b.flush()
+        b.exit(next_addr, b.cycles)
+        return True, next_addr
+
+    def watch(self, page, key):
+        # Swap in a write page that drops this page's blocks on any write
+        self.page_blocks.setdefault(page, set()).add(key)
+        if page in self.watched:
+            return
+        write_pages = self.mmu.write_pages
+        self.watched[page] = write_pages[page]
+        write_pages[page] = HandlerPage(page << 8, self.mmu.unimplemented, self.code_write)
+
+    def code_write(self, addr, val):
+        page = addr >> 8
+        original = self.watched.pop(page)
+        self.mmu.write_pages[page] = original
+        original[addr & 0xFF] = val
+
+        for key in self.page_blocks.pop(page, ()):
+            if self.blocks.pop(key, None) is not None:
+                self.invalidated += 1
+
+    def report(self):
+        return ('%d blocks translated, %d loaded from cache, %d run, %d invalidated; '
+                '%d instructions interpreted'
+                % (self.translated, self.cache_hits, self.executed, self.invalidated,
+                   self.interpreted))
+
+    def load_cache(self, path):
+        # Takes the ROM blocks saved in path (see cache_path).  A missing or
+        # unreadable cache leaves everything to be translated.
+        try:
+            with open(path, 'rb') as fh:
+                if fh.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                    raise ValueError('Not a block cache: ' + path)
+                cached = marshal.load(fh)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        self.cached.update(cached)
+        return True
+
+    def save_cache(self, path):
+        # Writes every ROM block translated or loaded so far, plus those
+        # loaded and not used this run.  The file is replaced in one go, so
+        # processes sharing a cache never see half a file.
+        blocks = dict(self.cached)
+        blocks.update(self.code)
+        directory = os.path.dirname(path)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(temp_path, 'wb') as fh:
+                fh.write(CACHE_MAGIC)
+                marshal.dump(blocks, fh)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        return True
+
+    def flush(self):
+        # Drop every block, e.g. after loading a state
+        for page, original in self.watched.items():
+            self.mmu.write_pages[page] = original
+        self.watched.clear()
+        self.page_blocks.clear()
+        self.blocks.clear()
@@ -0,0 +1,597 @@
+from functools import partial
+import numpy as np
+
+from cpu import OP_CYCLES, CB_CYCLES, JR_TAKEN, JP_TAKEN, CALL_TAKEN, RET_TAKEN, \
+    OPCODE_REGS, REG_INDEX, PAIR_INDEX, REG_A, REG_F, REG_B, REG_D, REG_H
+import alu_tables
+
+# Lockstep execution of many instances of one ROM, for batch workloads
+# (fuzzing, training) that run the same code over and over with different
+# inputs.
+#
+# The registers and memory of all count instances are (count, ...) numpy
+# arrays.  Each step fetches the opcode at every running instance's PC and
+# runs each opcode once, as numpy operations over the group of instances
+# on it: when the instances run the same code, one Python dispatch is
+# shared by all of them.  The handlers follow numba_cpu.step, quirks and
+# ALU tables included.
+#
+# Each instance is a CPU and a flat 64 KB of memory, without the PPU,
+# timer, serial port or interrupts: the I/O registers are plain memory,
+# for the caller to fill in (joypad state, say) between runs.  Writes to
+# ROM are dropped, so only 32 KB ROMs without bank switching are
+# supported.  Addresses wrap at 0xFFFF.  HALT and STOP, which would wait
+# forever for an interrupt, and unused opcodes stop the instance on that
+# instruction; stopped marks which have.
+
+# Unused opcodes
+UNUSED_OPS = [0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD]
+
+MAX_ROM_SIZE = 0x8000
+
+_alu = None
+
+def vector_alu_tables():
+    # The ALU tables as int64 arrays, built once per process
+    global _alu
+    if _alu is None:
+        _alu = {name: np.asarray(table, dtype=np.int64)
+                for name, table in alu_tables.build_tables().items()}
+    return _alu
+
+
+def condition(cc, f):
+    # NZ, Z, NC, C, for each F in f
+    if cc == 0:
+        return f & 0x80 == 0
+    if cc == 1:
+        return f & 0x80 != 0
+    if cc == 2:
+        return f & 0x10 == 0
+    return f & 0x10 != 0
+
+
+def add_16(v1, v2, f):
+    # As CPU.add_16 without a carry.  Returns (result, F).
+    total = v1 + v2
+    result = total & 0xFFFF
+    f = (f & 0x0F) | ((result == 0) << 7) | ((((v1 & 0xFFF) + (v2 & 0xFFF)) > 0xFFF) << 5) \
+        | ((total > 0xFFFF) << 4)
+    return result, f
+
+
+class VectorCPU:
+    def __init__(self, rom_file, count):
+        if len(rom_file) > MAX_ROM_SIZE:
+            raise ValueError('VectorCPU runs ROMs of up to 32 KB without bank switching, '
+                             'not %d bytes' % len(rom_file))
+        self.count = count
+        self.memory = np.zeros((count, 0x10000), dtype=np.uint8)
+        self.memory[:, :len(rom_file)] = rom_file
+
+        # Registers in CPU.regs order, one row per instance
+        self.regs = np.zeros((count, 8), dtype=np.uint8)
+        self.sp = np.full(count, 0xFFFE, dtype=np.int64)
+        self.pc = np.full(count, 0x0100, dtype=np.int64)
+        self.interrupt_master_enable = np.zeros(count, dtype=bool)
+        self.cycles = np.zeros(count, dtype=np.int64)
+        self.stopped = np.zeros(count, dtype=bool)
+
+        # Opcode handlers run, and instructions run by them
+        self.dispatches = 0
+        self.instructions = 0
+
+        self.alu = vector_alu_tables()
+        self.build_ops()
+
+    # Register access by name, as CPU's, with one value per instance
+
+    def get_reg_8(self, reg):
+        return self.regs[:, REG_INDEX[reg]].astype(np.int64)
+
+    def set_reg_8(self, reg, val):
+        self.regs[:, REG_INDEX[reg]] = val
+
+    def get_reg_16(self, reg):
+        if reg == 'SP':
+            return self.sp.copy()
+        if reg == 'PC':
+            return self.pc.copy()
+        return self.pair(slice(None), PAIR_INDEX[reg])
+
+    def set_reg_16(self, reg, val):
+        if reg == 'SP':
+            self.sp[:] = val
+        elif reg == 'PC':
+            self.pc[:] = val
+        else:
+            self.set_pair(slice(None), PAIR_INDEX[reg], val)
+
+    # Helpers over the instances in i
+
+    def reg(self, i, r):
+        return self.regs[i, r].astype(np.int64)
+
+    def pair(self, i, r):
+        return (self.reg(i, r) << 8) | self.reg(i, r + 1)
+
+    def set_pair(self, i, r, val):
+        self.regs[i, r] = val >> 8
+        self.regs[i, r + 1] = val & 0xFF
+
+    def read(self, i, addr):
+        return self.memory[i, addr & 0xFFFF].astype(np.int64)
+
+    def write(self, i, addr, val):
+        addr = addr & 0xFFFF
+        ram = addr >= 0x8000
+        if ram.all():
+            self.memory[i, addr] = val
+        else:
+            self.memory[i[ram], addr[ram]] = np.broadcast_to(val, addr.shape)[ram]
+
+    def push(self, i, val):
+        sp = self.sp[i] - 2
+        self.write(i, sp + 1, val >> 8)
+        self.write(i, sp, val & 0xFF)
+        self.sp[i] = sp & 0xFFFF
+
+    def pop(self, i):
+        sp = self.sp[i]
+        self.sp[i] = (sp + 2) & 0xFFFF
+        return (self.read(i, sp + 1) << 8) | self.read(i, sp)
+
+    def operand_8(self, i):
+        return self.read(i, self.pc[i] + 1)
+
+    def operand_16(self, i):
+        pc = self.pc[i]
+        return (self.read(i, pc + 2) << 8) | self.read(i, pc + 1)
+
+    def get_r(self, i, z):
+        # Register z of an opcode, (HL) for 6
+        if z == 6:
+            return self.read(i, self.pair(i, REG_H))
+        return self.reg(i, OPCODE_REGS[z])
+
+    def set_r(self, i, z, val):
+        if z == 6:
+            self.write(i, self.pair(i, REG_H), val)
+        else:
+            self.regs[i, OPCODE_REGS[z]] = val
+
+    # Stepping
+
+    def dispatch(self, i, codes, handlers):
+        # Runs handlers[code] on the instances at each code, once per
+        # distinct code, adding the cycles they return
+        first = codes[0]
+        if (codes == first).all():
+            groups = [(first, i)]
+        else:
+            order = np.argsort(codes, kind='stable')
+            codes = codes[order]
+            i = i[order]
+            bounds = [0, *(np.flatnonzero(codes[1:] != codes[:-1]) + 1), len(codes)]
+            groups = [(codes[start], i[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+        for code, group in groups:
+            # CB adds its own cycles while the handler runs
+            cycles = handlers[code](group)
+            self.cycles[group] += cycles
+        self.dispatches += len(groups)
+
+    def step(self, i):
+        # One instruction on each of the instances in i
+        self.dispatch(i, self.memory[i, self.pc[i] & 0xFFFF], self.ops)
+        self.instructions += len(i)
+
+    def tick(self):
+        # One instruction on every instance not stopped.  Returns the
+        # cycles each ran.
+        start = self.cycles.copy()
+        i = np.flatnonzero(~self.stopped)
+        if len(i):
+            self.step(i)
+        return self.cycles - start
+
+    def run_cycles(self, cycles):
+        # Runs every instance not stopped until the next instruction would
+        # start at or past cycles from now, as CPU.run_cycles.  Returns the
+        # cycles each ran.
+        start = self.cycles.copy()
+        limit = start + cycles
+        while True:
+            i = np.flatnonzero((self.cycles < limit) & ~self.stopped)
+            if not len(i):
+                break
+            self.step(i)
+        return self.cycles - start
+
+    def build_ops(self):
+        ops = [None] * 0x100
+        cb_ops = [None] * 0x100
+
+        for op in range(0x100):
+            x = op >> 6
+            y = (op >> 3) & 0x07
+            z = op & 0x07
+            p = y >> 1
+            q = y & 0x01
+
+            if op in UNUSED_OPS or op in (0x10, 0x76):
+                ops[op] = self.STOP_INSTANCE
+            elif x == 1:
+                ops[op] = partial(self.LD_r_r, y, z)
+            elif x == 2:
+                ops[op] = partial(self.ALU_A, y, z, False)
+            elif op & 0xC7 == 0xC6:
+                ops[op] = partial(self.ALU_A, y, z, True)
+            elif op & 0xC7 == 0x04:
+                ops[op] = partial(self.INC_DEC_r, 'inc', y)
+            elif op & 0xC7 == 0x05:
+                ops[op] = partial(self.INC_DEC_r, 'dec', y)
+            elif op & 0xC7 == 0x06:
+                ops[op] = partial(self.LD_r_n, y)
+            elif op & 0xE7 == 0x07:
+                ops[op] = partial(self.ROTATE_A, y)
+            elif op & 0xCF == 0x01:
+                ops[op] = partial(self.LD_rr_nn, p)
+            elif op & 0xCF == 0x09:
+                ops[op] = partial(self.ADD_HL_rr, p)
+            elif op & 0xC7 == 0x02:
+                ops[op] = partial(self.LD_rr_A, p, q)
+            elif op & 0xC7 == 0x03:
+                ops[op] = partial(self.INC_DEC_rr, p, 1 if q == 0 else -1)
+            elif op & 0xCF == 0xC1:
+                ops[op] = partial(self.POP, p)
+            elif op & 0xCF == 0xC5:
+                ops[op] = partial(self.PUSH, p)
+            elif op & 0xC7 == 0xC7:
+                ops[op] = partial(self.RST, y << 3)
+            elif op in (0x18, 0x20, 0x28, 0x30, 0x38):
+                ops[op] = partial(self.JR, None if op == 0x18 else y - 4, op)
+            elif op in (0xC3, 0xC2, 0xCA, 0xD2, 0xDA):
+                ops[op] = partial(self.JP, None if op == 0xC3 else y, op)
+            elif op in (0xCD, 0xC4, 0xCC, 0xD4, 0xDC):
+                ops[op] = partial(self.CALL, None if op == 0xCD else y, op)
+            elif op in (0xC9, 0xC0, 0xC8, 0xD0, 0xD8):
+                ops[op] = partial(self.RET, None if op == 0xC9 else y, op)
+
+        ops[0x00] = self.NOP
+        ops[0x08] = self.LD_nn_SP
+        ops[0x27] = self.DAA
+        ops[0x2F] = self.CPL
+        ops[0x37] = self.SCF
+        ops[0x3F] = self.CCF
+        ops[0xCB] = self.CB
+        ops[0xD9] = self.RETI
+        ops[0xE0] = self.LDH_n_A
+        ops[0xF0] = self.LDH_A_n
+        ops[0xE2] = self.LD_C_A
+        ops[0xF2] = self.LD_A_C
+        ops[0xEA] = self.LD_nn_A
+        ops[0xFA] = self.LD_A_nn
+        ops[0xE8] = self.ADD_SP_n
+        ops[0xF8] = self.LD_HL_SP_n
+        ops[0xE9] = self.JP_HL
+        ops[0xF9] = self.LD_SP_HL
+        ops[0xF3] = partial(self.SET_IME, False)
+        ops[0xFB] = partial(self.SET_IME, True)
+
+        for op2 in range(0x100):
+            k = op2 >> 6
+            y = (op2 >> 3) & 0x07
+            z = op2 & 0x07
+            if k == 0:
+                cb_ops[op2] = partial(self.SHIFT, y, z, op2)
+            elif k == 1:
+                cb_ops[op2] = partial(self.BIT, y, z, op2)
+            else:
+                cb_ops[op2] = partial(self.RES_SET, k == 3, y, z, op2)
+
+        self.ops = ops
+        self.cb_ops = cb_ops
+
+    # Opcode handlers.  Each takes the instances to run on, all at the
+    # opcode, and returns their cycles.
+
+    def STOP_INSTANCE(self, i):
+        # HALT, STOP and unused opcodes
+        self.stopped[i] = True
+        return 0
+
+    def NOP(self, i):
+        self.pc[i] += 1
+        return OP_CYCLES[0x00]
+
+    def SET_IME(self, enable, i):
+        # DI, EI
+        self.interrupt_master_enable[i] = enable
+        self.pc[i] += 1
+        return OP_CYCLES[0xF3]
+
+    def LD_r_r(self, y, z, i):
+        # LD r, r', LD r, (HL), LD (HL), r
+        self.set_r(i, y, self.get_r(i, z))
+        self.pc[i] += 1
+        return OP_CYCLES[0x40 | (y << 3) | z]
+
+    def LD_r_n(self, y, i):
+        self.set_r(i, y, self.operand_8(i))
+        self.pc[i] += 2
+        return OP_CYCLES[0x06 | (y << 3)]
+
+    def alu_8(self, k, a, v, f):
+        # ADD, ADC, SUB, SBC, AND, XOR, OR, CP.  ADC and SBC always carry,
+        # as in CPU.  Returns (result, F).
+        alu = self.alu
+        index = (a << 8) | v
+        if k == 0:
+            entry = alu['add'][index]
+        elif k == 1:
+            entry = alu['add'][0x10000 + index]
+        elif k == 2 or k == 7:
+            entry = alu['sub'][index]
+        elif k == 3:
+            entry = alu['sub'][0x10000 + index]
+        elif k == 4:
+            entry = alu['and_'][index]
+        elif k == 5:
+            entry = alu['xor'][index]
+        else:
+            entry = alu['or_'][index]
+        return entry >> 8, (f & 0x0F) | (entry & 0xFF)
+
+    def ALU_A(self, y, z, immediate, i):
+        # ALU A, r, ALU A, (HL), ALU A, n
+        v = self.operand_8(i) if immediate else self.get_r(i, z)
+        result, f = self.alu_8(y, self.reg(i, REG_A), v, self.reg(i, REG_F))
+        if y != 7:
+            self.regs[i, REG_A] = result
+        self.regs[i, REG_F] = f
+        self.pc[i] += 2 if immediate else 1
+        return OP_CYCLES[0xC6 | (y << 3)] if immediate else OP_CYCLES[0x80 | (y << 3) | z]
+
+    def INC_DEC_r(self, name, y, i):
+        entry = self.alu[name][self.get_r(i, y)]
+        self.set_r(i, y, entry >> 8)
+        self.regs[i, REG_F] = (self.reg(i, REG_F) & 0x1F) | (entry & 0xFF)
+        self.pc[i] += 1
+        return OP_CYCLES[(0x04 if name == 'inc' else 0x05) | (y << 3)]
+
+    def shift_8(self, k, v, f):
+        # RLC, RRC, RL, RR, SLA, SRA, SWAP, SRL.  Returns (result, F).
+        alu = self.alu
+        if k == 2 or k == 3:
+            entry = alu['rl' if k == 2 else 'rr'][((f & 0x10) << 4) | v]
+        elif k == 6:
+            return alu['swap'][v] >> 8, f
+        else:
+            entry = alu[('rlc', 'rrc', None, None, 'sla', 'sra', None, 'srl')[k]][v]
+        return entry >> 8, (f & 0x0F) | (entry & 0xFF)
+
+    def ROTATE_A(self, y, i):
+        # RLCA, RRCA, RLA, RRA
+        result, f = self.shift_8(y, self.reg(i, REG_A), self.reg(i, REG_F))
+        self.regs[i, REG_A] = result
+        self.regs[i, REG_F] = f
+        self.pc[i] += 1
+        return OP_CYCLES[0x07 | (y << 3)]
+
+    def DAA(self, i):
+        f = self.reg(i, REG_F)
+        entry = self.alu['daa'][((f & 0x70) << 4) | self.reg(i, REG_A)]
+        self.regs[i, REG_A] = entry >> 8
+        self.regs[i, REG_F] = (f & 0x0F) | (entry & 0xFF)
+        self.pc[i] += 1
+        return OP_CYCLES[0x27]
+
+    def CPL(self, i):
+        self.regs[i, REG_A] ^= 0xFF
+        self.regs[i, REG_F] |= 0x60
+        self.pc[i] += 1
+        return OP_CYCLES[0x2F]
+
+    def SCF(self, i):
+        self.regs[i, REG_F] = (self.reg(i, REG_F) | 0x10) & 0x9F
+        self.pc[i] += 1
+        return OP_CYCLES[0x37]
+
+    def CCF(self, i):
+        self.regs[i, REG_F] = (self.reg(i, REG_F) ^ 0x10) & 0x9F
+        self.pc[i] += 1
+        return OP_CYCLES[0x3F]
+
+    def LD_rr_nn(self, p, i):
+        nn = self.operand_16(i)
+        if p == 3:
+            self.sp[i] = nn
+        else:
+            self.set_pair(i, p << 1, nn)
+        self.pc[i] += 3
+        return OP_CYCLES[0x01 | (p << 4)]
+
+    def ADD_HL_rr(self, p, i):
+        # Leaves Z alone
+        v = self.sp[i] if p == 3 else self.pair(i, p << 1)
+        f = self.reg(i, REG_F)
+        result, g = add_16(self.pair(i, REG_H), v, f)
+        self.set_pair(i, REG_H, result)
+        self.regs[i, REG_F] = (g & 0x7F) | (f & 0x80)
+        self.pc[i] += 1
+        return OP_CYCLES[0x09 | (p << 4)]
+
+    def LD_rr_A(self, p, q, i):
+        # LD (BC), A, LD (DE), A, LDI (HL), A, LDD (HL), A and back
+        addr = self.pair(i, (REG_B, REG_D, REG_H, REG_H)[p])
+        if q == 0:
+            self.write(i, addr, self.reg(i, REG_A))
+        else:
+            self.regs[i, REG_A] = self.read(i, addr)
+        if p >= 2:
+            self.set_pair(i, REG_H, (addr + 1 if p == 2 else addr - 1) & 0xFFFF)
+        self.pc[i] += 1
+        return OP_CYCLES[0x02 | (p << 4) | (q << 3)]
+
+    def INC_DEC_rr(self, p, delta, i):
+        if p == 3:
+            self.sp[i] = (self.sp[i] + delta) & 0xFFFF
+        else:
+            self.set_pair(i, p << 1, (self.pair(i, p << 1) + delta) & 0xFFFF)
+        self.pc[i] += 1
+        return OP_CYCLES[0x03 | (p << 4)]
+
+    def LD_nn_SP(self, i):
+        nn = self.operand_16(i)
+        sp = self.sp[i]
+        self.write(i, nn, sp & 0xFF)
+        self.write(i, nn + 1, sp >> 8)
+        self.pc[i] += 3
+        return OP_CYCLES[0x08]
+
+    def LDH_n_A(self, i):
+        self.write(i, 0xFF00 + self.operand_8(i), self.reg(i, REG_A))
+        self.pc[i] += 2
+        return OP_CYCLES[0xE0]
+
+    def LDH_A_n(self, i):
+        self.regs[i, REG_A] = self.read(i, 0xFF00 + self.operand_8(i))
+        self.pc[i] += 2
+        return OP_CYCLES[0xF0]
+
+    def LD_C_A(self, i):
+        self.write(i, 0xFF00 + self.reg(i, REG_B + 1), self.reg(i, REG_A))
+        self.pc[i] += 1
+        return OP_CYCLES[0xE2]
+
+    def LD_A_C(self, i):
+        self.regs[i, REG_A] = self.read(i, 0xFF00 + self.reg(i, REG_B + 1))
+        self.pc[i] += 1
+        return OP_CYCLES[0xF2]
+
+    def LD_nn_A(self, i):
+        self.write(i, self.operand_16(i), self.reg(i, REG_A))
+        self.pc[i] += 3
+        return OP_CYCLES[0xEA]
+
+    def LD_A_nn(self, i):
+        self.regs[i, REG_A] = self.read(i, self.operand_16(i))
+        self.pc[i] += 3
+        return OP_CYCLES[0xFA]
+
+    def ADD_SP_n(self, i):
+        # Reads a 16-bit operand, as CPU
+        result, f = add_16(self.sp[i], self.operand_16(i), self.reg(i, REG_F))
+        self.sp[i] = result
+        self.regs[i, REG_F] = f & 0x7F
+        self.pc[i] += 3
+        return OP_CYCLES[0xE8]
+
+    def LD_HL_SP_n(self, i):
+        result, f = add_16(self.operand_8(i), self.sp[i], self.reg(i, REG_F))
+        self.set_pair(i, REG_H, result)
+        self.regs[i, REG_F] = f
+        self.pc[i] += 2
+        return OP_CYCLES[0xF8]
+
+    def LD_SP_HL(self, i):
+        self.sp[i] = self.pair(i, REG_H)
+        self.pc[i] += 1
+        return OP_CYCLES[0xF9]
+
+    def POP(self, p, i):
+        val = self.pop(i)
+        self.set_pair(i, REG_A if p == 3 else p << 1, val)
+        self.pc[i] += 1
+        return OP_CYCLES[0xC1 | (p << 4)]
+
+    def PUSH(self, p, i):
+        self.push(i, self.pair(i, REG_A if p == 3 else p << 1))
+        self.pc[i] += 1
+        return OP_CYCLES[0xC5 | (p << 4)]
+
+    def JR(self, cc, op, i):
+        # Relative to the offset byte, unsigned
+        if cc is None:
+            self.pc[i] += 1 + self.operand_8(i)
+            return JR_TAKEN
+        taken = condition(cc, self.reg(i, REG_F))
+        jumps = i[taken]
+        self.pc[jumps] += 1 + self.operand_8(jumps)
+        self.pc[i[~taken]] += 2
+        return np.where(taken, JR_TAKEN, OP_CYCLES[op])
+
+    def JP(self, cc, op, i):
+        if cc is None:
+            self.pc[i] = self.operand_16(i)
+            return OP_CYCLES[op]
+        taken = condition(cc, self.reg(i, REG_F))
+        jumps = i[taken]
+        self.pc[jumps] = self.operand_16(jumps)
+        self.pc[i[~taken]] += 3
+        return np.where(taken, JP_TAKEN, OP_CYCLES[op])
+
+    def JP_HL(self, i):
+        self.pc[i] = self.pair(i, REG_H)
+        return OP_CYCLES[0xE9]
+
+    def CALL(self, cc, op, i):
+        # Pushes the address after the operand
+        if cc is None:
+            taken = None
+            calls = i
+        else:
+            taken = condition(cc, self.reg(i, REG_F))
+            calls = i[taken]
+            self.pc[i[~taken]] += 3
+        nn = self.operand_16(calls)
+        self.push(calls, self.pc[calls] + 3)
+        self.pc[calls] = nn
+        return CALL_TAKEN if taken is None else np.where(taken, CALL_TAKEN, OP_CYCLES[op])
+
+    def RET(self, cc, op, i):
+        if cc is None:
+            self.pc[i] = self.pop(i)
+            return OP_CYCLES[op]
+        taken = condition(cc, self.reg(i, REG_F))
+        returns = i[taken]
+        self.pc[returns] = self.pop(returns)
+        self.pc[i[~taken]] += 1
+        return np.where(taken, RET_TAKEN, OP_CYCLES[op])
+
+    def RETI(self, i):
+        self.interrupt_master_enable[i] = True
+        return self.RET(None, 0xD9, i)
+
+    def RST(self, n, i):
+        self.push(i, self.pc[i] + 1)
+        self.pc[i] = n
+        return OP_CYCLES[0xC7 | n]
+
+    def CB(self, i):
+        # Dispatches again on the byte after 0xCB
+        self.dispatch(i, self.memory[i, (self.pc[i] + 1) & 0xFFFF], self.cb_ops)
+        self.pc[i] += 2
+        return 0
+
+    def SHIFT(self, y, z, op2, i):
+        result, f = self.shift_8(y, self.get_r(i, z), self.reg(i, REG_F))
+        self.set_r(i, z, result)
+        self.regs[i, REG_F] = f
+        return CB_CYCLES[op2]
+
+    def BIT(self, y, z, op2, i):
+        v = self.get_r(i, z)
+        self.regs[i, REG_F] = (self.reg(i, REG_F) & 0x1F) | ((((v >> y) & 0x01) ^ 0x01) << 7) | 0x20
+        return CB_CYCLES[op2]
+
+    def RES_SET(self, set_bit, y, z, op2, i):
+        # SET also sets H, as in CPU
+        v = self.get_r(i, z)
+        if set_bit:
+            self.set_r(i, z, v | (0x01 << y))
+            self.regs[i, REG_F] |= 0x20
+        else:
+            self.set_r(i, z, v & ((0x01 << y) ^ 0xFF))
+        return CB_CYCLES[op2]
@@ -0,0 +1,3 @@
+# Emulator version.  On-disk caches of generated code are keyed by it, so
+# bump it with any change to what the CPU or translator generate.
+VERSION = '0.2.0'
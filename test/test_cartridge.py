@@ -0,0 +1,214 @@
+import os
+import numpy as np
+import pytest
+from mmu import MMU
+import cartridge
+
+def banked_rom(cart_type, banks, ram_code = 0x00):
+    # Every ROM bank starts with its bank number, low byte then high byte
+    rom_file = np.zeros(banks * 0x4000, dtype=np.uint8)
+    for bank in range(banks):
+        rom_file[bank * 0x4000] = bank & 0xFF
+        rom_file[bank * 0x4000 + 1] = bank >> 8
+    rom_file[cartridge.HEADER_TYPE] = cart_type
+    rom_file[cartridge.HEADER_RAM_SIZE] = ram_code
+    return rom_file
+
+def rom_bank(mmu, base = 0x4000):
+    return mmu.get(base) | (mmu.get(base + 1) << 8)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_cartridge_types():
+    assert type(MMU(banked_rom(0x00, 2)).cartridge) is cartridge.Cartridge
+    assert type(MMU(banked_rom(0x03, 4)).cartridge) is cartridge.MBC1
+    assert type(MMU(banked_rom(0x10, 4)).cartridge) is cartridge.MBC3
+    assert type(MMU(banked_rom(0x1B, 4)).cartridge) is cartridge.MBC5
+    assert MMU(banked_rom(0x03, 4)).cartridge.battery
+    assert not MMU(banked_rom(0x01, 4)).cartridge.battery
+
+    with pytest.raises(NotImplementedError):
+        MMU(banked_rom(0xFC, 2))
+
+def test_rom_only():
+    mmu = MMU(banked_rom(0x00, 2))
+    # Control writes are ignored
+    mmu.set(0x2000, 0x01)
+    assert rom_bank(mmu, 0x0000) == 0
+    assert rom_bank(mmu) == 1
+
+def test_mbc1_rom_banks():
+    mmu = MMU(banked_rom(0x01, 128))
+    assert rom_bank(mmu) == 1
+
+    mmu.set(0x2000, 0x05)
+    assert rom_bank(mmu) == 5
+    assert rom_bank(mmu, 0x0000) == 0
+
+    # Bank 0 in the low bits selects bank 1, including for 0x20/0x40/0x60
+    mmu.set(0x2000, 0x00)
+    assert rom_bank(mmu) == 1
+    mmu.set(0x4000, 0x01)
+    assert rom_bank(mmu) == 0x21
+
+    # Mode 1 also maps the upper bits into 0x0000-0x3FFF
+    mmu.set(0x6000, 0x01)
+    assert rom_bank(mmu, 0x0000) == 0x20
+    mmu.set(0x6000, 0x00)
+    assert rom_bank(mmu, 0x0000) == 0
+
+    # Bank numbers wrap at the ROM size
+    mmu = MMU(banked_rom(0x01, 4))
+    mmu.set(0x2000, 0x06)
+    assert rom_bank(mmu) == 2
+
+def test_mbc1_ram():
+    mmu = MMU(banked_rom(0x03, 4, ram_code=0x03))
+
+    # RAM is disabled until 0x0A is written to 0x0000-0x1FFF
+    mmu.set(0xA000, 0x12)
+    assert mmu.get(0xA000) == 0xFF
+
+    mmu.set(0x0000, 0x0A)
+    mmu.set(0x6000, 0x01)
+    for bank in range(4):
+        mmu.set(0x4000, bank)
+        mmu.set(0xA000, 0x10 + bank)
+    for bank in range(4):
+        mmu.set(0x4000, bank)
+        assert mmu.get(0xA000) == 0x10 + bank
+    assert list(mmu.EXT_RAM[0::0x2000]) == [0x10, 0x11, 0x12, 0x13]
+
+    mmu.set(0x0000, 0x00)
+    assert mmu.get(0xA000) == 0xFF
+
+def test_mbc3_rom_and_ram_banks():
+    mmu = MMU(banked_rom(0x13, 128, ram_code=0x03))
+    mmu.set(0x2000, 0x7F)
+    assert rom_bank(mmu) == 0x7F
+    mmu.set(0x2000, 0x00)
+    assert rom_bank(mmu) == 1
+
+    mmu.set(0x0000, 0x0A)
+    mmu.set(0x4000, 0x02)
+    mmu.set(0xBFFF, 0x34)
+    assert mmu.EXT_RAM[0x2 * 0x2000 + 0x1FFF] == 0x34
+
+def test_mbc3_rtc():
+    clock = FakeClock()
+    mmu = MMU(banked_rom(0x10, 4, ram_code=0x03))
+    mmu.cartridge = cartridge.MBC3(mmu.ROM, battery=True, timer=True, clock=clock)
+    mmu.map_cartridge()
+
+    mmu.set(0x0000, 0x0A)
+    clock.now += 2 * 86400 + 3 * 3600 + 4 * 60 + 5
+
+    # Registers only change on a latch
+    mmu.set(0x4000, cartridge.RTC_S)
+    assert mmu.get(0xA000) == 0
+    mmu.set(0x6000, 0x00)
+    mmu.set(0x6000, 0x01)
+
+    for register, val in ((cartridge.RTC_S, 5), (cartridge.RTC_M, 4), (cartridge.RTC_H, 3),
+                          (cartridge.RTC_DL, 2), (cartridge.RTC_DH, 0)):
+        mmu.set(0x4000, register)
+        assert mmu.get(0xA000) == val
+
+    # Halting stops the clock
+    mmu.set(0x4000, cartridge.RTC_DH)
+    mmu.set(0xA000, 0x40)
+    clock.now += 100
+    mmu.set(0x6000, 0x00)
+    mmu.set(0x6000, 0x01)
+    mmu.set(0x4000, cartridge.RTC_S)
+    assert mmu.get(0xA000) == 5
+
+    # Selecting a RAM bank maps RAM back in
+    mmu.set(0x4000, 0x00)
+    mmu.set(0xA000, 0x56)
+    assert mmu.cartridge.RAM[0] == 0x56
+
+def test_mbc5_rom_banks():
+    mmu = MMU(banked_rom(0x19, 512))
+
+    # Bank 0 can be mapped into the switchable area
+    mmu.set(0x2000, 0x00)
+    assert rom_bank(mmu) == 0
+
+    mmu.set(0x2000, 0xFF)
+    mmu.set(0x3000, 0x01)
+    assert rom_bank(mmu) == 0x1FF
+
+def test_bank_switch_is_zero_copy():
+    rom_file = banked_rom(0x19, 8)
+    mmu = MMU(rom_file)
+
+    mmu.set(0x2000, 0x03)
+    page = mmu.read_pages[0x40]
+    mmu.set(0x2000, 0x04)
+    mmu.set(0x2000, 0x03)
+    # The same cached view is swapped back in, and it aliases the ROM
+    assert mmu.read_pages[0x40] is page
+    rom_file[3 * 0x4000 + 0x10] = 0x99
+    assert mmu.get(0x4010) == 0x99
+
+def test_load_rom(tmp_path):
+    path = str(tmp_path / 'banked.gb')
+    banked_rom(0x19, 8).tofile(path)
+
+    rom_file = cartridge.load_rom(path)
+    mmu = MMU(rom_file)
+    assert mmu.ROM[cartridge.HEADER_TYPE] == 0x19
+    assert rom_bank(mmu) == 1
+    mmu.set(0x2000, 0x07)
+    assert rom_bank(mmu) == 7
+
+    # The mapping is read-only
+    with pytest.raises(TypeError):
+        rom_file[0] = 0x00
+
+def test_battery_ram_save_file(tmp_path):
+    path = str(tmp_path / 'game.sav')
+    rom_file = banked_rom(0x03, 4, ram_code=0x03)
+
+    mmu = MMU(rom_file, save_path=path)
+    assert os.path.getsize(path) == 0x8000
+
+    mmu.set(0x0000, 0x0A)
+    mmu.set(0x6000, 0x01)
+    mmu.set(0x4000, 0x03)
+    mmu.set(0xA123, 0x42)
+
+    # Writes reach the file without an explicit save
+    with open(path, 'rb') as fh:
+        assert fh.read()[0x6123] == 0x42
+
+    mmu = MMU(rom_file, save_path=path)
+    mmu.set(0x0000, 0x0A)
+    mmu.set(0x6000, 0x01)
+    mmu.set(0x4000, 0x03)
+    assert mmu.get(0xA123) == 0x42
+
+def test_no_save_file_without_battery(tmp_path):
+    path = str(tmp_path / 'game.sav')
+    mmu = MMU(banked_rom(0x02, 4, ram_code=0x03), save_path=path)
+    mmu.set(0x0000, 0x0A)
+    mmu.set(0xA000, 0x42)
+    assert not os.path.exists(path)
+
+def test_small_ram_is_mirrored(tmp_path):
+    path = str(tmp_path / 'game.sav')
+    mmu = MMU(banked_rom(0x09, 2, ram_code=0x01), save_path=path)
+    assert os.path.getsize(path) == 0x800
+
+    mmu.set(0xA010, 0x42)
+    assert mmu.get(0xA810) == 0x42
+    assert mmu.get(0xB810) == 0x42
+
+def test_save_path_for():
+    assert cartridge.save_path_for(os.path.join('roms', 'game.gb')) == os.path.join('roms', 'game.sav')
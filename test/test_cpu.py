@@ -1,6 +1,17 @@
 import numpy as np
+import pytest
 from mmu import MMU
-from cpu import CPU
+from cpu import CPU, FUSIONS, STOP_CYCLES, STOP_BREAKPOINT, STOP_INTERRUPT, STOP_PREDICATE
+import numba_cpu
+from numba_cpu import BACKENDS
+
+# Every test runs once per CPU backend, through this module's CPU name.
+# Without numba the numba backend's core runs as plain Python.
+@pytest.fixture(autouse=True, params=sorted(BACKENDS))
+def backend(request, monkeypatch):
+    monkeypatch.setitem(globals(), 'CPU', BACKENDS[request.param])
+    monkeypatch.setattr(numba_cpu, 'INTERPRETED_CORE', True)
+    return request.param
 
 def test_registers():
     cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
@@ -34,8 +45,9 @@ def test_flags():
         cpu.set_flag(flag, 0)
         assert cpu.get_flag(flag) == 0
 
-def test_add_8():
-    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_add_8(lazy_flags):
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), lazy_flags=lazy_flags)
     assert cpu.add_8(0x11, 0x22) == 0x33
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 0
@@ -49,8 +61,9 @@ def test_add_8():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_add_16():
-    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_add_16(lazy_flags):
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), lazy_flags=lazy_flags)
     assert cpu.add_16(0x1111, 0x2222) == 0x3333
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 0
@@ -64,8 +77,9 @@ def test_add_16():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_sub_8():
-    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_sub_8(lazy_flags):
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), lazy_flags=lazy_flags)
     assert cpu.sub_8(0x33, 0x22) == 0x11
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 0
@@ -79,8 +93,9 @@ def test_sub_8():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_sub_16():
-    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_sub_16(lazy_flags):
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), lazy_flags=lazy_flags)
     assert cpu.sub_16(0x3333, 0x2222) == 0x1111
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 0
@@ -94,6 +109,25 @@ def test_sub_16():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
+def test_lazy_flags_differential():
+    eager = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+    lazy = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), lazy_flags=True)
+
+    values_8 = range(0x100)
+    values_16 = [0x0000, 0x0001, 0x0FFF, 0x1000, 0x7FFF, 0x8000, 0xF000, 0xFFFF]
+
+    for helper, values in (('add_8', values_8), ('sub_8', values_8),
+                           ('add_16', values_16), ('sub_16', values_16)):
+        for val1 in values:
+            for val2 in values:
+                for use_carry in (False, True):
+                    # Low nibble of F must survive untouched as well
+                    eager.set_reg_8('F', 0x05)
+                    lazy.set_reg_8('F', 0x05)
+                    assert getattr(eager, helper)(val1, val2, use_carry) == \
+                           getattr(lazy, helper)(val1, val2, use_carry)
+                    assert eager.get_reg_8('F') == lazy.get_reg_8('F')
+
 ### Test opcodes
 
 # 8-bit loads
@@ -427,12 +461,13 @@ def test_LD_SP_HL():
     cpu.tick()
     assert cpu.get_reg_16('SP') == 0x1234
 
-def test_LD_HL_SPn():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_LD_HL_SPn(lazy_flags):
     # Test no carry
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xF8
     rom_file[0x0101] = 0x12
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0x1234)
     cpu.tick()
     assert cpu.get_reg_16('HL') == 0x1246
@@ -445,7 +480,7 @@ def test_LD_HL_SPn():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xF8
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0x0FFF)
     cpu.tick()
     assert cpu.get_reg_16('HL') == 0x1000
@@ -458,7 +493,7 @@ def test_LD_HL_SPn():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xF8
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0xFFFF)
     cpu.tick()
     assert cpu.get_reg_16('HL') == 0x0000
@@ -478,7 +513,8 @@ def test_LD_nn_SP():
     assert cpu.mmu.get(0xC002) == 0xBB
     assert cpu.mmu.get(0xC003) == 0xAA
 
-def test_PUSH_nn():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_PUSH_nn(lazy_flags):
     ops = {
         0xF5: 'AF',
         0xC5: 'BC',
@@ -488,7 +524,7 @@ def test_PUSH_nn():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_16(reg, 0xAABB)
         cpu.set_reg_16('SP', 0xC002)
         cpu.tick()
@@ -496,7 +532,8 @@ def test_PUSH_nn():
         assert cpu.mmu.get(0xC000) == 0xBB
         assert cpu.get_reg_16('SP') == 0xC000
 
-def test_POP_nn():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_POP_nn(lazy_flags):
     ops = {
         0xF1: 'AF',
         0xC1: 'BC',
@@ -508,7 +545,7 @@ def test_POP_nn():
         rom_file[0x0100] = op
         rom_file[0x00F0] = 0xBB
         rom_file[0x00F1] = 0xAA
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_16('SP', 0x00F0)
         cpu.tick()
         assert cpu.get_reg_16(reg) == 0xAABB
@@ -516,11 +553,12 @@ def test_POP_nn():
 
 # 8-bit ALU
 
-def test_ADD_A_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_ADD_A_n(lazy_flags):
     # Add A to itself
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x87
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x22
@@ -541,7 +579,7 @@ def test_ADD_A_n():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x11)
         cpu.set_reg_8(reg, 0x22)
         cpu.tick()
@@ -555,7 +593,7 @@ def test_ADD_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x86
     rom_file[0x0123] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_reg_16('HL', 0x0123)
     cpu.tick()
@@ -569,7 +607,7 @@ def test_ADD_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xC6
     rom_file[0x0101] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x33
@@ -582,7 +620,7 @@ def test_ADD_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xC6
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x0F)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x10
@@ -595,7 +633,7 @@ def test_ADD_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xC6
     rom_file[0x0101] = 0x10
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0xF0)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x00
@@ -604,11 +642,12 @@ def test_ADD_A_n():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_ADC_A_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_ADC_A_n(lazy_flags):
     # Add A to itself
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x8F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -630,7 +669,7 @@ def test_ADC_A_n():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x11)
         cpu.set_flag('C', 1)
         cpu.set_reg_8(reg, 0x22)
@@ -645,7 +684,7 @@ def test_ADC_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x8E
     rom_file[0x0123] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('C', 1)
     cpu.set_reg_16('HL', 0x0123)
@@ -660,7 +699,7 @@ def test_ADC_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xCE
     rom_file[0x0101] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -674,7 +713,7 @@ def test_ADC_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xCE
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x0E)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -688,7 +727,7 @@ def test_ADC_A_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xCE
     rom_file[0x0101] = 0x0F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0xF0)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -698,11 +737,12 @@ def test_ADC_A_n():
     assert cpu.get_flag('H') == 1
     assert cpu.get_flag('C') == 1
 
-def test_SUB_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_SUB_n(lazy_flags):
     # Sub A from itself
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x97
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x00
@@ -723,7 +763,7 @@ def test_SUB_n():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x33)
         cpu.set_reg_8(reg, 0x22)
         cpu.tick()
@@ -737,7 +777,7 @@ def test_SUB_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x96
     rom_file[0x0123] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x33)
     cpu.set_reg_16('HL', 0x0123)
     cpu.tick()
@@ -751,7 +791,7 @@ def test_SUB_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xD6
     rom_file[0x0101] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x33)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x11
@@ -764,7 +804,7 @@ def test_SUB_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xD6
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0x0F
@@ -777,7 +817,7 @@ def test_SUB_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xD6
     rom_file[0x0101] = 0x10
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x00)
     cpu.tick()
     assert cpu.get_reg_8('A') == 0xF0
@@ -786,11 +826,12 @@ def test_SUB_n():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_SBC_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_SBC_n(lazy_flags):
     # Sub A from itself
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x9F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -812,7 +853,7 @@ def test_SBC_n():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x33)
         cpu.set_reg_8(reg, 0x22)
         cpu.set_flag('C', 1)
@@ -827,7 +868,7 @@ def test_SBC_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x9E
     rom_file[0x0123] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x33)
     cpu.set_reg_16('HL', 0x0123)
     cpu.set_flag('C', 1)
@@ -842,7 +883,7 @@ def test_SBC_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xDE
     rom_file[0x0101] = 0x22
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x33)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -856,7 +897,7 @@ def test_SBC_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xDE
     rom_file[0x0101] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -870,7 +911,7 @@ def test_SBC_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xDE
     rom_file[0x0101] = 0x0F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x00)
     cpu.set_flag('C', 1)
     cpu.tick()
@@ -1092,11 +1133,12 @@ def test_XOR_n():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 0
 
-def test_CP_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_CP_n(lazy_flags):
     # A
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xBF
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.tick()
     assert cpu.get_flag('Z') == 1
@@ -1116,7 +1158,7 @@ def test_CP_n():
     for op, reg in ops.items():
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x10)
         cpu.set_reg_8(reg, 0x10)
         cpu.tick()
@@ -1127,7 +1169,7 @@ def test_CP_n():
 
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x10)
         cpu.set_reg_8(reg, 0x0F)
         cpu.tick()
@@ -1138,7 +1180,7 @@ def test_CP_n():
 
         rom_file = np.zeros(0x8000, dtype=np.uint8)
         rom_file[0x0100] = op
-        cpu = CPU(MMU(rom_file))
+        cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
         cpu.set_reg_8('A', 0x10)
         cpu.set_reg_8(reg, 0x11)
         cpu.tick()
@@ -1151,7 +1193,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xBE
     rom_file[0x0123] = 0x10
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.set_reg_16('HL', 0x0123)
     cpu.tick()
@@ -1163,7 +1205,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xBE
     rom_file[0x0123] = 0x0F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.set_reg_16('HL', 0x0123)
     cpu.tick()
@@ -1175,7 +1217,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xBE
     rom_file[0x0123] = 0x11
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.set_reg_16('HL', 0x0123)
     cpu.tick()
@@ -1188,7 +1230,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xFE
     rom_file[0x0101] = 0x10
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.tick()
     assert cpu.get_flag('Z') == 1
@@ -1199,7 +1241,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xFE
     rom_file[0x0101] = 0x0F
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.tick()
     assert cpu.get_flag('Z') == 0
@@ -1210,7 +1252,7 @@ def test_CP_n():
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xFE
     rom_file[0x0101] = 0x11
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.tick()
     assert cpu.get_flag('Z') == 0
@@ -1389,11 +1431,12 @@ def test_DEC_n():
 
 # 16-bit ALU
 
-def test_ADD_HL_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_ADD_HL_n(lazy_flags):
     # Test each source register
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x09
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0x1122)
     cpu.set_reg_16('BC', 0x3344)
     cpu.tick()
@@ -1404,7 +1447,7 @@ def test_ADD_HL_n():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x19
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0x1122)
     cpu.set_reg_16('DE', 0x3344)
     cpu.tick()
@@ -1415,7 +1458,7 @@ def test_ADD_HL_n():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x29
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0x1122)
     cpu.tick()
     assert cpu.get_reg_16('HL') == 0x2244
@@ -1425,7 +1468,7 @@ def test_ADD_HL_n():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x39
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0x1122)
     cpu.set_reg_16('SP', 0x3344)
     cpu.tick()
@@ -1437,7 +1480,7 @@ def test_ADD_HL_n():
     #Test half-carry
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x09
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0x0F00)
     cpu.set_reg_16('BC', 0x0100)
     cpu.tick()
@@ -1449,7 +1492,7 @@ def test_ADD_HL_n():
     #Test full-carry
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x09
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('HL', 0xF000)
     cpu.set_reg_16('BC', 0x1000)
     cpu.tick()
@@ -1458,12 +1501,13 @@ def test_ADD_HL_n():
     assert cpu.get_flag('H') == 0
     assert cpu.get_flag('C') == 1
 
-def test_ADD_SP_n():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_ADD_SP_n(lazy_flags):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0xE8
     rom_file[0x0101] = 0x44
     rom_file[0x0102] = 0x33
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0x1122)
     cpu.tick()
     assert cpu.get_reg_16('SP') == 0x4466
@@ -1477,7 +1521,7 @@ def test_ADD_SP_n():
     rom_file[0x0100] = 0xE8
     rom_file[0x0101] = 0x00
     rom_file[0x0102] = 0x01
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0x0F00)
     cpu.tick()
     assert cpu.get_reg_16('SP') == 0x1000
@@ -1491,7 +1535,7 @@ def test_ADD_SP_n():
     rom_file[0x0100] = 0xE8
     rom_file[0x0101] = 0x00
     rom_file[0x0102] = 0x10
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_16('SP', 0xF000)
     cpu.tick()
     assert cpu.get_reg_16('SP') == 0x0000
@@ -1563,12 +1607,13 @@ def test_SWAP_n():
     cpu.tick()
     assert cpu.mmu.get(0xC001) == 0xBA
 
-def test_DAA():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_DAA(lazy_flags):
     # Set/reset N flag to test post add/subtract DAA respectively
     # Addition
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x0C)
     cpu.set_flag('N', 0)
     cpu.tick()
@@ -1579,7 +1624,7 @@ def test_DAA():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0xC0)
     cpu.set_flag('N', 0)
     cpu.tick()
@@ -1590,7 +1635,7 @@ def test_DAA():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x10)
     cpu.set_flag('N', 0)
     cpu.set_flag('C', 1)
@@ -1602,7 +1647,7 @@ def test_DAA():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x11)
     cpu.set_flag('N', 0)
     cpu.set_flag('H', 1)
@@ -1615,7 +1660,7 @@ def test_DAA():
     # Subtraction
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0xE0)
     cpu.set_flag('N', 1)
     cpu.set_flag('C', 1)
@@ -1627,7 +1672,7 @@ def test_DAA():
 
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x0E)
     cpu.set_flag('N', 1)
     cpu.set_flag('H', 1)
@@ -1640,7 +1685,7 @@ def test_DAA():
     # Test zero
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x27
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
     cpu.set_reg_8('A', 0x00)
     cpu.set_flag('N', 0)
     cpu.tick()
@@ -1658,7 +1703,7 @@ def test_DAA():
     rom_file[0x0103] = 0x80
     rom_file[0x0104] = 0x27 # DAA
 
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
 
     # Tick 3 times
     cpu.tick()
@@ -3245,7 +3290,8 @@ def test_RETI():
     assert cpu.pc == 0x1234
     assert cpu.interrupt_master_enable == True
 
-def test_fibonacci():
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_fibonacci(lazy_flags):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0100] = 0x16 # LD D=13  - Set counter to 13 loops
     rom_file[0x0101] = 0x0D
@@ -3263,13 +3309,168 @@ def test_fibonacci():
     rom_file[0x010D] = 0x01
     rom_file[0x010E] = 0x76 #          - ..else, halt
 
-    cpu = CPU(MMU(rom_file))
+    cpu = CPU(MMU(rom_file), lazy_flags=lazy_flags)
 
     while cpu.pc != 0x010E:
         cpu.tick()
 
     assert cpu.get_reg_8('B') == 233    # F13 = 233
 
+def fibonacci_rom():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x010F] = [0x16, 0x0D, 0x06, 0x00, 0x0E, 0x01, 0x78, 0x81,
+                               0x48, 0x47, 0x15, 0xC2, 0x06, 0x01, 0x76]
+    return rom_file
+
+def test_run_cycles():
+    # All NOPs, 4 cycles each
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+    assert cpu.run_cycles(40) == (40, STOP_CYCLES)
+    assert cpu.pc == 0x010A
+
+    # The budget is a minimum: the last instruction runs to completion
+    assert cpu.run_cycles(42) == (44, STOP_CYCLES)
+    assert cpu.pc == 0x0115
+    assert cpu.cycles == 84
+
+def test_run_matches_tick():
+    ticked = CPU(MMU(fibonacci_rom()))
+    while ticked.pc != 0x010E:
+        ticked.tick()
+
+    batched = CPU(MMU(fibonacci_rom()))
+    batched.breakpoints.add(0x010E)
+    assert batched.run_cycles(100000) == (ticked.cycles, STOP_BREAKPOINT)
+
+    assert batched.regs == ticked.regs
+    assert batched.pc == ticked.pc
+    assert batched.cycles == ticked.cycles
+
+def test_run_breakpoint_resumes():
+    # Stops with PC at the loop head each time round, and resumes from there
+    cpu = CPU(MMU(fibonacci_rom()))
+    cpu.breakpoints.add(0x0106)
+    assert cpu.run_cycles(1000) == (24, STOP_BREAKPOINT)
+    assert cpu.pc == 0x0106
+
+    # LD, ADD, LD, LD, DEC, taken JP NZ
+    assert cpu.run_cycles(1000) == (36, STOP_BREAKPOINT)
+    assert cpu.get_reg_8('D') == 12
+
+def test_run_until():
+    cpu = CPU(MMU(fibonacci_rom()))
+    assert cpu.run_until(lambda cpu: cpu.get_reg_8('D') == 10) == (24 + 3 * 36 - 16, STOP_PREDICATE)
+
+    # max_cycles still applies
+    spent, reason = cpu.run_until(lambda cpu: False, max_cycles=100)
+    assert reason == STOP_CYCLES
+    assert 100 <= spent < 120
+
+def test_run_stops_on_interrupt():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0102] = 0xFB     # EI
+    cpu = CPU(MMU(rom_file))
+    cpu.mmu.set(0xFF0F, 0x04)
+    cpu.mmu.set(0xFFFF, 0x04)
+
+    assert cpu.run_cycles(1000) == (4 + 4 + 4 + 20, STOP_INTERRUPT)
+    assert cpu.pc == 0x0050
+    assert cpu.pop_stack() == 0x0103
+
+def test_HALT_waits_for_interrupt():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100] = 0x76     # HALT
+    cpu = CPU(MMU(rom_file))
+    cpu.interrupt_master_enable = True
+    cpu.mmu.set(0xFFFF, 0x04)
+
+    cpu.tick()
+    for _ in range(10):
+        assert cpu.tick() == 4
+    assert cpu.halted
+    assert cpu.pc == 0x0101
+    assert cpu.idle_cycles == 40
+
+    # Woken and dispatched, returning after the HALT
+    cpu.mmu.set(0xFF0F, 0x04)
+    assert cpu.tick() == 4 + 20
+    assert not cpu.halted
+    assert cpu.pc == 0x0050
+    assert cpu.pop_stack() == 0x0101
+
+def test_HALT_without_IME_resumes():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100] = 0x76     # HALT
+    rom_file[0x0101] = 0x3C     # INC A
+    cpu = CPU(MMU(rom_file))
+    cpu.mmu.set(0xFFFF, 0x01)
+
+    cpu.tick()
+    cpu.tick()
+    assert cpu.halted
+
+    # Carries on with the next instruction, the interrupt stays pending
+    cpu.mmu.set(0xFF0F, 0x01)
+    cpu.tick()
+    cpu.tick()
+    assert cpu.get_reg_8('A') == 1
+    assert cpu.pc == 0x0102
+    assert cpu.mmu.get(0xFF0F) == 0x01
+
+def test_HALT_bug():
+    # With an interrupt pending and IME clear, the byte after HALT is read
+    # twice: INC A runs twice
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0102] = [0x76, 0x3C]
+    cpu = CPU(MMU(rom_file))
+    cpu.mmu.set(0xFFFF, 0x01)
+    cpu.mmu.set(0xFF0F, 0x01)
+
+    assert cpu.tick() == 8
+    assert not cpu.halted
+    cpu.tick()
+    assert cpu.get_reg_8('A') == 2
+    assert cpu.pc == 0x0102
+
+    # LD A, n takes its own opcode as the operand, then runs n as an opcode
+    rom_file[0x0100:0x0103] = [0x76, 0x3E, 0x14]    # HALT; LD A, 0x14 -> INC D
+    cpu = CPU(MMU(rom_file))
+    cpu.mmu.set(0xFFFF, 0x01)
+    cpu.mmu.set(0xFF0F, 0x01)
+    cpu.tick()
+    cpu.tick()
+    assert cpu.get_reg_8('A') == 0x3E
+    assert cpu.get_reg_8('D') == 1
+    assert cpu.pc == 0x0103
+
+def test_HALT_skips_to_end_of_batch():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100] = 0x76     # HALT
+    cpu = CPU(MMU(rom_file))
+
+    assert cpu.run_cycles(10002) == (10004, STOP_CYCLES)
+    assert cpu.idle_cycles == 10000
+
+    cpu.mmu.set(0xFFFF, 0x01)
+    cpu.mmu.set(0xFF0F, 0x01)
+    assert cpu.run_cycles(10000) == (4, STOP_INTERRUPT)
+    assert cpu.pc == 0x0101
+
+def test_STOP_waits_for_joypad():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0102] = [0x10, 0x00]
+    cpu = CPU(MMU(rom_file))
+    cpu.mmu.set(0xFFFF, 0x1F)
+    cpu.tick()
+    assert cpu.pc == 0x0102
+
+    cpu.mmu.set(0xFF0F, 0x01)
+    cpu.tick()
+    assert cpu.halted
+    cpu.mmu.set(0xFF0F, 0x10)
+    cpu.tick()
+    assert not cpu.halted
+
 def test_interrupts():
     #V-Blank
     rom_file = np.zeros(0x8000, dtype=np.uint8)
@@ -3391,3 +3592,60 @@ def test_interrupts():
     cpu.tick()
     assert cpu.pc == 0x0060
     assert cpu.pop_stack() == 0x0105
+
+# Operands for the instructions of the fused pairs
+FUSION_OPERANDS = {0xF0: [0x80], 0xFE: [0x42], 0xE6: [0x0F], 0x20: [0x05], 0x28: [0x05],
+                   0xC2: [0x00, 0x02], 0xCA: [0x00, 0x02]}
+
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_fusions_match_separate_instructions(lazy_flags):
+    # Each superinstruction against its two instructions ticked one at a
+    # time, with branches both taken (DEC to 0, CP equal) and not
+    for first, second in FUSIONS:
+        rom_file = np.zeros(0x8000, dtype=np.uint8)
+        code = [first] + FUSION_OPERANDS.get(first, []) + [second] + FUSION_OPERANDS.get(second, [])
+        rom_file[0x0100:0x0100 + len(code)] = code
+
+        for a, val in ((0x42, 0x01), (0x01, 0x02)):
+            separate = CPU(MMU(rom_file), lazy_flags=lazy_flags)
+            fused = CPU(MMU(rom_file), lazy_flags=lazy_flags, fusions=[(first, second)])
+            for cpu in (separate, fused):
+                cpu.regs[:] = bytes([val, val, 0xC1, 0x00, 0xC0, 0x00, a, 0x00])
+                cpu.mmu.set(0xC000, 0x42)
+                cpu.mmu.set(0xFF80, a)
+            separate.tick()
+            separate.tick()
+            fused.tick()
+
+            # With lazy flags the branch may leave F pending instead
+            assert fused.get_reg_8('F') == separate.get_reg_8('F')
+            assert fused.regs == separate.regs, (hex(first), hex(second))
+            assert fused.pc == separate.pc
+            assert fused.cycles == separate.cycles
+            assert fused.mmu.get(0xC100) == separate.mmu.get(0xC100)
+
+def test_fusion_needs_both_opcodes():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0103] = [0x05, 0x05, 0x20]    # DEC B / DEC B / JR NZ
+    cpu = CPU(MMU(rom_file), fusions=True)
+    assert cpu.tick() == 4
+    assert cpu.pc == 0x0101
+    assert cpu.tick() == 16
+    assert cpu.pc == 0x0103
+
+    with pytest.raises(ValueError):
+        CPU(MMU(rom_file), fusions=[(0x00, 0x00)])
+
+def test_fusion_split_at_breakpoint():
+    # DEC B / JP NZ is a pair, but the breakpoint on the JP still stops it
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0106] = [0x06, 0x03,              # LD B, 3
+                               0x05,                    # DEC B      <-- 0x0102
+                               0xC2, 0x02, 0x01]        # JP NZ, 0x0102
+    cpu = CPU(MMU(rom_file), fusions=True)
+    cpu.breakpoints.add(0x0103)
+    assert cpu.run_cycles(1000) == (12, STOP_BREAKPOINT)
+    assert cpu.pc == 0x0103
+    assert cpu.run_cycles(1000) == (20, STOP_BREAKPOINT)
+    assert cpu.get_reg_8('B') == 1
+
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from mmu import MMU
+from graphics import NullGraphics, FramebufferGraphics, create_graphics
+
+GB_PARAMS = {
+            'screen_res': (160, 144),
+            'clk_spd_mhz': '4.194'
+            }
+
+def headless_graphics():
+    return NullGraphics(GB_PARAMS)
+
+def reference_test_pattern(mmu):
+    # The original per-pixel implementation
+    pixel_values = np.zeros(shape=(GB_PARAMS['screen_res'][0], GB_PARAMS['screen_res'][1],3), dtype='uint8')
+
+    for x in range(0, GB_PARAMS['screen_res'][0]):
+        for y in range(0, GB_PARAMS['screen_res'][1]):
+            pixel_values[x][y] = [mmu.get((x*160)+y+0x150)&224,
+                                  (mmu.get((x*160)+y+0x150)&28)<<3,
+                                  (mmu.get((x*160)+y+0x150)&3)<<6]
+
+    return pixel_values
+
+def test_test_pattern():
+    rom_file = np.random.default_rng(0).integers(0, 0x100, 0x8000, dtype=np.uint8)
+    rom_file[0x0147:0x014A] = 0x00
+    mmu = MMU(rom_file)
+
+    pattern = headless_graphics().get_test_pattern(mmu)
+    assert pattern.dtype == np.uint8
+    assert pattern.shape == (160, 144, 3)
+    assert pattern.tobytes() == reference_test_pattern(mmu).tobytes()
+
+def test_test_pattern_from_bytes():
+    rom_file = bytes(range(0x100)) * 0x80
+    rom_file = rom_file[:0x0147] + bytes(3) + rom_file[0x014A:]
+    mmu = MMU(rom_file)
+
+    assert headless_graphics().get_test_pattern(mmu).tobytes() == reference_test_pattern(mmu).tobytes()
+
+def test_framebuffer_backend():
+    gfx = create_graphics('numpy', GB_PARAMS)
+    assert isinstance(gfx, FramebufferGraphics)
+
+    pixels = np.random.default_rng(0).integers(0, 0x100, (160, 144, 3), dtype=np.uint8)
+    gfx.draw(pixels)
+    assert (gfx.frame == pixels).all()
+    assert gfx.frames_drawn == 1
+    assert gfx.get_events() is None
+
+def test_headless_backends_skip_pygame():
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    code = ('import sys, graphics\n'
+            'for backend in ("null", "numpy"):\n'
+            '    graphics.create_graphics(backend, {"screen_res": (160, 144)}).draw(None if backend == "null" else 0)\n'
+            'assert "pygame" not in sys.modules\n')
+    subprocess.run([sys.executable, '-c', code], cwd=src, check=True)
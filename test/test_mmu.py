@@ -3,18 +3,20 @@ import pytest
 from mmu import MMU
 from exceptions.memory_access_error import MemoryAccessError
 
-def test_read_range():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_read_range(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
     for i in range(0, 0xFFFF):
         try:
             mmu.get(i)
         except NotImplementedError:
             pass
 
-def test_write_range():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_write_range(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
     for i in range(0, 0xFFFF):
         try:
             mmu.set(i, 0x00)
@@ -22,9 +24,10 @@ def test_write_range():
         except NotImplementedError:
             pass
 
-def test_out_of_range():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_out_of_range(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
     with pytest.raises(MemoryAccessError):
         mmu.get(-1)
     with pytest.raises(MemoryAccessError):
@@ -34,22 +37,24 @@ def test_out_of_range():
     with pytest.raises(MemoryAccessError):
         mmu.set(0x10000, 0)
 
-def test_rom_access():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_rom_access(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
     rom_file[0x0000] = 0x11
     rom_file[0x0100] = 0x66
     rom_file[0x0150] = 0xAA
     rom_file[0x7FFF] = 0xFF
 
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
     assert mmu.get(0x0000) == 0x11
     assert mmu.get(0x0100) == 0x66
     assert mmu.get(0x0150) == 0xAA
     assert mmu.get(0x7FFF) == 0xFF
 
-def test_work_ram():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_work_ram(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0xC000, 0xA0)
     assert mmu.get(0xC000) == 0xA0
@@ -57,9 +62,10 @@ def test_work_ram():
     mmu.set(0xDFFF, 0xA0)
     assert mmu.get(0xDFFF) == 0xA0
 
-def test_external_ram():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_external_ram(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0xA000, 0xA0)
     assert mmu.get(0xA000) == 0xA0
@@ -67,9 +73,10 @@ def test_external_ram():
     mmu.set(0xBFFF, 0xA0)
     assert mmu.get(0xBFFF) == 0xA0
 
-def test_char_ram():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_char_ram(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0x8000, 0xA0)
     assert mmu.get(0x8000) == 0xA0
@@ -77,9 +84,10 @@ def test_char_ram():
     mmu.set(0x97FF, 0xA0)
     assert mmu.get(0x97FF) == 0xA0
 
-def test_bg_map_1():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_bg_map_1(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0x9800, 0xA0)
     assert mmu.get(0x9800) == 0xA0
@@ -87,9 +95,10 @@ def test_bg_map_1():
     mmu.set(0x9BFF, 0xA0)
     assert mmu.get(0x9BFF) == 0xA0
 
-def test_bg_map_2():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_bg_map_2(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0x9C00, 0xA0)
     assert mmu.get(0x9C00) == 0xA0
@@ -97,9 +106,10 @@ def test_bg_map_2():
     mmu.set(0x9FFF, 0xA0)
     assert mmu.get(0x9FFF) == 0xA0
 
-def test_oam():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_oam(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0xFE00, 0xA0)
     assert mmu.get(0xFE00) == 0xA0
@@ -107,9 +117,10 @@ def test_oam():
     mmu.set(0xFE9F, 0xA0)
     assert mmu.get(0xFE9F) == 0xA0
 
-def test_high_ram():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_high_ram(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0xFF80, 0xA0)
     assert mmu.get(0xFF80) == 0xA0
@@ -117,9 +128,35 @@ def test_high_ram():
     mmu.set(0xFFFE, 0xA0)
     assert mmu.get(0xFFFE) == 0xA0
 
-def test_interrupt_register():
+@pytest.mark.parametrize('flat_memory', [False, True])
+def test_interrupt_register(flat_memory):
     rom_file = np.zeros(0x8000, dtype=np.uint8)
-    mmu = MMU(rom_file)
+    mmu = MMU(rom_file, flat_memory=flat_memory)
 
     mmu.set(0xFFFF, 0xA0)
     assert mmu.get(0xFFFF) == 0xA0
+
+def test_flat_memory_aliases():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    mmu = MMU(rom_file, flat_memory=True)
+
+    # Writes through the MMU, the region views and the buffer all land in
+    # the same place
+    mmu.set(0xC010, 0x12)
+    assert mmu.memory[0xC010] == 0x12
+    assert mmu.WORK_RAM[0x10] == 0x12
+
+    mmu.CHAR_RAM[0x20] = 0x34
+    assert mmu.get(0x8020) == 0x34
+    assert mmu.memory[0x8020] == 0x34
+
+    mmu.memory[0xFF85] = 0x56
+    assert mmu.get(0xFF85) == 0x56
+    assert mmu.HIGH_RAM[0x05] == 0x56
+
+    mmu.set(0xFE9F, 0x78)
+    assert mmu.OAM[0x9F] == 0x78
+
+    # Tile data can be sliced out of the buffer in one go
+    mmu.memory[0x8000:0x8010] = bytes(range(0x10))
+    assert list(mmu.CHAR_RAM[0x00:0x10]) == list(range(0x10))
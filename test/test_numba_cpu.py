@@ -0,0 +1,224 @@
+import random
+import numpy as np
+import pytest
+from cpu import CPU
+from exceptions.memory_access_error import MemoryAccessError
+from gameboy import GameBoy
+from mmu import MMU
+import numba_cpu
+from numba_cpu import NumbaCPU, BACKENDS, default_backend, HAVE_NUMBA
+
+# Without numba the core runs as plain Python
+@pytest.fixture(autouse=True)
+def interpreted_core(monkeypatch):
+    monkeypatch.setattr(numba_cpu, 'INTERPRETED_CORE', True)
+
+
+# Opcodes the core leaves to the interpreter: HALT, STOP, DI, EI, RETI and
+# the unused ones
+INTERPRETED = [0x10, 0x76, 0xD9, 0xF3, 0xFB,
+               0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD]
+
+# Places for (HL), (BC), (DE), SP and the operands to point at: work RAM,
+# high RAM, background map and ROM (plain memory), and the I/O registers
+# and character RAM (through the MMU)
+ADDRESSES = [0xC123, 0xC000, 0xDFFF, 0xFF90, 0xFFFE, 0x9900, 0x0150, 0xFF05, 0x8010]
+
+
+def randomise(rng, cpus, operands):
+    # The same random state in an interpreting and a compiled CPU sharing
+    # one ROM, with the operand bytes after the opcode at 0x0100
+    cpus[0].mmu.ROM[0x0101:0x0104] = operands
+    regs = rng.randbytes(8)
+    sp = rng.choice(ADDRESSES[:5])
+    pairs = [rng.choice(ADDRESSES) for _ in range(3)]
+    fill = np.frombuffer(rng.randbytes(0x2000), dtype=np.uint8)
+
+    for cpu in cpus:
+        cpu.regs[:] = regs
+        cpu.set_reg_16('BC', pairs[0])
+        cpu.set_reg_16('DE', pairs[1])
+        cpu.set_reg_16('HL', pairs[2])
+        cpu.sp = sp
+        cpu.pc = 0x0100
+        cpu.cycles = 0
+        cpu.mmu.WORK_RAM[:] = fill
+        cpu.mmu.HIGH_RAM[:] = fill[:127]
+        cpu.mmu.BG_MAP_1[:] = fill[:1024]
+
+
+def assert_same_state(interpreted, compiled, message):
+    assert compiled.regs == interpreted.regs, message
+    assert compiled.pc == interpreted.pc, message
+    assert compiled.sp == interpreted.sp, message
+    assert compiled.cycles == interpreted.cycles, message
+    for region in ('WORK_RAM', 'HIGH_RAM', 'BG_MAP_1', 'CHAR_RAM', 'HW_REGS_TEMP'):
+        assert np.array_equal(getattr(compiled.mmu, region), getattr(interpreted.mmu, region)), \
+            (region, message)
+
+
+def test_instructions_match_interpreter():
+    # Every opcode, CB-prefixed ones included, from random registers and
+    # memory, with operands pointing at plain memory and at the MMU
+    rng = random.Random(24)
+    ops = [(op, None) for op in range(0x100) if op not in INTERPRETED and op != 0xCB] + \
+          [(0xCB, op2) for op2 in range(0x100)]
+    for op, op2 in ops:
+        rom_file = np.zeros(0x8000, dtype=np.uint8)
+        rom_file[0x0100] = op
+        rom_file[0x0150] = 0x5A
+        cpus = [CPU(MMU(rom_file)), NumbaCPU(MMU(rom_file))]
+        for _ in range(8):
+            addr = rng.choice(ADDRESSES)
+            if op2 is not None:
+                operands = [op2, 0, 0]
+            else:
+                operands = [rng.choice([addr & 0xFF, rng.randrange(0x100)]), addr >> 8, 0]
+            randomise(rng, cpus, operands)
+            # Accesses to unmapped memory must fail the same way
+            errors = []
+            for cpu in cpus:
+                try:
+                    cpu.tick()
+                    errors.append(None)
+                except (NotImplementedError, MemoryAccessError) as error:
+                    errors.append(type(error))
+            assert errors[0] == errors[1], (hex(op), op2, operands)
+            if errors[0] is None:
+                assert_same_state(*cpus, (hex(op), op2, operands))
+
+
+def test_core_runs_plain_code():
+    # A loop over work RAM runs without the interpreter
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x010E] = [0x21, 0x00, 0xC0,    # LD HL, 0xC000
+                               0x06, 0x00,          # LD B, 0
+                               0x22,                # LDI (HL), A   <-- loop
+                               0x3C,                # INC A
+                               0x05,                # DEC B
+                               0xC2, 0x05, 0x01,    # JP NZ, loop
+                               0xC3, 0x00, 0x01]    # JP 0x0100
+    interpreted = CPU(MMU(rom_file))
+    compiled = NumbaCPU(MMU(rom_file))
+    for cpu in (interpreted, compiled):
+        cpu.run_cycles(20000)
+
+    assert compiled.core_bails == 0
+    assert compiled.core_cycles == compiled.cycles
+    assert_same_state(interpreted, compiled, 'loop')
+
+
+def test_io_goes_through_the_mmu():
+    # LDH (n), A to a mapped register calls its handler
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0104] = [0x3E, 0x42,          # LD A, 0x42
+                               0xE0, 0x01]          # LDH (0x01), A
+    cpu = NumbaCPU(MMU(rom_file))
+    written = []
+    cpu.mmu.map_io(0xFF01, write=lambda addr, val: written.append((addr, val)))
+    cpu.run_cycles(20)
+
+    assert written == [(0xFF01, 0x42)]
+    assert cpu.core_bails == 1
+
+
+def test_bank_switch():
+    # MBC1: switching banks in the interpreter changes what the core reads
+    rom_file = np.zeros(0x10000, dtype=np.uint8)
+    rom_file[0x0147] = 0x01
+    rom_file[0x0100:0x0108] = [0x3E, 0x02,          # LD A, 2
+                               0xEA, 0x00, 0x20,    # LD (0x2000), A - bank 2
+                               0xFA, 0x00, 0x40]    # LD A, (0x4000)
+    rom_file[0x4000] = 0x11
+    rom_file[0x8000] = 0x22
+    cpu = NumbaCPU(MMU(rom_file))
+    cpu.run_cycles(36)
+
+    assert cpu.get_reg_8('A') == 0x22
+
+
+def test_read_only_rom():
+    # A read-only ROM, as load_rom maps it, is read where it is, not copied
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0102] = [0x3E, 0x42]          # LD A, 0x42
+    rom_file = np.frombuffer(rom_file.tobytes(), dtype=np.uint8)
+    cpu = NumbaCPU(MMU(rom_file))
+    cpu.tick()
+
+    assert cpu.get_reg_8('A') == 0x42
+    assert cpu.core_bails == 0
+    sources = cpu.memory_map.args[0]
+    assert any(np.shares_memory(np.asarray(source), rom_file) for source in sources)
+
+
+# Some work each frame, then waiting for V-Blank in HALT or polling LY
+FRAME_LOOP = [0x3E, 0x01,                           # LD A, 0x01
+              0xE0, 0xFF,                           # LDH (0xFF), A - V-Blank only
+              0xFB,                                 # EI
+              0x06, 0xFF,                           # LD B, 0xFF    <-- frame loop
+              0x05,                                 # DEC B
+              0xC2, 0x07, 0x01]                     # JP NZ, 0x0107
+WAITS = {
+    'halt': [0x76,                                  # HALT
+             0xC3, 0x05, 0x01],                     # JP frame loop
+    'poll': [0xF0, 0x44,                            # LDH A, (0x44) <-- poll
+             0xFE, 0x90,                            # CP 144
+             0xC2, 0x0B, 0x01,                      # JP NZ, poll
+             0xF3,                                  # DI
+             0xC3, 0x05, 0x01]                      # JP frame loop
+}
+
+@pytest.mark.parametrize('wait', sorted(WAITS))
+def test_game_boy_frames(wait):
+    # Whole frames with interrupts, HALT and polling LY come out the same
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0040] = 0xD9                         # RETI
+    code = FRAME_LOOP + WAITS[wait]
+    rom_file[0x0100:0x0100 + len(code)] = code
+    gameboys = [GameBoy(rom_file, cpu_backend=backend) for backend in ('python', 'numba')]
+    for gameboy in gameboys:
+        for _ in range(3):
+            gameboy.run_frame()
+
+    interpreted, compiled = (gameboy.cpu for gameboy in gameboys)
+    assert isinstance(compiled, NumbaCPU)
+    assert compiled.core_cycles > 0
+    assert_same_state(interpreted, compiled, wait)
+
+
+def test_timer_started_by_core_code():
+    # The TAC write is handed to the interpreter, and the core then runs
+    # only up to the overflow it schedules, not the end of the line
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0050:0x0052] = [0x48, 0xD9]          # LD C, B; RETI
+    code = [0x3E, 0x04, 0xE0, 0xFF,                 # LD A, 0x04; LDH (IE), A - timer
+            0xFB,                                   # EI
+            0x3E, 0xFE, 0xE0, 0x05,                 # LD A, 0xFE; LDH (TIMA), A
+            0x3E, 0x05, 0xE0, 0x07,                 # LD A, 0x05; LDH (TAC), A
+            0x04,                                   # INC B         <-- 0x010D
+            0xC3, 0x0D, 0x01]                       # JP 0x010D
+    rom_file[0x0100:0x0100 + len(code)] = code
+    gameboys = [GameBoy(rom_file, cpu_backend=backend) for backend in ('python', 'numba')]
+    for gameboy in gameboys:
+        gameboy.scheduler.run(456)
+
+    interpreted, compiled = (gameboy.cpu for gameboy in gameboys)
+    assert compiled.core_cycles > 0
+    assert compiled.get_reg_8('C') == 2
+    assert_same_state(interpreted, compiled, 'timer')
+
+
+def test_backends():
+    assert BACKENDS['python'] is CPU
+    assert default_backend() == ('numba' if HAVE_NUMBA else 'python')
+    with pytest.raises(ValueError):
+        GameBoy(np.zeros(0x8000, dtype=np.uint8), cpu_backend='fortran')
+
+
+def test_backend_needs_numba(monkeypatch):
+    # Asking for the numba backend without numba is an error, not a slower
+    # interpreter
+    monkeypatch.setattr(numba_cpu, 'HAVE_NUMBA', False)
+    monkeypatch.setattr(numba_cpu, 'INTERPRETED_CORE', False)
+    with pytest.raises(ValueError):
+        GameBoy(np.zeros(0x8000, dtype=np.uint8), cpu_backend='numba')
@@ -0,0 +1,76 @@
+import pytest
+import pacing
+from pacing import Pacer, PACING_REALTIME, PACING_SPEED, PACING_UNCAPPED
+
+class FakeTime:
+    # Clock that only moves when slept on, or when the test says so
+    def __init__(self):
+        self.now = 100.0
+        self.slept = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+def run_frames(pacer, fake, frames, frame_cost = 0.0):
+    presented = 0
+    for _ in range(frames):
+        if pacer.should_present():
+            presented += 1
+        fake.now += frame_cost
+        pacer.wait()
+    return presented
+
+def test_realtime():
+    fake = FakeTime()
+    pacer = Pacer(PACING_REALTIME, clock=fake.clock, sleep=fake.sleep)
+    start = fake.now
+    assert run_frames(pacer, fake, 597, frame_cost=0.002) == 597
+    assert fake.now - start == pytest.approx(597 / pacing.FRAME_RATE, rel=1e-3)
+    assert pacer.describe() == 'realtime'
+
+def test_speed_multiplier():
+    fake = FakeTime()
+    pacer = Pacer(PACING_SPEED, speed=4, clock=fake.clock, sleep=fake.sleep)
+    start = fake.now
+    assert run_frames(pacer, fake, 400) == 400
+    assert fake.now - start == pytest.approx(100 / pacing.FRAME_RATE, rel=1e-3)
+    assert pacer.describe() == '4x'
+
+def test_uncapped():
+    fake = FakeTime()
+    pacer = Pacer(PACING_UNCAPPED, present_every=8, clock=fake.clock, sleep=fake.sleep)
+    assert run_frames(pacer, fake, 80) == 10
+    assert fake.slept == 0
+    assert pacer.describe() == 'uncapped, presenting 1/8'
+
+def test_switch_at_runtime():
+    fake = FakeTime()
+    pacer = Pacer(PACING_UNCAPPED, clock=fake.clock, sleep=fake.sleep)
+    run_frames(pacer, fake, 100)
+    assert fake.slept == 0
+
+    pacer.set_mode(PACING_SPEED, 2)
+    start = fake.now
+    run_frames(pacer, fake, 120)
+    assert fake.now - start == pytest.approx(60 / pacing.FRAME_RATE, rel=1e-3)
+
+    # Realtime always means 1x
+    pacer.set_mode(PACING_REALTIME)
+    assert pacer.speed == 1.0
+
+    with pytest.raises(ValueError):
+        pacer.set_mode('warp')
+
+def test_falling_behind_resets_schedule():
+    fake = FakeTime()
+    pacer = Pacer(PACING_REALTIME, clock=fake.clock, sleep=fake.sleep)
+    # A one second stall shouldn't be followed by a burst of unpaced frames
+    fake.now += 1.0
+    pacer.wait()
+    slept = fake.slept
+    pacer.wait()
+    assert fake.slept - slept == pytest.approx(1 / pacing.FRAME_RATE)
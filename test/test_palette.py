@@ -0,0 +1,61 @@
+import tracemalloc
+import numpy as np
+from mmu import MMU
+import ppu
+from ppu import PPU
+from palette import PaletteLUT, SHADES, PALETTE_BGP, PALETTE_OBP0, PALETTE_OBP1, PALETTE_BLANK
+
+def test_static_palettes():
+    lut = PaletteLUT(160, 144)
+    framebuffer = np.zeros((144, 160), dtype=np.uint8)
+    framebuffer[0][0:4] = [PALETTE_BGP * 4 + 0, PALETTE_BGP * 4 + 3,
+                           PALETTE_OBP0 * 4 + 1, PALETTE_OBP1 * 4 + 2]
+    framebuffer[1][0:4] = [PALETTE_BLANK * 4 + n for n in range(4)]
+    line_palettes = np.zeros((144, 3), dtype=np.uint8)
+    line_palettes[:] = (0x1B, 0xE4, 0x93)
+
+    pixels = lut.convert(framebuffer, line_palettes)
+    assert pixels.shape == (160, 144, 3)
+    assert [list(pixels[x][0]) for x in range(4)] == [list(SHADES[3]), list(SHADES[0]),
+                                                      list(SHADES[1]), list(SHADES[1])]
+    assert [list(pixels[x][1]) for x in range(4)] == [list(SHADES[n]) for n in range(4)]
+
+    # Same palettes: no rebuild, and the same output array every frame
+    assert lut.convert(framebuffer, line_palettes) is pixels
+    assert lut.rebuilds == 1
+
+    line_palettes[:] = (0xE4, 0xE4, 0xE4)
+    lut.convert(framebuffer, line_palettes)
+    assert lut.rebuilds == 2
+    assert list(pixels[1][0]) == list(SHADES[3])
+
+def test_mid_frame_palette_change():
+    mmu = MMU(np.zeros(0x8000, dtype=np.uint8))
+    mmu.set(ppu.LCDC, 0x91)
+    for addr in range(0x8010, 0x8020):
+        mmu.set(addr, 0xFF)
+    mmu.BG_MAP_1[:] = 0x01
+
+    renderer = PPU(mmu)
+    for ly in range(144):
+        mmu.set(ppu.BGP, 0xFF if ly < 72 else 0x3F)
+        renderer.render_scanline(ly)
+
+    pixels = PaletteLUT(160, 144).convert(renderer.framebuffer, renderer.line_palettes)
+    assert list(pixels[0][71]) == list(SHADES[3])
+    assert list(pixels[0][72]) == list(SHADES[0])
+
+def test_convert_allocates_nothing():
+    # Neither path allocates per frame once the palettes are built
+    lut = PaletteLUT(160, 144)
+    framebuffer = np.random.default_rng(13).integers(0, 16, (144, 160), dtype=np.uint8)
+    same = np.full((144, 3), 0xE4, dtype=np.uint8)
+    changing = np.zeros((144, 3), dtype=np.uint8)
+    changing[72:] = 0x1B
+    for line_palettes in (same, changing):
+        lut.convert(framebuffer, line_palettes)
+        tracemalloc.start()
+        lut.convert(framebuffer, line_palettes)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < 4096
@@ -0,0 +1,246 @@
+import numpy as np
+import pytest
+from mmu import MMU
+import ppu
+from ppu import PPU
+from palette import PALETTES, BLANK_PALETTE_REG
+
+def make_mmu():
+    return MMU(np.zeros(0x8000, dtype=np.uint8))
+
+def render_shades(renderer):
+    # Render a frame and apply the palettes each line was drawn with
+    frame = renderer.render_frame()
+    blank = np.full((144, 1), BLANK_PALETTE_REG, dtype=np.uint8)
+    registers = np.concatenate((renderer.line_palettes, blank), axis=1)
+    return PALETTES[registers[np.arange(144)[:, None], frame >> 2], frame & 0x03]
+
+def set_tile_row(mmu, tile, row, colours):
+    # colours: 8 colour indices, leftmost first
+    low = high = 0
+    for i, colour in enumerate(colours):
+        low |= (colour & 0x01) << (7 - i)
+        high |= (colour >> 1) << (7 - i)
+    mmu.set(0x8000 + tile * 16 + row * 2, low)
+    mmu.set(0x8000 + tile * 16 + row * 2 + 1, high)
+
+def reference_pixel_colour(mmu, tile_map_base, signed, tx, ty):
+    # Colour index at (tx, ty) of a 256x256 tile map, one pixel at a time
+    tile_id = mmu.get(tile_map_base + (ty // 8) * 32 + (tx // 8))
+    if signed:
+        addr = 0x9000 + (tile_id - 256 if tile_id > 127 else tile_id) * 16
+    else:
+        addr = 0x8000 + tile_id * 16
+    low = mmu.get(addr + (ty % 8) * 2)
+    high = mmu.get(addr + (ty % 8) * 2 + 1)
+    bit = 7 - (tx % 8)
+    return ((low >> bit) & 1) | (((high >> bit) & 1) << 1)
+
+def reference_frame(mmu):
+    # Straightforward per-pixel renderer used to check the PPU
+    lcdc = mmu.get(ppu.LCDC)
+    shade = lambda reg, colour: (mmu.get(reg) >> (colour * 2)) & 0x03
+    frame = np.zeros((144, 160), dtype=np.uint8)
+    window_line = 0
+
+    for ly in range(144):
+        bg = [0] * 160
+        window_drawn = False
+        for x in range(160):
+            if not lcdc & 0x01:
+                continue
+            wx = mmu.get(ppu.WX) - 7
+            if lcdc & 0x20 and ly >= mmu.get(ppu.WY) and x >= wx:
+                bg[x] = reference_pixel_colour(mmu, 0x9C00 if lcdc & 0x40 else 0x9800,
+                                               not lcdc & 0x10, x - wx, window_line)
+                window_drawn = True
+            else:
+                bg[x] = reference_pixel_colour(mmu, 0x9C00 if lcdc & 0x08 else 0x9800,
+                                               not lcdc & 0x10, (x + mmu.get(ppu.SCX)) & 0xFF,
+                                               (ly + mmu.get(ppu.SCY)) & 0xFF)
+            frame[ly][x] = shade(ppu.BGP, bg[x])
+        if window_drawn:
+            window_line += 1
+
+        if not lcdc & 0x02:
+            continue
+        height = 16 if lcdc & 0x04 else 8
+        sprites = [i for i in range(40)
+                   if mmu.get(0xFE00 + i * 4) - 16 <= ly < mmu.get(0xFE00 + i * 4) - 16 + height][:10]
+        for x in range(160):
+            best = None
+            for i in sprites:
+                sx = mmu.get(0xFE00 + i * 4 + 1) - 8
+                if not sx <= x < sx + 8:
+                    continue
+                tile = mmu.get(0xFE00 + i * 4 + 2)
+                flags = mmu.get(0xFE00 + i * 4 + 3)
+                row = ly - (mmu.get(0xFE00 + i * 4) - 16)
+                if flags & 0x40:
+                    row = height - 1 - row
+                if height == 16:
+                    tile &= 0xFE
+                col = x - sx
+                if flags & 0x20:
+                    col = 7 - col
+                low = mmu.get(0x8000 + tile * 16 + row * 2)
+                high = mmu.get(0x8000 + tile * 16 + row * 2 + 1)
+                colour = ((low >> (7 - col)) & 1) | (((high >> (7 - col)) & 1) << 1)
+                if colour == 0:
+                    continue
+                key = (sx, i)
+                if best is None or key < best[0]:
+                    best = (key, colour, flags)
+            if best is not None:
+                _, colour, flags = best
+                if flags & 0x80 and bg[x] != 0:
+                    continue
+                frame[ly][x] = shade(ppu.OBP1 if flags & 0x10 else ppu.OBP0, colour)
+
+    return frame
+
+def test_background_tile():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x91)
+    mmu.set(ppu.BGP, 0xE4)
+    set_tile_row(mmu, 1, 0, [0, 1, 2, 3, 3, 2, 1, 0])
+    mmu.set(0x9800, 0x01)
+
+    frame = render_shades(PPU(mmu))
+    assert list(frame[0][0:8]) == [0, 1, 2, 3, 3, 2, 1, 0]
+    assert not frame[1:].any()
+
+def test_scroll_wraps():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x91)
+    mmu.set(ppu.BGP, 0xE4)
+    set_tile_row(mmu, 1, 0, [3] * 8)
+    mmu.set(0x9800, 0x01)
+    mmu.set(ppu.SCX, 0xFC)
+    mmu.set(ppu.SCY, 0xFF)
+
+    frame = render_shades(PPU(mmu))
+    assert list(frame[1][0:6]) == [0, 0, 0, 0, 3, 3]
+
+def test_signed_tile_addressing():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x81)
+    mmu.set(ppu.BGP, 0xE4)
+    # Tile id 0xFF is at 0x8FF0 in 0x8800 mode
+    set_tile_row(mmu, 0xFF, 0, [2] * 8)
+    mmu.set(0x9800, 0xFF)
+
+    frame = render_shades(PPU(mmu))
+    assert list(frame[0][0:8]) == [2] * 8
+
+def test_lcd_off():
+    mmu = make_mmu()
+    set_tile_row(mmu, 0, 0, [3] * 8)
+    mmu.set(ppu.BGP, 0xE4)
+    assert not render_shades(PPU(mmu)).any()
+
+def test_sprite_priority_and_transparency():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x93)
+    mmu.set(ppu.BGP, 0xE4)
+    mmu.set(ppu.OBP0, 0xE4)
+    set_tile_row(mmu, 2, 0, [0, 3, 3, 3, 3, 3, 3, 3])
+    set_tile_row(mmu, 3, 0, [1] * 8)
+
+    # Sprite 1 has the lower X, so it wins where they overlap; its
+    # transparent first pixel shows sprite 0 underneath
+    mmu.OAM[0:4] = [16, 12, 3, 0x00]
+    mmu.OAM[4:8] = [16, 10, 2, 0x00]
+
+    frame = render_shades(PPU(mmu))
+    assert list(frame[0][0:12]) == [0, 0, 0, 3, 3, 3, 3, 3, 3, 3, 1, 1]
+
+def test_ten_sprites_per_line():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x93)
+    mmu.set(ppu.OBP0, 0xE4)
+    set_tile_row(mmu, 1, 0, [3] * 8)
+    for i in range(12):
+        mmu.OAM[i * 4:i * 4 + 4] = [16, 8 + i * 8, 1, 0x00]
+
+    frame = render_shades(PPU(mmu))
+    assert frame[0][79] == 3
+    assert frame[0][80] == 0
+
+@pytest.mark.parametrize('lcdc', [0xF3, 0xE7, 0x93, 0xB1, 0xD3, 0x91])
+def test_matches_reference(lcdc):
+    rng = np.random.default_rng(lcdc)
+    mmu = make_mmu()
+    mmu.CHAR_RAM[:] = rng.integers(0, 0x100, len(mmu.CHAR_RAM))
+    mmu.BG_MAP_1[:] = rng.integers(0, 0x100, len(mmu.BG_MAP_1))
+    mmu.BG_MAP_2[:] = rng.integers(0, 0x100, len(mmu.BG_MAP_2))
+    mmu.OAM[:160] = rng.integers(0, 0x100, 160)
+    # Keep most sprites near the screen
+    mmu.OAM[0:160:4] = rng.integers(0, 170, 40)
+    mmu.OAM[1:160:4] = rng.integers(0, 176, 40)
+
+    mmu.set(ppu.LCDC, lcdc)
+    mmu.set(ppu.SCX, 0x35)
+    mmu.set(ppu.SCY, 0xC9)
+    mmu.set(ppu.WX, 0x30)
+    mmu.set(ppu.WY, 0x40)
+    mmu.set(ppu.BGP, 0xE4)
+    mmu.set(ppu.OBP0, 0x1B)
+    mmu.set(ppu.OBP1, 0x93)
+
+    assert (render_shades(PPU(mmu)) == reference_frame(mmu)).all()
+
+def test_window_left_of_screen():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0xF1)
+    mmu.set(ppu.BGP, 0xE4)
+    set_tile_row(mmu, 1, 0, [1, 2, 3, 3, 3, 3, 3, 3])
+    mmu.set(0x9C00, 0x01)
+    mmu.set(ppu.WX, 0x05)
+
+    frame = render_shades(PPU(mmu))
+    assert list(frame[0][0:3]) == [3, 3, 3]
+
+def test_tile_cache_tracks_char_ram_writes():
+    mmu = make_mmu()
+    mmu.set(ppu.LCDC, 0x91)
+    mmu.set(ppu.BGP, 0xE4)
+    mmu.set(0x9800, 0x01)
+    renderer = PPU(mmu)
+    cache = renderer.tile_cache
+    assert cache.redecodes == 384
+    assert not cache.tiles.any()
+
+    # Writes through the MMU mark just their tile dirty
+    set_tile_row(mmu, 1, 0, [3, 2, 1, 0, 0, 1, 2, 3])
+    assert mmu.dirty_tiles == {1}
+
+    frame = renderer.render_frame()
+    assert list(frame[0][0:8]) == [3, 2, 1, 0, 0, 1, 2, 3]
+    assert not mmu.dirty_tiles
+    assert cache.redecodes == 385
+    assert cache.misses == 2
+    # One 32-tile map row per line
+    assert cache.hits == 144 * 32
+
+    renderer.render_frame()
+    assert cache.redecodes == 385
+    assert cache.misses == 2
+
+    # Writes that bypass the MMU need an explicit invalidate
+    mmu.CHAR_RAM[16] = 0x00
+    mmu.CHAR_RAM[17] = 0x00
+    cache.invalidate()
+    assert not renderer.render_frame().any()
+
+def test_tile_cache_decoding():
+    mmu = make_mmu()
+    mmu.CHAR_RAM[:] = np.random.default_rng(0).integers(0, 0x100, len(mmu.CHAR_RAM))
+    cache = PPU(mmu).tile_cache
+
+    for tile in (0, 1, 127, 128, 255, 256, 383):
+        for row in range(8):
+            low = int(mmu.CHAR_RAM[tile * 16 + row * 2])
+            high = int(mmu.CHAR_RAM[tile * 16 + row * 2 + 1])
+            assert list(cache.tiles[tile, row]) == \
+                   [((low >> (7 - x)) & 1) | (((high >> (7 - x)) & 1) << 1) for x in range(8)]
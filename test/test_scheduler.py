@@ -0,0 +1,58 @@
+import numpy as np
+from mmu import MMU
+from cpu import CPU, STOP_BREAKPOINT, STOP_CYCLES
+from scheduler import Scheduler, EVENT_DMA, EVENT_SERIAL, EVENT_TIMER
+
+def nop_scheduler():
+    # All NOPs, 4 cycles each
+    return Scheduler(CPU(MMU(np.zeros(0x8000, dtype=np.uint8))))
+
+def test_events_run_in_time_order():
+    scheduler = nop_scheduler()
+    fired = []
+    scheduler.schedule(100, EVENT_TIMER, lambda time: fired.append(('timer', time)))
+    scheduler.schedule(40, EVENT_SERIAL, lambda time: fired.append(('serial', time)))
+    scheduler.schedule(40, EVENT_DMA, lambda time: fired.append(('dma', time)))
+
+    assert scheduler.run(1000) == STOP_CYCLES
+    assert fired == [('serial', 40), ('dma', 40), ('timer', 100)]
+    assert scheduler.now == 1000
+
+def test_cpu_runs_up_to_each_event():
+    scheduler = nop_scheduler()
+    seen = []
+    scheduler.schedule(42, EVENT_TIMER, lambda time: seen.append(scheduler.now))
+
+    scheduler.run(100)
+    # The instruction that crosses the event time finishes first
+    assert seen == [44]
+
+def test_periodic_event_does_not_drift():
+    scheduler = nop_scheduler()
+    times = []
+
+    def tick(time):
+        times.append(time)
+        scheduler.schedule_at(time + 10, EVENT_TIMER, tick)
+
+    scheduler.schedule_at(10, EVENT_TIMER, tick)
+    scheduler.run(100)
+    assert times == list(range(10, 101, 10))
+
+def test_cancel():
+    scheduler = nop_scheduler()
+    fired = []
+    scheduler.schedule(40, EVENT_TIMER, fired.append)
+    scheduler.schedule(80, EVENT_SERIAL, fired.append)
+    scheduler.cancel(EVENT_TIMER)
+
+    assert not scheduler.pending(EVENT_TIMER)
+    assert scheduler.pending(EVENT_SERIAL)
+    scheduler.run(100)
+    assert fired == [80]
+
+def test_breakpoint_stops_run():
+    scheduler = nop_scheduler()
+    scheduler.cpu.breakpoints.add(0x0110)
+    assert scheduler.run(1000) == STOP_BREAKPOINT
+    assert scheduler.cpu.pc == 0x0110
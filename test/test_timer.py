@@ -0,0 +1,66 @@
+import numpy as np
+from mmu import MMU, IF, INT_TIMER
+from cpu import CPU
+from scheduler import Scheduler
+from timer import Timer, DIV, TIMA, TMA, TAC
+
+def nop_timer():
+    mmu = MMU(np.zeros(0x8000, dtype=np.uint8))
+    scheduler = Scheduler(CPU(mmu))
+    return mmu, scheduler, Timer(mmu, scheduler)
+
+def test_div():
+    mmu, scheduler, timer = nop_timer()
+    scheduler.run(256 * 5)
+    assert mmu.get(DIV) == 5
+
+    mmu.set(DIV, 0x12)
+    assert mmu.get(DIV) == 0
+    scheduler.run(scheduler.now + 256 * 300)
+    assert mmu.get(DIV) == 300 & 0xFF
+
+def test_tima_counts_when_enabled():
+    mmu, scheduler, timer = nop_timer()
+    scheduler.run(1000)
+    assert mmu.get(TIMA) == 0
+
+    # 16 cycles per increment
+    mmu.set(TAC, 0x05)
+    scheduler.run(scheduler.now + 16 * 10)
+    assert mmu.get(TIMA) == 10
+
+    # Stopping keeps the count
+    mmu.set(TAC, 0x01)
+    scheduler.run(scheduler.now + 1000)
+    assert mmu.get(TIMA) == 10
+    assert mmu.get(TAC) == 0xF9
+
+def test_tima_overflow():
+    mmu, scheduler, timer = nop_timer()
+    mmu.set(TMA, 0xF0)
+    mmu.set(TIMA, 0xFE)
+    mmu.set(TAC, 0x04)      # 1024 cycles per increment
+
+    scheduler.run(1024)
+    assert mmu.get(TIMA) == 0xFF
+    assert not mmu.get(IF) & INT_TIMER
+
+    scheduler.run(2048)
+    assert mmu.get(TIMA) == 0xF0
+    assert mmu.get(IF) & INT_TIMER
+
+    # Reloaded from TMA, 16 increments to the next overflow
+    mmu.set(IF, 0)
+    scheduler.run(2048 + 1024 * 16)
+    assert mmu.get(TIMA) == 0xF0
+    assert mmu.get(IF) & INT_TIMER
+
+def test_tima_write_reschedules():
+    mmu, scheduler, timer = nop_timer()
+    mmu.set(TAC, 0x05)
+    scheduler.run(16 * 100)
+    mmu.set(TIMA, 0xFF)
+    scheduler.run(scheduler.now + 8)
+    assert not mmu.get(IF) & INT_TIMER
+    scheduler.run(scheduler.now + 16)
+    assert mmu.get(IF) & INT_TIMER
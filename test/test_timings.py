@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+from mmu import MMU
+from cpu import CPU, OP_CYCLES
+
+# Documented instruction timings in clock cycles, by instruction group.
+# Reference: https://gbdev.io/pandocs/CPU_Instruction_Set.html
+HL_OPERAND = [0x46, 0x4E, 0x56, 0x5E, 0x66, 0x6E, 0x7E,
+              0x70, 0x71, 0x72, 0x73, 0x74, 0x75, 0x77]
+
+DOCUMENTED = [
+    ('LD r, r', [op for op in range(0x40, 0x80) if op not in HL_OPERAND + [0x76]], 4),
+    ('LD r, (HL) / LD (HL), r', HL_OPERAND, 8),
+    ('LD r, n', [0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E, 0x3E], 8),
+    ('LD (HL), n', [0x36], 12),
+    ('LD A, (rr) / LD (rr), A', [0x0A, 0x1A, 0x02, 0x12], 8),
+    ('LDI / LDD', [0x22, 0x2A, 0x32, 0x3A], 8),
+    ('LD A, (nn) / LD (nn), A', [0xFA, 0xEA], 16),
+    ('LD A, (C) / LD (C), A', [0xF2, 0xE2], 8),
+    ('LDH', [0xE0, 0xF0], 12),
+    ('LD rr, nn', [0x01, 0x11, 0x21, 0x31], 12),
+    ('LD (nn), SP', [0x08], 20),
+    ('LD SP, HL', [0xF9], 8),
+    ('LD HL, SP+n', [0xF8], 12),
+    ('PUSH', [0xC5, 0xD5, 0xE5, 0xF5], 16),
+    ('POP', [0xC1, 0xD1, 0xE1, 0xF1], 12),
+    ('ALU A, r', [op for op in range(0x80, 0xC0) if op & 0x07 != 6], 4),
+    ('ALU A, (HL)', list(range(0x86, 0xC0, 0x08)), 8),
+    ('ALU A, n', list(range(0xC6, 0x100, 0x08)), 8),
+    ('INC/DEC r', [op for op in range(0x04, 0x40, 0x08) if op != 0x34]
+                  + [op for op in range(0x05, 0x40, 0x08) if op != 0x35], 4),
+    ('INC/DEC (HL)', [0x34, 0x35], 12),
+    ('ADD HL, rr', [0x09, 0x19, 0x29, 0x39], 8),
+    ('INC/DEC rr', [0x03, 0x13, 0x23, 0x33, 0x0B, 0x1B, 0x2B, 0x3B], 8),
+    ('ADD SP, n', [0xE8], 16),
+    ('DAA / CPL / CCF / SCF', [0x27, 0x2F, 0x3F, 0x37], 4),
+    ('NOP / HALT / STOP', [0x00, 0x76, 0x10], 4),
+    ('DI / EI', [0xF3, 0xFB], 4),
+    ('RLCA / RLA / RRCA / RRA', [0x07, 0x17, 0x0F, 0x1F], 4),
+    ('JP nn', [0xC3], 16),
+    ('JP HL', [0xE9], 4),
+    ('JR n', [0x18], 12),
+    ('CALL nn', [0xCD], 24),
+    ('RST', list(range(0xC7, 0x100, 0x08)), 16),
+    ('RET / RETI', [0xC9, 0xD9], 16),
+]
+
+UNUSED = [0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD]
+
+# Conditional branches: opcode, flags that take it, flags that don't,
+# taken cycles, not taken cycles
+CONDITIONAL = [
+    (0x20, 0x00, 0x80, 12, 8),    # JR NZ
+    (0x28, 0x80, 0x00, 12, 8),    # JR Z
+    (0x30, 0x00, 0x10, 12, 8),    # JR NC
+    (0x38, 0x10, 0x00, 12, 8),    # JR C
+    (0xC2, 0x00, 0x80, 16, 12),   # JP NZ
+    (0xCA, 0x80, 0x00, 16, 12),   # JP Z
+    (0xD2, 0x00, 0x10, 16, 12),   # JP NC
+    (0xDA, 0x10, 0x00, 16, 12),   # JP C
+    (0xC4, 0x00, 0x80, 24, 12),   # CALL NZ
+    (0xCC, 0x80, 0x00, 24, 12),   # CALL Z
+    (0xD4, 0x00, 0x10, 24, 12),   # CALL NC
+    (0xDC, 0x10, 0x00, 24, 12),   # CALL C
+    (0xC0, 0x00, 0x80, 20, 8),    # RET NZ
+    (0xC8, 0x80, 0x00, 20, 8),    # RET Z
+    (0xD0, 0x00, 0x10, 20, 8),    # RET NC
+    (0xD8, 0x10, 0x00, 20, 8),    # RET C
+]
+
+def make_cpu(code, flags = 0x00):
+    # Operands point into work RAM, as do HL, BC, DE and SP
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0103] = [0x00, 0xC0, 0xC0]
+    rom_file[0x0100:0x0100 + len(code)] = code
+
+    cpu = CPU(MMU(rom_file))
+    for pair in ('BC', 'DE', 'HL'):
+        cpu.set_reg_16(pair, 0xC000)
+    cpu.sp = 0xDFF0
+    cpu.set_reg_8('F', flags)
+    return cpu
+
+def documented_cycles():
+    cycles = {}
+    for name, opcodes, count in DOCUMENTED:
+        for op in opcodes:
+            assert op not in cycles, name
+            cycles[op] = count
+    return cycles
+
+def test_table_covers_every_opcode():
+    documented = documented_cycles()
+    conditional = [entry[0] for entry in CONDITIONAL]
+    assert sorted(list(documented) + conditional + UNUSED + [0xCB]) == list(range(0x100))
+
+    for op in UNUSED:
+        assert OP_CYCLES[op] == 0
+
+@pytest.mark.parametrize('op, cycles', sorted(documented_cycles().items()))
+def test_opcode_cycles(op, cycles):
+    cpu = make_cpu([op])
+    assert cpu.tick() == cycles
+    assert cpu.cycles == cycles
+
+@pytest.mark.parametrize('op, taken_flags, not_taken_flags, taken, not_taken', CONDITIONAL)
+def test_conditional_cycles(op, taken_flags, not_taken_flags, taken, not_taken):
+    cpu = make_cpu([op], taken_flags)
+    assert cpu.tick() == taken
+
+    cpu = make_cpu([op], not_taken_flags)
+    assert cpu.tick() == not_taken
+
+def test_cb_cycles():
+    for op2 in range(0x100):
+        if op2 & 0x07 != 6:
+            expected = 8            # register operand
+        elif 0x40 <= op2 < 0x80:
+            expected = 12           # BIT b, (HL)
+        else:
+            expected = 16           # everything else on (HL)
+
+        cpu = make_cpu([0xCB, op2])
+        assert cpu.tick() == expected, hex(op2)
+        assert cpu.pc == 0x0102
+
+def test_cycle_counter():
+    # LD B, 1; DEC B; JR NZ; JR Z; BIT 0, (HL).  JR offsets count from the
+    # offset byte here, so 1 lands on the next instruction.
+    cpu = make_cpu([0x06, 0x01, 0x05, 0x20, 0x01, 0x28, 0x01, 0xCB, 0x46])
+    ticks = [cpu.tick() for _ in range(5)]
+
+    assert ticks == [8, 4, 8, 12, 12]
+    assert cpu.cycles == sum(ticks)
+    assert cpu.pc == 0x0109
+
+def test_interrupt_cycles():
+    cpu = make_cpu([0x00])
+    cpu.interrupt_master_enable = True
+    cpu.mmu.set(0xFFFF, 0x01)
+    cpu.mmu.set(0xFF0F, 0x01)
+
+    assert cpu.tick() == 4 + 20
+    assert cpu.pc == 0x0040
@@ -0,0 +1,307 @@
+import os
+import numpy as np
+import pytest
+from cpu import CPU, STOP_BREAKPOINT, STOP_CYCLES, STOP_INTERRUPT
+from mmu import MMU, IE, IF, INT_TIMER
+from gameboy import GameBoy
+from ppu import CYCLES_PER_FRAME
+import cartridge
+from translator import cache_path
+
+def rom_with(code, rom_file = None):
+    if rom_file is None:
+        rom_file = np.zeros(0x8000, dtype=np.uint8)
+    for addr, block in code.items():
+        rom_file[addr:addr + len(block)] = block
+    return rom_file
+
+# Loads, ALU, (HL) and stack operations, CB ops, calls and conditional
+# branches both ways, then HALT with interrupts off
+KITCHEN_SINK = {
+    0x0100: [0x31, 0xF0, 0xDF,          # LD SP, 0xDFF0
+             0x21, 0x00, 0xC0,          # LD HL, 0xC000
+             0x11, 0x80, 0xC0,          # LD DE, 0xC080
+             0x01, 0x05, 0x20,          # LD BC, 0x2005
+             0x78,                      # LD A, B         <-- loop, 0x010C
+             0x22,                      # LDI (HL), A
+             0x89,                      # ADC A, C
+             0x12,                      # LD (DE), A
+             0x13,                      # INC DE
+             0xCB, 0x37,                # SWAP A
+             0xE6, 0x3F,                # AND 0x3F
+             0xC5,                      # PUSH BC
+             0xCD, 0x00, 0x02,          # CALL 0x0200
+             0xC1,                      # POP BC
+             0x2B,                      # DEC HL
+             0x34,                      # INC (HL)
+             0x7E,                      # LD A, (HL)
+             0x9E,                      # SBC A, (HL)
+             0xB1,                      # OR C
+             0xAE,                      # XOR (HL)
+             0x23,                      # INC HL
+             0x27,                      # DAA
+             0xE0, 0x80,                # LDH (0x80), A
+             0xF0, 0x80,                # LDH A, (0x80)
+             0xEA, 0x40, 0xC1,          # LD (0xC140), A
+             0xFA, 0x40, 0xC1,          # LD A, (0xC140)
+             0xFE, 0x10,                # CP 0x10
+             0x38, 0x02,                # JR C, skip
+             0x3C,                      # INC A
+             0x3D,                      # DEC A           <-- skip
+             0x57,                      # LD D, A
+             0x16, 0xC0,                # LD D, 0xC0
+             0x05,                      # DEC B
+             0xC2, 0x0C, 0x01,          # JP NZ, loop
+             0xAF,                      # XOR A
+             0xC4, 0x00, 0x02,          # CALL NZ, 0x0200
+             0xCC, 0x00, 0x02,          # CALL Z, 0x0200
+             0x76],                     # HALT
+    0x0200: [0x0C,                      # INC C
+             0x79,                      # LD A, C
+             0xFE, 0x08,                # CP 0x08
+             0xD8,                      # RET C
+             0x0E, 0x00,                # LD C, 0
+             0xC9],                     # RET
+}
+
+def run_to_halt(rom_file, translate, cache = None, **cpu_args):
+    cpu = CPU(MMU(rom_file), translate=translate, **cpu_args)
+    if cache is not None:
+        cpu.translator.load_cache(cache)
+    while not cpu.halted:
+        cpu.run_cycles(1000)
+    return cpu
+
+def assert_same_state(translated, interpreted):
+    assert translated.regs == interpreted.regs
+    assert translated.sp == interpreted.sp
+    assert translated.pc == interpreted.pc
+    assert translated.cycles - translated.idle_cycles == \
+           interpreted.cycles - interpreted.idle_cycles
+    assert bytes(translated.mmu.WORK_RAM) == bytes(interpreted.mmu.WORK_RAM)
+    assert bytes(translated.mmu.HIGH_RAM) == bytes(interpreted.mmu.HIGH_RAM)
+
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_matches_interpreter(lazy_flags):
+    rom_file = rom_with(KITCHEN_SINK)
+    translated = run_to_halt(rom_file, True, lazy_flags=lazy_flags)
+    interpreted = run_to_halt(rom_file, False, lazy_flags=lazy_flags)
+
+    assert_same_state(translated, interpreted)
+    assert translated.translator.translated > 0
+    assert translated.translator.executed > translated.translator.translated
+
+ALU_VALUES = [0x00, 0x01, 0x0F, 0x10, 0x7F, 0x80, 0xF0, 0xFF]
+
+@pytest.mark.parametrize('lazy_flags', [False, True])
+def test_alu_flags_match_interpreter(lazy_flags):
+    # Every 8-bit ALU, INC and DEC opcode, on B, (HL) and immediates, over
+    # operand and flag values around the carry and half-carry edges
+    opcodes = list(range(0x80, 0xC0)) + list(range(0xC6, 0x100, 0x08)) + \
+              [0x04, 0x05, 0x34, 0x35, 0x3C, 0x3D]
+    machines = {}
+    for op in opcodes:
+        for a in ALU_VALUES:
+            for val in ALU_VALUES:
+                code = (op, val) if op >= 0xC0 else (op,)
+                if code not in machines:
+                    rom_file = rom_with({0x0100: list(code) + [0x76]})
+                    machines[code] = [CPU(MMU(rom_file), translate=translate, lazy_flags=lazy_flags)
+                                      for translate in (True, False)]
+                for cpu in machines[code]:
+                    cpu.pc = 0x0100
+                    cpu.halted = False
+                    cpu.regs[:] = bytes([val, 0, 0, 0, 0xC0, 0x00, a, 0xB0 if val & 1 else 0x40])
+                    cpu.mmu.set(0xC000, val)
+                    cpu.run_cycles(8)
+                    cpu.get_reg_8('F')
+                translated, interpreted = machines[code]
+                assert translated.regs == interpreted.regs, (hex(op), a, val)
+                assert translated.mmu.get(0xC000) == interpreted.mmu.get(0xC000)
+
+def test_fibonacci():
+    rom_file = rom_with({0x0100: [0x16, 0x0D, 0x06, 0x00, 0x0E, 0x01, 0x78, 0x81,
+                                  0x48, 0x47, 0x15, 0xC2, 0x06, 0x01, 0x76]})
+    cpu = run_to_halt(rom_file, True)
+    assert cpu.regs[0] == 233
+    assert cpu.pc == 0x010F
+
+    # The loop body is one block, entered once from the top of the program
+    # and once per turn
+    assert set(cpu.translator.blocks) == {(0, 0x0100), (0, 0x0106), (0, 0x010E)}
+
+def test_breakpoints_use_interpreter():
+    rom_file = rom_with({0x0100: [0x00, 0x00, 0x00, 0xC3, 0x00, 0x01]})
+    cpu = CPU(MMU(rom_file), translate=True)
+    cpu.breakpoints.add(0x0102)
+
+    assert cpu.run_cycles(1000) == (8, STOP_BREAKPOINT)
+    assert cpu.pc == 0x0102
+    assert cpu.translator.translated == 0
+
+def test_blocks_end_on_cycle_budget():
+    # All NOPs: a block of MAX_BLOCK_INSTRUCTIONS at a time, so the budget
+    # is overshot by less than one block
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)), translate=True, idle_loops=False)
+    spent, reason = cpu.run_cycles(40)
+    assert reason == STOP_CYCLES
+    assert spent == cpu.cycles == 4 * (cpu.pc - 0x0100)
+    assert 40 <= spent < 40 + 4 * 32
+
+def test_interrupts_between_blocks():
+    rom_file = rom_with({0x0050: [0xD9],            # RETI
+                         0x0100: [0xFB,             # EI
+                                  0x00,             # NOP         <-- loop
+                                  0xC3, 0x01, 0x01]})
+    cpu = CPU(MMU(rom_file), translate=True)
+    cpu.mmu.set(IE, INT_TIMER)
+    cpu.run_cycles(100)
+
+    cpu.mmu.set(IF, INT_TIMER)
+    spent, reason = cpu.run_cycles(1000)
+    assert reason == STOP_INTERRUPT
+    assert cpu.pc == 0x0050
+    assert cpu.pop_stack() in (0x0101, 0x0102)
+
+def test_work_ram_code_is_invalidated_on_write():
+    # Runs a routine copied to work RAM, patches its operand and runs it
+    # again
+    rom_file = rom_with({0x0100: [0x21, 0x00, 0xC0,      # LD HL, 0xC000
+                                  0x36, 0x3E,            # LD (HL), 0x3E - LD A, n
+                                  0x23,                  # INC HL
+                                  0x36, 0x11,            # LD (HL), 0x11
+                                  0x23,                  # INC HL
+                                  0x36, 0xC9,            # LD (HL), 0xC9 - RET
+                                  0x31, 0xFE, 0xFF,      # LD SP, 0xFFFE
+                                  0xCD, 0x00, 0xC0,      # CALL 0xC000
+                                  0x47,                  # LD B, A
+                                  0x3E, 0x22,            # LD A, 0x22
+                                  0xEA, 0x01, 0xC0,      # LD (0xC001), A
+                                  0xCD, 0x00, 0xC0,      # CALL 0xC000
+                                  0x4F,                  # LD C, A
+                                  0x76]})                # HALT
+    cpu = run_to_halt(rom_file, True)
+    translator = cpu.translator
+
+    assert cpu.regs[0] == 0x11
+    assert cpu.regs[1] == 0x22
+    assert translator.invalidated == 1
+    assert 0xC0 in translator.watched        # watched again once retranslated
+
+def test_blocks_are_keyed_by_rom_bank():
+    # The same address in two switchable banks holds different code
+    rom_file = np.zeros(4 * 0x4000, dtype=np.uint8)
+    rom_file[cartridge.HEADER_TYPE] = 0x01
+    rom_with({0x0100: [0x31, 0xFE, 0xFF,       # LD SP, 0xFFFE
+                       0xCD, 0x00, 0x40,       # CALL 0x4000 - bank 1
+                       0x47,                   # LD B, A
+                       0x3E, 0x02,             # LD A, 2
+                       0xEA, 0x00, 0x20,       # LD (0x2000), A - bank 2
+                       0xCD, 0x00, 0x40,       # CALL 0x4000
+                       0x4F,                   # LD C, A
+                       0x76],                  # HALT
+              0x4000: [0x3E, 0x11, 0xC9],      # bank 1: LD A, 0x11 / RET
+              0x8000: [0x3E, 0x22, 0xC9]},     # bank 2: LD A, 0x22 / RET
+             rom_file=rom_file)
+
+    cpu = run_to_halt(rom_file, True)
+    assert cpu.regs[0] == 0x11
+    assert cpu.regs[1] == 0x22
+    assert (1, 0x4000) in cpu.translator.blocks
+    assert (2, 0x4000) in cpu.translator.blocks
+
+def test_game_boy_frames():
+    # Work, then HALT until V-Blank, each frame: translated, the machine
+    # wakes on the same interrupts
+    rom_file = rom_with({0x0040: [0xD9],                  # RETI
+                         0x0100: [0x3E, 0x01,             # LD A, 0x01
+                                  0xE0, 0xFF,             # LDH (0xFF), A
+                                  0xFB,                   # EI
+                                  0x06, 0xFF,             # LD B, 0xFF     <-- frame
+                                  0x05,                   # DEC B          <-- work
+                                  0x0C,                   # INC C
+                                  0xC2, 0x07, 0x01,       # JP NZ, work
+                                  0x76,                   # HALT
+                                  0xC3, 0x05, 0x01]})     # JP frame
+    gameboys = [GameBoy(rom_file, translate=translate) for translate in (True, False)]
+    for gameboy in gameboys:
+        for _ in range(3):
+            gameboy.run_frame()
+
+    translated, interpreted = (gameboy.cpu for gameboy in gameboys)
+    assert translated.regs == interpreted.regs
+    assert gameboys[0].ppu.frames == gameboys[1].ppu.frames == 3
+
+    # Frames can only end between blocks, so the last one may overshoot a
+    # little further
+    assert 0 <= translated.cycles - 3 * CYCLES_PER_FRAME < 32 * 24
+
+def test_block_cache(tmp_path):
+    rom_file = rom_with(KITCHEN_SINK)
+    path = cache_path(str(tmp_path), rom_file, True)
+
+    cold = run_to_halt(rom_file, True, cache=path)
+    assert cold.translator.cache_hits == 0
+    assert cold.translator.save_cache(path)
+
+    warm = run_to_halt(rom_file, True, cache=path)
+    assert warm.translator.translated == 0
+    assert warm.translator.cache_hits == cold.translator.translated
+    assert_same_state(warm, cold)
+
+def test_block_cache_key(tmp_path):
+    rom_file = rom_with(KITCHEN_SINK)
+    path = cache_path('cache', rom_file, True)
+    assert path.startswith(os.path.join('cache', ''))
+    assert cache_path('cache', rom_file, True) == path
+    assert cache_path('cache', rom_file, False) != path
+
+    # The same ROM mapped by load_rom
+    rom_path = str(tmp_path / 'rom.gb')
+    rom_file.tofile(rom_path)
+    assert cache_path('cache', cartridge.load_rom(rom_path), True) == path
+
+    rom_file[0x0150] = 0x01
+    assert cache_path('cache', rom_file, True) != path
+
+def test_bad_block_cache_is_ignored(tmp_path):
+    rom_file = rom_with(KITCHEN_SINK)
+    path = str(tmp_path / 'blocks')
+    with open(path, 'wb') as fh:
+        fh.write(b'PYGBBLK')
+
+    cpu = CPU(MMU(rom_file), translate=True)
+    assert not cpu.translator.load_cache(path)
+    assert not cpu.translator.load_cache(str(tmp_path / 'missing'))
+    while not cpu.halted:
+        cpu.run_cycles(1000)
+    assert cpu.translator.translated > 0
+
+def test_work_ram_blocks_are_not_cached(tmp_path):
+    rom_file = rom_with({0x0100: [0x21, 0x00, 0xC0,      # LD HL, 0xC000
+                                  0x36, 0xC9,            # LD (HL), 0xC9 - RET
+                                  0x31, 0xFE, 0xFF,      # LD SP, 0xFFFE
+                                  0xCD, 0x00, 0xC0,      # CALL 0xC000
+                                  0x76]})                # HALT
+    path = str(tmp_path / 'blocks')
+    cpu = run_to_halt(rom_file, True)
+    assert (-1, 0xC000) in cpu.translator.blocks
+    cpu.translator.save_cache(path)
+
+    warm = run_to_halt(rom_file, True, cache=path)
+    assert warm.translator.translated == 1
+
+def test_game_boy_block_cache(tmp_path):
+    rom_file = rom_with(KITCHEN_SINK)
+    cold = GameBoy(rom_file, translate=True, block_cache=str(tmp_path))
+    cold.run_frame()
+    cold.save_block_cache()
+
+    warm = GameBoy(rom_file, translate=True, block_cache=str(tmp_path))
+    warm.run_frame()
+    assert warm.cpu.translator.translated == 0
+    assert warm.cpu.translator.cache_hits == cold.cpu.translator.translated
+    assert warm.cpu.regs == cold.cpu.regs
+
+    # Without translation there is nothing to cache
+    assert GameBoy(rom_file, block_cache=str(tmp_path)).block_cache_path is None
@@ -0,0 +1,157 @@
+import random
+import numpy as np
+import pytest
+from cpu import CPU
+from mmu import MMU
+from vector_cpu import VectorCPU, UNUSED_OPS
+
+# Places for (HL), (BC), (DE) and the operands to point at: work RAM, high
+# RAM, background map, character RAM and ROM.  The stack stays clear of
+# the interrupt enable register at 0xFFFF.
+ADDRESSES = [0xC123, 0xC000, 0xDFFF, 0xFF90, 0xFFFD, 0x9900, 0x8010, 0x0150]
+STACKS = [0xC123, 0xDFF0, 0xFF90, 0xFFF0]
+
+# Memory that is plain in both, as (address, size, MMU attribute)
+REGIONS = [(0xC000, 0x2000, 'WORK_RAM'), (0xFF80, 0x7F, 'HIGH_RAM'),
+           (0x9800, 0x400, 'BG_MAP_1'), (0x8000, 0x1800, 'CHAR_RAM')]
+
+# Opcodes addressing 0xFF00 plus their operand or C, kept in high RAM
+HIGH_OPS = [0xE0, 0xF0, 0xE2, 0xF2]
+
+STOPPING = [0x10, 0x76] + UNUSED_OPS
+
+
+def randomise(rng, cpu, vector, n):
+    # A random instruction at 0x0100 and random state, the same in an
+    # interpreting CPU and in instance n
+    op = rng.choice([op for op in range(0x100) if op not in STOPPING])
+    addr = rng.choice(ADDRESSES)
+    if op == 0xCB:
+        operands = [rng.randrange(0x100), 0, 0]
+    elif op in HIGH_OPS:
+        operands = [rng.randrange(0x80, 0xFF), 0, 0]
+    else:
+        low = rng.randrange(0x80, 0xFF) if addr >> 8 == 0xFF else rng.randrange(0x100)
+        operands = [low, addr >> 8, rng.randrange(0x100)]
+    code = [op] + operands
+    cpu.mmu.ROM[0x0100:0x0104] = code
+    vector.memory[n, 0x0100:0x0104] = code
+
+    cpu.regs[:] = rng.randbytes(8)
+    for pair in ('BC', 'DE', 'HL'):
+        cpu.set_reg_16(pair, rng.choice(ADDRESSES))
+    if op in HIGH_OPS:
+        cpu.set_reg_8('C', rng.randrange(0x80, 0xFF))
+    vector.regs[n] = list(cpu.regs)
+    cpu.sp = vector.sp[n] = rng.choice(STACKS)
+    cpu.pc = vector.pc[n] = 0x0100
+    cpu.cycles = vector.cycles[n] = 0
+    cpu.interrupt_master_enable = vector.interrupt_master_enable[n] = rng.random() < 0.5
+    for start, size, region in REGIONS:
+        fill = np.frombuffer(rng.randbytes(size), dtype=np.uint8)
+        getattr(cpu.mmu, region)[:] = fill
+        vector.memory[n, start:start + size] = fill
+    return code
+
+
+def state(cpu):
+    return (bytes(cpu.regs), cpu.pc, cpu.sp, cpu.cycles, cpu.interrupt_master_enable,
+            [bytes(getattr(cpu.mmu, region)) for _, _, region in REGIONS])
+
+
+def instance_state(vector, n):
+    return (bytes(vector.regs[n]), vector.pc[n], vector.sp[n], vector.cycles[n],
+            vector.interrupt_master_enable[n],
+            [bytes(vector.memory[n, start:start + size]) for start, size, _ in REGIONS])
+
+
+def test_instructions_match_interpreter():
+    # Instances each on a random instruction, CB-prefixed ones included,
+    # so one step dispatches to many opcode groups at once
+    rng = random.Random(25)
+    cpu = CPU(MMU(np.zeros(0x8000, dtype=np.uint8)))
+    vector = VectorCPU(np.zeros(0x8000, dtype=np.uint8), 64)
+    for _ in range(100):
+        expected = []
+        codes = []
+        for n in range(vector.count):
+            codes.append(randomise(rng, cpu, vector, n))
+            cpu.tick()
+            expected.append(state(cpu))
+        vector.tick()
+
+        for n, code in enumerate(codes):
+            assert instance_state(vector, n) == expected[n], [hex(byte) for byte in code]
+
+
+# Fills work RAM from 0xC000 with A, A + 1, ... for B bytes, then starts
+# over with A + 1
+FILL_LOOP = [0x21, 0x00, 0xC0,                      # LD HL, 0xC000 <-- start
+             0x22,                                  # LDI (HL), A   <-- loop
+             0x3C,                                  # INC A
+             0x05,                                  # DEC B
+             0x20, 0xFB,                            # JR NZ, loop
+             0xCB, 0x37,                            # SWAP A
+             0xC3, 0x00, 0x01]                      # JP start
+
+def fill_loop_rom():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0100 + len(FILL_LOOP)] = FILL_LOOP
+    return rom_file
+
+
+def test_run_cycles_matches_interpreter():
+    # Instances with different inputs leave the loop at different times
+    rom_file = fill_loop_rom()
+    vector = VectorCPU(rom_file, 16)
+    vector.set_reg_8('A', np.arange(16) * 7)
+    vector.set_reg_8('B', np.arange(16) * 13 + 1)
+    ran = vector.run_cycles(5000)
+
+    for n in range(vector.count):
+        cpu = CPU(MMU(rom_file))
+        cpu.set_reg_8('A', n * 7)
+        cpu.set_reg_8('B', n * 13 + 1)
+        assert ran[n] == cpu.run_cycles(5000)[0]
+        assert instance_state(vector, n) == state(cpu), n
+    assert vector.instructions > vector.dispatches
+
+
+def test_stopping():
+    # HALT and unused opcodes stop their instance only
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    vector = VectorCPU(rom_file, 3)
+    vector.memory[1, 0x0101] = 0x76                 # HALT
+    vector.memory[2, 0x0102] = 0xD3
+    vector.run_cycles(16)
+
+    assert list(vector.stopped) == [False, True, True]
+    assert list(vector.pc) == [0x0104, 0x0101, 0x0102]
+    assert list(vector.cycles) == [16, 4, 8]
+
+
+def test_rom_writes_dropped():
+    rom_file = np.zeros(0x8000, dtype=np.uint8)
+    rom_file[0x0100:0x0104] = [0x3E, 0x42,          # LD A, 0x42
+                               0xEA, 0x00]          # LD (0x2000), A
+    rom_file[0x0104] = 0x20
+    vector = VectorCPU(rom_file, 2)
+    vector.run_cycles(24)
+
+    assert (vector.memory[:, 0x2000] == 0).all()
+    assert (vector.get_reg_8('A') == 0x42).all()
+
+
+def test_registers():
+    vector = VectorCPU(np.zeros(0x8000, dtype=np.uint8), 4)
+    vector.set_reg_16('HL', np.array([0x1234, 0x5678, 0x9ABC, 0xDEF0]))
+    vector.set_reg_16('SP', 0xC000)
+
+    assert list(vector.get_reg_8('H')) == [0x12, 0x56, 0x9A, 0xDE]
+    assert list(vector.get_reg_16('HL')) == [0x1234, 0x5678, 0x9ABC, 0xDEF0]
+    assert list(vector.get_reg_16('SP')) == [0xC000] * 4
+
+
+def test_large_rom():
+    with pytest.raises(ValueError):
+        VectorCPU(np.zeros(0x10000, dtype=np.uint8), 4)